@@ -0,0 +1,58 @@
+#! /usr/bin/env python3
+
+'''cost of argument binding and expression tree building
+
+Times a single argument binding by :func:`nutils.util.binder` against
+:meth:`inspect.Signature.bind` with defaults applied, followed by the
+construction and simplification of a Navier-Stokes jacobian, which binds the
+arguments of every :class:`nutils.cache.Immutable` and every
+:class:`nutils.cache.Wrapper` call on its way. Run at different commits to
+compare, e.g.::
+
+    python3 benchmarks/binder.py --nelems=4 --nrepeat=20
+'''
+
+from nutils import mesh, cli, log, function, util
+import numpy, inspect, timeit
+
+
+def f(a, b, c=None, d=1):
+  pass
+
+
+def main(
+    nelems: 'number of elements per direction' = 4,
+    nrepeat: 'number of jacobian constructions' = 20,
+    ncalls: 'number of bindings' = 100000,
+  ):
+
+  # bind arguments
+  signature = inspect.signature(f)
+  bind = util.binder(signature)
+  def genericbind(*args, **kwargs):
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return bound.args
+  for name, func in ('binder', bind), ('signature', genericbind):
+    elapsed = timeit.timeit(lambda: func(1, 2, d=3), number=ncalls)
+    log.user('{} bind: {:.2f}us per call'.format(name, 1e6*elapsed/ncalls))
+
+  # build navier-stokes jacobian
+  domain, geom = mesh.rectilinear([numpy.linspace(0,1,nelems+1)] * 2)
+  ubasis, pbasis = function.chain([
+    domain.basis('std', degree=2).vector(2),
+    domain.basis('std', degree=1),
+  ])
+  def build():
+    dofs = function.Argument('dofs', [len(ubasis)])
+    u = ubasis.dot(dofs)
+    p = pbasis.dot(dofs)
+    res = domain.integral((ubasis.grad(geom) * (u.grad(geom)+u.grad(geom).T)).sum([-1,-2]) - ubasis.div(geom) * p + pbasis * u.div(geom), geometry=geom, degree=5)
+    res += domain.integral((ubasis * (u.grad(geom) * u).sum(-1)).sum(-1), geometry=geom, degree=5)
+    return [integrand.simplified for integrand in res.derivative('dofs')._integrands.values()]
+  elapsed = timeit.timeit(build, number=nrepeat)
+  log.user('jacobian: {:.3f}s per construction'.format(elapsed/nrepeat))
+
+
+if __name__ == '__main__':
+  cli.run(main)
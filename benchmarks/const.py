@@ -0,0 +1,48 @@
+#! /usr/bin/env python3
+
+'''cost of constructing, hashing and comparing large constant arrays
+
+Times the construction of a :class:`nutils.numeric.const` around an existing
+array, the first comparison of two distinct but equal arrays, which hashes
+both, and repeated comparisons of the same pair. The last timing builds a
+spline basis and Laplace matrix, whose evaluation is dominated by cached
+arrays. Run at different commits to compare, e.g.::
+
+    python3 benchmarks/const.py --size=10000000 --nelems=60
+'''
+
+from nutils import mesh, cli, log, function, numeric
+import numpy, timeit
+
+
+def main(
+    size: 'number of array elements' = 10000000,
+    ncalls: 'number of constructions and comparisons' = 1000,
+    nelems: 'number of elements per direction' = 60,
+  ):
+
+  base = numpy.random.RandomState(0).uniform(size=size)
+  elapsed = timeit.timeit(lambda: numeric.const(base, copy=False), number=ncalls)
+  log.user('construction: {:.2f}us'.format(1e6*elapsed/ncalls))
+
+  a = numeric.const(base)
+  b = numeric.const(base)
+  elapsed = timeit.timeit(lambda: a == b, number=1)
+  log.user('first comparison: {:.2f}ms'.format(1e3*elapsed))
+
+  a = numeric.const(base)
+  b = numeric.const(base)
+  a == b
+  elapsed = timeit.timeit(lambda: a == b, number=ncalls)
+  log.user('repeat comparison: {:.2f}us'.format(1e6*elapsed/ncalls))
+
+  def laplace():
+    domain, geom = mesh.rectilinear([numpy.linspace(0,1,nelems+1)] * 2)
+    basis = domain.basis('spline', degree=2)
+    return domain.integrate(function.outer(basis.grad(geom)).sum(-1), geometry=geom, ischeme='gauss4')
+  elapsed = timeit.timeit(laplace, number=1)
+  log.user('laplace matrix: {:.2f}s'.format(elapsed))
+
+
+if __name__ == '__main__':
+  cli.run(main)
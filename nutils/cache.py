@@ -11,76 +11,180 @@ The cache module.
 """
 
 from . import core, log, numeric, util
-import os, sys, numpy, functools, inspect, builtins
+import os, numpy, functools, inspect, builtins, collections.abc, weakref, threading, time, json, pickle, mmap, io, contextlib
+
+try:
+  import fcntl
+except ImportError: # not available on windows
+  fcntl = None
+
+_propertycounts = {} # functions returning hits, misses and elapsed time per cached property
 
 def property(f):
   _self = object()
   _temp = object()
   _name = f.__name__
+  # counts are closure variables, such that a hit costs a single increment;
+  # only misses are timed
+  hits = misses = 0
+  elapsed = 0.
   def property_getter(self):
+    nonlocal hits, misses, elapsed
     try:
       dictvalue = self.__dict__[_name]
       assert dictvalue is not _temp, 'attribute requested during construction'
     except KeyError:
       self.__dict__[_name] = _temp # placeholder for detection of cyclic dependencies
+      t0 = time.perf_counter()
       value = f(self)
+      elapsed += time.perf_counter() - t0
+      misses += 1
       self.__dict__[_name] = value if value is not self else _self
     else:
+      hits += 1
       value = dictvalue if dictvalue is not _self else self
     return value
+  _propertycounts.setdefault(_qualname(f), []).append(lambda: (hits, misses, elapsed))
   def property_setter(self, value):
     assert _name not in self.__dict__, 'property can be set only once'
     self.__dict__[_name] = value if value is not self else _self
   return builtins.property(fget=property_getter, fset=property_setter)
 
 class Wrapper:
-  'function decorator that caches results by arguments'
+  '''function decorator that caches results by arguments
+
+  The cache is optionally bounded to ``maxsize`` entries and/or ``maxbytes``
+  bytes of array data, in which case the least recently used entries are
+  evicted first. If ``minhitrate`` is specified, caching is disabled for good
+  when the fraction of calls that hit the cache is below this value after
+  ``probe`` calls. Usage is summarized in :attr:`stats` and collected by
+  :func:`statistics`.'''
 
-  def __init__( self, func ):
+  def __init__( self, func, maxsize=None, maxbytes=None, minhitrate=None, probe=1000 ):
     self.func = func
-    self.cache = {}
+    self.name = _qualname(func)
+    self.cache = collections.OrderedDict()
     self.count = 0
+    self.misses = 0
+    self.elapsed = 0.
+    self.nbytes = 0
+    self.nevicted = 0
+    self.enabled = True
+    self.maxsize = maxsize
+    self.maxbytes = maxbytes
+    self.minhitrate = minhitrate
+    self.probe = probe
     self.signature = inspect.signature(func)
+    self.bind = util.binder(self.signature) or self._bind
+    _wrappers.add(self)
 
-  def __call__( self, *args, **kwargs ):
-    self.count += 1
+  def __del__( self ):
+    try:
+      _addstats( _retired['functions'], self.name, self.stats, skip=_gauges )
+    except Exception: # module globals may be gone during interpreter shutdown
+      pass
+
+  def _bind( self, *args, **kwargs ):
     bound = self.signature.bind(*args, **kwargs)
     bound.apply_defaults()
-    args = bound.args
     assert not bound.kwargs
+    return bound.args
+
+  def __call__( self, *args, **kwargs ):
+    self.count += 1
+    args = self.bind(*args, **kwargs)
+    if not self.enabled:
+      self.misses += 1
+      return self.func(*args)
     try:
       value = self.cache[args]
     except KeyError:
+      self.misses += 1
+      t0 = time.perf_counter()
       value = self.func(*args)
+      self.elapsed += time.perf_counter() - t0
       self.cache[args] = value
+      self.nbytes += _nbytes(value)
+      self._evict()
+    else:
+      self.cache.move_to_end(args)
+    if self.count == self.probe and self.minhitrate is not None and self.hits < self.minhitrate * self.count:
+      self.disable()
     return value
 
+  def prune( self, condition ):
+    'remove the entries whose argument tuple satisfies condition'
+
+    for args in [ args for args in self.cache if condition( args ) ]:
+      self.nbytes -= _nbytes( self.cache.pop( args ) )
+
+  def _evict( self ):
+    while self.cache and ( self.maxsize is not None and len(self.cache) > self.maxsize or self.maxbytes is not None and self.nbytes > self.maxbytes ):
+      key, value = self.cache.popitem(last=False)
+      self.nbytes -= _nbytes(value)
+      self.nevicted += 1
+
+  def disable( self ):
+    'clear the cache and pass all further calls on to the function'
+
+    log.debug( 'disabling cache for {} at hit rate {}/{}'.format( self.name, self.hits, self.count ) )
+    self.cache.clear()
+    self.nbytes = 0
+    self.enabled = False
+
   @builtins.property
   def hits( self ):
-    return self.count - len(self.cache)
+    return self.count - self.misses
+
+  @builtins.property
+  def stats( self ):
+    'calls, hits, misses, evictions, bytes held and estimated seconds saved'
+
+    return dict( calls=self.count, hits=self.hits, misses=self.misses, evicted=self.nevicted, nbytes=self.nbytes, saved=_saved( self.hits, self.misses, self.elapsed ) )
 
 class WrapperCache:
-  'maintains a cache for Wrapper instances'
+  '''maintains a cache for Wrapper instances
 
-  def __init__( self ):
+  Keyword arguments are passed on to every :class:`Wrapper`.'''
+
+  def __init__( self, **wrapperargs ):
     self.cache = {}
+    self.wrapperargs = wrapperargs
 
   def __getitem__( self, func ):
     try:
       wrapper = self.cache[func]
     except KeyError:
-      wrapper = Wrapper(func)
+      wrapper = Wrapper(func, **self.wrapperargs)
       self.cache[func] = wrapper
     return wrapper
 
+  @builtins.property
+  def nbytes( self ):
+    return sum( wrapper.nbytes for wrapper in self.cache.values() )
+
   @builtins.property
   def stats( self ):
     hits = count = 0
     for wrapper in self.cache.values():
       hits += wrapper.hits
       count += wrapper.count
-    return 'not used' if not count \
-      else 'effectivity %d%% (hit %d/%d calls over %d functions)' % ( 100*hits/count, hits, count, len(self.cache) )
+    if not count:
+      return 'not used'
+    stats = 'effectivity %d%% (hit %d/%d calls over %d functions, %d bytes)' % ( 100*hits/count, hits, count, len(self.cache), self.nbytes )
+    ndisabled = sum( not wrapper.enabled for wrapper in self.cache.values() )
+    if ndisabled:
+      stats += ', disabled for %d functions' % ndisabled
+    return stats
+
+def _nbytes( value ):
+  'number of bytes of array data in value'
+
+  if isinstance( value, ( numpy.ndarray, numeric.const ) ):
+    return value.nbytes
+  if isinstance( value, ( tuple, list ) ):
+    return sum( _nbytes( item ) for item in value )
+  return 0
 
 class WrapperDummyCache( object ):
   'placeholder object'
@@ -91,8 +195,19 @@ class WrapperDummyCache( object ):
     return func
 
 class ImmutableMeta(type):
+  '''metaclass that interns instances by their constructor arguments
 
-  _cleanup_threshold = 1000 # number of new instances until next cleanup
+  Instances are held in a per-class table of weak references, such that equal
+  arguments yield the identical instance for as long as it is alive. The weak
+  reference callback removes the entry of a collected instance. The most
+  recently created instances are additionally kept alive in a bounded queue,
+  so that short-lived intermediates are reused together with their cached
+  properties. Insertion is locked, so that concurrent threads agree on a
+  single instance per key.'''
+
+  _lock = threading.Lock()
+  _keepalive = 1000 # number of recent instances kept alive per class
+  _classes = weakref.WeakSet()
 
   def __init__(cls, *args, **kwargs):
     super().__init__(*args, **kwargs)
@@ -100,12 +215,19 @@ class ImmutableMeta(type):
     param0, *params = signature.parameters.values()
     cls._signature = inspect.Signature(params)
     cls._annotations = [(param.name, param.annotation) for param in params if param.annotation != param.empty]
+    cls._bind = util.binder(cls._signature, cls._annotations)
     cls._cache = {}
+    cls._counts = [0, 0, 0.] # hits, misses, elapsed time
+    cls._recent = collections.deque(maxlen=cls._keepalive)
+    cls._uncache = functools.partial(_uncache, cls._cache)
     cls._init = cls.__init__
     if cls._annotations:
       cls.__init__ = util.enforcetypes(cls.__init__, signature)
+    ImmutableMeta._classes.add(cls)
 
   def __call__(cls, *args, **kwargs):
+    if cls._bind:
+      return cls._new(*cls._bind(*args, **kwargs))
     bound = cls._signature.bind(*args, **kwargs)
     bound.apply_defaults()
     for name, op in cls._annotations:
@@ -114,19 +236,125 @@ class ImmutableMeta(type):
     return cls._new(*bound.args)
 
   def _new(cls, *args):
-    try:
-      self = cls._cache[args]
-    except KeyError:
-      self = cls.__new__(cls)
-      self._args = args
-      self._hash = hash(args)
-      self._init(*args)
-      cls._cache[args] = self
-      if len(cls._cache) > cls._cleanup_threshold:
-        cls._cache = {key: value for key, value in cls._cache.items() if sys.getrefcount(value) > 4}
-        cls._cleanup_threshold = ImmutableMeta._cleanup_threshold + len(cls._cache)
+    ref = cls._cache.get(args)
+    if ref is not None:
+      self = ref()
+      if self is not None:
+        cls._counts[0] += 1
+        return self
+    cls._counts[1] += 1
+    t0 = time.perf_counter()
+    self = cls.__new__(cls)
+    self._args = args
+    self._hash = hash(args)
+    self._init(*args)
+    cls._counts[2] += time.perf_counter() - t0
+    with ImmutableMeta._lock:
+      ref = cls._cache.get(args)
+      existing = ref and ref()
+      if existing is not None: # constructed concurrently
+        return existing
+      cls._cache[args] = _KeyedRef(self, cls._uncache, args)
+      cls._recent.append(self)
+    return self
+
+  @builtins.property
+  def internstats(cls):
+    'number of live instances, and of hits and misses of the intern table'
+
+    hits, misses, elapsed = cls._counts
+    return dict(live=len(cls._cache), hits=hits, misses=misses)
+
+_wrappers = weakref.WeakSet() # live Wrapper instances
+_retired = { 'functions': {}, 'classes': {}, 'properties': {} } # counts of collected wrappers and child processes
+_gauges = 'nbytes', 'live' # statistics that are not accumulated
+
+def statistics( since=None ):
+  '''structured usage statistics of all caches
+
+  Returns a dictionary with categories ``functions`` (:class:`Wrapper`
+  instances, grouped by function name), ``classes`` (interning of
+  :class:`Immutable` subclasses) and ``properties`` (:func:`property`
+  values), each mapping names to dictionaries of counts. The ``saved`` entry
+  estimates the number of seconds saved by cache hits from the average time of
+  a miss. If ``since`` is a previously obtained statistics dictionary, only
+  the counts accumulated since are returned.'''
+
+  stats = { category: { name: dict(values) for name, values in items.items() } for category, items in _retired.items() }
+  for wrapper in list(_wrappers):
+    _addstats( stats['functions'], wrapper.name, wrapper.stats )
+  for cls in list(ImmutableMeta._classes):
+    hits, misses, elapsed = cls._counts
+    if hits or misses:
+      _addstats( stats['classes'], _qualname(cls), dict( cls.internstats, saved=_saved( hits, misses, elapsed ) ) )
+  for name, counts in _propertycounts.items():
+    hits, misses, elapsed = map(sum, zip(*[ getcounts() for getcounts in counts ]))
+    if hits or misses:
+      _addstats( stats['properties'], name, dict( hits=hits, misses=misses, saved=_saved( hits, misses, elapsed ) ) )
+  if since is not None:
+    for category, items in since.items():
+      for name, values in items.items():
+        _addstats( stats[category], name, { key: -value for key, value in values.items() }, skip=_gauges )
+  return stats
+
+def mergestats( stats ):
+  '''add counts from a statistics dictionary to the totals
+
+  Used to accumulate the statistics of forked child processes; see
+  :func:`nutils.parallel.pariter`.'''
+
+  for category, items in stats.items():
+    for name, values in items.items():
+      _addstats( _retired[category], name, values, skip=_gauges )
+
+def writestats( name='cachestats.json' ):
+  '''write :func:`statistics` as JSON to the output directory'''
+
+  stats = statistics()
+  for category, items in sorted( stats.items() ):
+    hits = sum( values['hits'] for values in items.values() )
+    misses = sum( values['misses'] for values in items.values() )
+    saved = sum( values['saved'] for values in items.values() )
+    log.info( '{}: hit {}/{} over {} caches, saved {:.1f}s'.format( category, hits, hits+misses, len(items), saved ) )
+  with core.open_in_outdir( name, 'w' ) as f:
+    json.dump( stats, f, indent=2, sort_keys=True )
+
+def _addstats( items, name, values, skip=() ):
+  current = items.setdefault( name, {} )
+  for key, value in values.items():
+    if key not in skip:
+      current[key] = current.get( key, 0 ) + value
+
+def _saved( hits, misses, elapsed ):
+  'estimated time saved by hits, based on the average time of a miss'
+
+  return hits * elapsed / misses if misses else 0.
+
+def _qualname( obj ):
+  func = getattr( obj, '__func__', obj ) # bound methods
+  if not hasattr( func, '__qualname__' ):
+    func = type(func)
+  return '{}.{}'.format( func.__module__, func.__qualname__ )
+
+class _KeyedRef(weakref.ref):
+  'weak reference that holds the key of its intern table entry'
+
+  __slots__ = 'key',
+
+  def __new__(cls, obj, callback, key):
+    self = super().__new__(cls, obj, callback)
+    self.key = key
     return self
 
+  def __init__(self, obj, callback, key):
+    super().__init__(obj, callback)
+
+def _uncache(cache, ref):
+  'weak reference callback that removes a collected instance'
+
+  if cache.get(ref.key) is ref:
+    del cache[ref.key]
+
 class Immutable(metaclass=ImmutableMeta):
 
   def __init__( self ):
@@ -150,62 +378,403 @@ class Immutable(metaclass=ImmutableMeta):
   def edit(self, op):
     return self.__class__(*[op(arg) for arg in self._args])
 
+class _Pickler( pickle.Pickler ):
+  '''pickler that moves large constant arrays out of band
+
+  Every :class:`nutils.numeric.const` of at least ``minbytes`` bytes is
+  replaced by an index into the ``buffers`` list, where equal arrays share a
+  single entry.'''
+
+  minbytes = 1024
+
+  def __init__( self, file, buffers ):
+    super().__init__( file, pickle.HIGHEST_PROTOCOL )
+    self.buffers = buffers
+    self.index = {}
+
+  def persistent_id( self, obj ):
+    if type(obj) is not numeric.const or obj.dtype.hasobject or obj.size * obj.dtype.itemsize < self.minbytes:
+      return None
+    try:
+      return self.index[obj]
+    except KeyError:
+      pass
+    index = self.index[obj] = len( self.buffers )
+    self.buffers.append( numpy.ascontiguousarray( obj ).reshape( obj.shape ) )
+    return index
+
+def _dump( obj, f, align=64 ):
+  '''write obj to file, with its large constant arrays as raw aligned data
+
+  The file starts with a pickle of the object graph and the layout of the
+  arrays, which follow as raw data such that :func:`_load` can map them into
+  memory rather than reading them.'''
+
+  buffers = []
+  graph = io.BytesIO()
+  _Pickler( graph, buffers ).dump( obj )
+  layout = []
+  offset = 0
+  for array in buffers:
+    layout.append(( array.dtype, array.shape, offset ))
+    offset += -array.nbytes % align + array.nbytes
+  pickle.dump( ( graph.getvalue(), layout ), f, pickle.HIGHEST_PROTOCOL )
+  f.write( b'\0' * ( -f.tell() % align ) )
+  for array in buffers:
+    f.write( array.data )
+    f.write( b'\0' * ( -array.nbytes % align ) )
+
+def _load( f, align=64 ):
+  '''load object from a file written by :func:`_dump`, mapping arrays read-only'''
+
+  graph, layout = pickle.load( f )
+  buffers = []
+  if layout:
+    start = -f.tell() % align + f.tell()
+    data = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+    for dtype, shape, offset in layout:
+      array = numpy.frombuffer( data, dtype, count=numpy.prod( shape, dtype=int ), offset=start+offset ).reshape( shape )
+      buffers.append( numeric.const( array, copy=False ) )
+  unpickler = pickle.Unpickler( io.BytesIO( graph ) )
+  unpickler.persistent_load = buffers.__getitem__
+  return unpickler.load()
+
 class FileCache( object ):
-  'cache'
+  '''content addressed on-disk cache
+
+  Stores the results of function calls in the ``filecache`` subdirectory of
+  the cache directory, under a namespace defined by the constructor arguments.
+  Every result is keyed by the md5 digest of the identity of the function,
+  including its bytecode, and its arguments, such that results are found
+  irrespective of the order of calls. Numpy arrays are stored as ``.npy``
+  files that are memory mapped read-only on retrieval; other results are
+  pickled, with large constant arrays stored out of band and likewise mapped.
+  Entries are locked while they are computed, such that concurrent runs
+  compute every entry only once. Retrieved entries have their modification
+  time updated, and least recently used entries are evicted when the total
+  size of the store exceeds the ``cachesize`` property (bytes, default 1GB).
+  The size is measured on the first write and estimated from the written
+  entries after that, such that the store is scanned again only when the
+  estimate exceeds the limit.'''
 
   def __init__( self, *args ):
     'constructor'
 
-    import os, numpy, hashlib, pickle
+    import hashlib, pickle
     serial = pickle.dumps( args, -1 )
     self.myhash = hash( serial )
-    hexhash = hashlib.md5(serial).hexdigest()
-    cachedir = core.getprop( 'cachedir', 'cache' )
-    if not os.path.exists( cachedir ):
-      os.makedirs( cachedir )
-    path = os.path.join( cachedir, hexhash )
-    if not os.path.isfile( path ) or core.getprop( 'recache', False ):
-      log.info( 'starting new cache:', hexhash )
-      data = open( path, 'wb+' )
-      data.write( serial )
-      data.flush()
-    else:
-      log.info( 'continuing from cache:', hexhash )
-      data = open( path, 'ab+' )
-      data.seek(0)
-      recovered_args = pickle.load( data )
-      assert recovered_args == args, 'hash clash'
-    self.data = data
+    self.root = os.path.join( core.getprop( 'cachedir', 'cache' ), 'filecache' )
+    self.path = os.path.join( self.root, hashlib.md5( serial ).hexdigest() )
+    self.size = None # estimated size of the store in bytes
+    os.makedirs( self.path, exist_ok=True )
+    log.info( 'using file cache:', os.path.basename( self.path ) )
+
+  def _key( self, func, args, kwargs ):
+    import hashlib, pickle
+    code = getattr( func, '__code__', None )
+    identity = getattr( func, '__module__', None ), getattr( func, '__qualname__', repr(func) ), code and _codeidentity( code )
+    return hashlib.md5( pickle.dumps( ( identity, args, sorted( kwargs.items() ) ), -1 ) ).hexdigest()
 
   def __call__( self, func, *args, **kwargs ):
     'call'
 
-    try:
-      import cPickle as pickle
-    except ImportError:
-      import pickle
     name = func.__name__ + ''.join( ' %s' % arg for arg in args ) + ''.join( ' %s=%s' % item for item in kwargs.items() )
-    pos = self.data.tell()
-    try:
-      data = pickle.load( self.data )
-    except EOFError:
-      data = func( *args, **kwargs)
-      self.data.seek( pos )
-      pickle.dump( data, self.data, -1 )
-      self.data.flush()
-      msg = 'written to'
+    key = self._key( func, args, kwargs )
+    path = os.path.join( self.path, key )
+    with _lock( path + '.lock', remove=True ):
+      for ext in '.npy', '.pkl':
+        if os.path.isfile( path + ext ) and not core.getprop( 'recache', False ):
+          os.utime( path + ext )
+          if ext == '.npy':
+            data = numpy.load( path + ext, mmap_mode='r' )
+          else:
+            with open( path + ext, 'rb' ) as f:
+              data = _load( f )
+          log.info( 'loaded from cache:', name, '[%db]' % os.path.getsize( path + ext ) )
+          return data
+      data = func( *args, **kwargs )
+      ext = '.npy' if isinstance( data, numpy.ndarray ) and not data.dtype.hasobject else '.pkl'
+      tmp = path + '.tmp'
+      with open( tmp, 'wb' ) as f:
+        if ext == '.npy':
+          numpy.save( f, data )
+        else:
+          _dump( data, f )
+      os.replace( tmp, path + ext )
+      nbytes = os.path.getsize( path + ext )
+      log.info( 'written to cache:', name, '[%db]' % nbytes )
+    if self.size is None or self.size + nbytes > core.getprop( 'cachesize', 2**30 ):
+      self.evict()
     else:
-      msg = 'loaded from'
-    log.info( msg, 'cache:', name, '[%db]' % (self.data.tell()-pos) )
+      self.size += nbytes
     return data
 
+  def evict( self, maxsize=None ):
+    'remove least recently used entries until the store fits in maxsize bytes'
+
+    if maxsize is None:
+      maxsize = core.getprop( 'cachesize', 2**30 )
+    with _lock( os.path.join( self.root, '.lock' ) ):
+      entries = []
+      for dirpath, dirnames, filenames in os.walk( self.root ):
+        for filename in filenames:
+          if filename.endswith( ('.npy','.pkl') ):
+            stat = os.stat( os.path.join( dirpath, filename ) )
+            entries.append(( stat.st_mtime, stat.st_size, os.path.join( dirpath, filename ) ))
+      size = sum( entry[1] for entry in entries )
+      for mtime, nbytes, path in sorted( entries ):
+        if size <= maxsize:
+          break
+        log.info( 'evicting from cache:', os.path.basename( path ) )
+        os.remove( path )
+        size -= nbytes
+      self.size = size
+
   def truncate( self ):
+    'remove all entries of this cache'
+
     log.info( 'truncating cache' )
-    self.data.truncate()
+    for filename in os.listdir( self.path ):
+      if filename.endswith( ('.npy','.pkl') ):
+        os.remove( os.path.join( self.path, filename ) )
+    self.size = None
 
   def __hash__( self ):
     return self.myhash
 
+def _codeidentity( code ):
+  'picklable representation of a code object and the code objects it contains'
+
+  consts = tuple( _codeidentity( const ) if inspect.iscode( const ) else const for const in code.co_consts )
+  return code.co_code, code.co_names, consts
+
+class _lock( object ):
+  '''exclusive lock on a file, shared between processes where fcntl is available
+
+  If ``remove`` is true the file is removed on release. A process that was
+  waiting for the lock then finds its file unlinked and retries on a new one.'''
+
+  def __init__( self, path, remove=False ):
+    self.path = path
+    self.remove = remove
+
+  def __enter__( self ):
+    while True:
+      self.file = open( self.path, 'a' )
+      if not fcntl:
+        return self
+      fcntl.flock( self.file, fcntl.LOCK_EX )
+      try:
+        if os.path.samestat( os.fstat( self.file.fileno() ), os.stat( self.path ) ):
+          return self
+      except FileNotFoundError:
+        pass
+      self.file.close()
+
+  def __exit__( self, *exc ):
+    if fcntl:
+      if self.remove: # while locked, such that no other process holds the path
+        os.remove( self.path )
+      fcntl.flock( self.file, fcntl.LOCK_UN )
+    self.file.close()
+    if self.remove and not fcntl: # files that are open cannot be removed on windows
+      with contextlib.suppress( OSError ):
+        os.remove( self.path )
+
+def digest( obj ):
+  '''md5 hex digest of the structure of obj
+
+  Unlike a digest of the pickled object, the result does not depend on which
+  equal subobjects are shared, nor on the iteration order of sets, such that
+  it is reproducible across runs. Objects with a ``_persistkey`` attribute are
+  represented by its value, which must not be None.'''
+
+  return _digest( obj, {} ).hex()
+
+def _digest( obj, memo ):
+  import hashlib, pickle
+  try:
+    return memo[id(obj)][1]
+  except KeyError:
+    pass
+  h = hashlib.md5( type(obj).__qualname__.encode() )
+  if hasattr( obj, '_persistkey' ) and not isinstance( obj, type ):
+    if obj._persistkey is None:
+      raise ValueError( '{} has no persistent key'.format( type(obj).__name__ ) )
+    h.update( _digest( obj._persistkey, memo ) )
+  elif obj is None or obj is Ellipsis or isinstance( obj, ( str, bytes, int, float, complex ) ):
+    h.update( repr(obj).encode() )
+  elif isinstance( obj, numeric.const ) and obj.digest is not None:
+    h.update( repr( obj.dtype.descr ).encode() + obj.digest )
+  elif isinstance( obj, ( numpy.ndarray, numpy.generic, numeric.const ) ):
+    array = numpy.asarray( obj )
+    h.update( repr(( array.dtype.descr, array.shape )).encode() )
+    if array.dtype.hasobject:
+      for item in array.flat:
+        h.update( _digest( item, memo ) )
+    else:
+      h.update( numpy.ascontiguousarray( array ).data )
+  elif isinstance( obj, numpy.dtype ):
+    h.update( repr(obj.descr).encode() )
+  elif isinstance( obj, ( tuple, list ) ):
+    for item in obj:
+      h.update( _digest( item, memo ) )
+  elif isinstance( obj, ( dict, set, frozenset ) ):
+    items = [ _digest( item, memo ) for item in ( obj.items() if isinstance( obj, dict ) else obj ) ]
+    for item in sorted( items ):
+      h.update( item )
+  elif isinstance( obj, type ) or inspect.isfunction( obj ) or inspect.isbuiltin( obj ):
+    h.update( pickle.dumps( obj, -1 ) ) # by reference
+  elif inspect.ismethod( obj ):
+    h.update( _digest( ( obj.__self__, obj.__name__ ), memo ) )
+  else:
+    reduced = obj.__reduce_ex__( 4 )
+    h.update( _digest( reduced if isinstance( reduced, str ) else tuple( item if not isinstance( item, collections.abc.Iterator ) else list( item ) for item in reduced ), memo ) )
+  value = h.digest()
+  memo[id(obj)] = obj, value # keep obj alive to keep its id unique
+  return value
+
+def persist( name, key, compute ):
+  '''retrieve or compute a value that is stored on disk across runs
+
+  Stores the result of ``compute()`` in the ``name`` subdirectory of the
+  cache directory, under the digest of ``key`` and the nutils version (see
+  :func:`digest`). Large constant arrays in the value are stored as raw data
+  that is memory mapped on retrieval. Files are written atomically, such that
+  concurrent runs and worker processes share the store. If ``key`` cannot be digested or the value
+  cannot be pickled the value is computed without storing.'''
+
+  from . import version
+  try:
+    hexdigest = digest( ( version, key ) )
+  except Exception as e: # unsupported or too deeply nested
+    log.debug( 'cannot persist {}: {}'.format( name, e ) )
+    return compute()
+  path = os.path.join( core.getprop( 'cachedir', 'cache' ), name, hexdigest )
+  if os.path.isfile( path ) and not core.getprop( 'recache', False ):
+    try:
+      with open( path, 'rb' ) as f:
+        value = _load( f )
+    except Exception as e:
+      log.warning( 'failed to load {} from cache: {}'.format( name, e ) )
+    else:
+      log.debug( 'loaded {} from cache: {}'.format( name, hexdigest ) )
+      return value
+  value = compute()
+  os.makedirs( os.path.dirname( path ), exist_ok=True )
+  tmp = '{}.{}.tmp'.format( path, os.getpid() )
+  try:
+    with open( tmp, 'wb' ) as f:
+      _dump( value, f )
+  except Exception as e:
+    with contextlib.suppress( FileNotFoundError ):
+      os.remove( tmp )
+    log.debug( 'cannot persist {}: {}'.format( name, e ) )
+    return value
+  os.replace( tmp, path )
+  log.debug( 'written {} to cache: {}'.format( name, hexdigest ) )
+  return value
+
+def persistent( name, prop, files=() ):
+  '''decorator that stores results across runs with :func:`persist`
+
+  Storage is active if property ``prop`` is set. Results are keyed by the
+  qualified name of the function and its arguments. Arguments listed in
+  ``files`` are file names or iterables of lines, which are keyed by their
+  content. Arguments with a ``_persistkey`` attribute, such as topologies, are
+  keyed by its value; if any of these is None the result is computed without
+  storing. Results with a ``_persistkey`` attribute, or tuples thereof, have
+  the attribute set to their own key, such that derived results can be
+  persisted in turn.'''
+
+  def wrapper( func ):
+    signature = inspect.signature( func )
+    @functools.wraps( func )
+    def wrapped( *args, **kwargs ):
+      if not core.getprop( prop, False ):
+        return func( *args, **kwargs )
+      bound = signature.bind( *args, **kwargs )
+      bound.apply_defaults()
+      key = [ _qualname( func ) ]
+      for argname, value in bound.arguments.items():
+        if argname in files:
+          if isinstance( value, str ):
+            with open( value, 'rb' ) as f:
+              value = f.read()
+          else:
+            bound.arguments[argname] = value = tuple( value )
+        elif hasattr( value, '_persistkey' ):
+          value = value._persistkey
+          if value is None:
+            return func( *args, **kwargs )
+        key.append(( argname, value ))
+      key = tuple( key )
+      value = persist( name, key, functools.partial( func, *bound.args, **bound.kwargs ) )
+      for item in value if isinstance( value, tuple ) else [ value ]:
+        if hasattr( item, '_persistkey' ):
+          item._persistkey = key
+      return value
+    return wrapped
+  return wrapper
+
+class Checkpoint( object ):
+  '''double buffered store for restarting iterative procedures
+
+  Holds a state of named float arrays of fixed shape, plus an integer
+  counter, in a memory mapped file in the cache directory. Saves alternate
+  between two slots; a slot becomes valid by writing its sequence number
+  after its data, so an interrupted save leaves the other slot intact.
+  Loading reads only the latest slot, independent of the number of saves.
+  The optional ``key`` string identifies the problem that is solved; an
+  existing checkpoint that was saved under a different key is discarded.'''
+
+  def __init__( self, name, key=None, **shapes ):
+    'constructor'
+
+    import hashlib
+    self.dtype = numpy.dtype( [ ('seq',numpy.int64), ('counter',numpy.int64) ] + [ (item,float,tuple(shape)) for item, shape in sorted( shapes.items() ) ] )
+    header = b'NUTILSCP' + hashlib.md5( str(self.dtype.descr).encode() + ( key or '' ).encode() ).digest()[:8]
+    cachedir = core.getprop( 'cachedir', 'cache' )
+    if not os.path.exists( cachedir ):
+      os.makedirs( cachedir )
+    path = os.path.join( cachedir, name )
+    if not os.path.isfile( path ) or os.path.getsize( path ) != len(header) + 2 * self.dtype.itemsize or core.getprop( 'recache', False ):
+      iscompatible = False
+    else:
+      with open( path, 'rb' ) as f:
+        iscompatible = f.read( len(header) ) == header
+    if not iscompatible:
+      log.info( 'starting new checkpoint:', name )
+      with open( path, 'wb' ) as f:
+        f.write( header )
+        f.write( numpy.zeros( 2, dtype=self.dtype ).tobytes() )
+    self.slots = numpy.memmap( path, dtype=self.dtype, mode='r+', offset=len(header), shape=(2,) )
+    self.seq = int( self.slots['seq'].max() )
+
+  def save( self, counter, **state ):
+    'write state to the oldest slot'
+
+    assert sorted( state ) == sorted( self.dtype.names[2:] ), 'incomplete state'
+    seq = self.seq + 1
+    islot = seq % 2
+    self.slots['counter'][islot] = counter
+    for key, value in state.items():
+      self.slots[key][islot] = value
+    self.slots.flush()
+    self.slots['seq'][islot] = seq
+    self.slots.flush()
+    self.seq = seq
+
+  def load( self ):
+    'return counter and state of the latest slot, or None if nothing was saved'
+
+    if not self.seq:
+      return None
+    islot = self.seq % 2
+    counter = int( self.slots['counter'][islot] )
+    log.info( 'resuming from checkpoint at', counter )
+    return counter, { key: numpy.array( self.slots[key][islot] ) for key in self.dtype.names[2:] }
+
 class Tuple( object ):
   unknown = object()
   def __init__( self, items, getitem, start=0, stride=1 ):
@@ -12,7 +12,7 @@ can be used set up properties, initiate an output environment, and execute a
 python function based arguments specified on the command line.
 """
 
-from . import log, core, version
+from . import log, core, version, cache
 import sys, inspect, os, datetime, argparse, pdb, signal, subprocess, pathlib, contextlib
 
 def _version():
@@ -94,6 +94,10 @@ def choose(*functions, cmd=True, args=None, scriptname=None):
   parser.add_argument( '--symlink', type=str, metavar='STR', default=core.globalproperties['symlink'], help='create symlink to latest results' )
   parser.add_argument( '--recache', type=_bool, nargs='?', const=True, metavar='BOOL', default=core.globalproperties['recache'], help='overwrite existing cache' )
   parser.add_argument( '--dot', type=str, metavar='STR', default=core.globalproperties['dot'], help='graphviz executable' )
+  parser.add_argument( '--telemetry', type=_bool, nargs='?', const=True, metavar='BOOL', default=core.globalproperties['telemetry'], help='write solver telemetry to telemetry.jsonl' )
+  parser.add_argument( '--treecache', type=_bool, nargs='?', const=True, metavar='BOOL', default=core.globalproperties['treecache'], help='cache simplified integrands on disk' )
+  parser.add_argument( '--cachestats', type=_bool, nargs='?', const=True, metavar='BOOL', default=core.globalproperties['cachestats'], help='write cache statistics to cachestats.json' )
+  parser.add_argument( '--topocache', type=_bool, nargs='?', const=True, metavar='BOOL', default=core.globalproperties['topocache'], help='cache topologies and bases on disk' )
   parser.add_argument( '--selfcheck', type=_bool, nargs='?', const=True, metavar='BOOL', default=core.globalproperties['selfcheck'], help='active self checks (slow!)' )
   if cmd:
     subparsers = parser.add_subparsers( dest='command', help='command (add -h for command-specific help)' )
@@ -123,6 +127,10 @@ def choose(*functions, cmd=True, args=None, scriptname=None):
   __imagetype__ = ns.imagetype
   __symlink__ = ns.symlink
   __recache__ = ns.recache
+  __telemetry__ = ns.telemetry
+  __treecache__ = ns.treecache
+  __cachestats__ = ns.cachestats
+  __topocache__ = ns.topocache
   __dot__ = ns.dot
   __selfcheck__ = ns.selfcheck
 
@@ -198,6 +206,10 @@ def call( func, **kwargs ):
         log.info( 'finish {}'.format( endtime.ctime() ) )
         log.info( 'elapsed {:.0f}:{:02.0f}:{:02.0f}'.format( hours, minutes, seconds ) )
 
+        if core.getprop( 'cachestats', False ):
+          log.info( '' )
+          cache.writestats()
+
     except (KeyboardInterrupt,SystemExit,pdb.bdb.BdbQuit):
       return 1
     except:
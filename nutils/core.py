@@ -27,6 +27,10 @@ globalproperties = {
   'dot': False,
   'profile': False,
   'selfcheck': False,
+  'telemetry': False,
+  'treecache': False,
+  'cachestats': False,
+  'topocache': False,
 }
 
 if os.access( '/run/shm', os.W_OK ):
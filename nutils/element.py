@@ -17,7 +17,7 @@ purposes of integration and sampling.
 """
 
 from . import log, util, numpy, core, numeric, function, cache, transform, _
-import re, warnings, math
+import re, warnings, math, weakref
 
 
 ## ELEMENT
@@ -1479,6 +1479,34 @@ class StdElem( cache.Immutable ):
 
     return ExtractionWrapper( self, extraction )
 
+  def tabulate( self, points, grad=0 ):
+    '''evaluate via the global store of tabulations
+
+    Returns values equal to ``eval(points, grad)``, which are retained for
+    constant (reference) points in a store that is shared by all evaluations,
+    and by forked processes. The store references elements weakly and drops
+    their values when they are collected. The retained values are read-only;
+    callers that modify the result in place should use ``eval`` instead, which
+    returns a private, writeable array.'''
+
+    if not isinstance( points, numeric.const ):
+      return self.eval( points, grad )
+    ref = weakref.ref( self ) # the same object for as long as self is alive
+    if self not in _tabulated:
+      _tabulated.add( self )
+      weakref.finalize( self, _tabulations.prune, lambda args: args[0] is ref ).atexit = False
+    return _tabulations( ref, points, grad )
+
+def _tabulate( ref, points, grad ):
+  values = ref().eval( points, grad )
+  if isinstance( values, numpy.ndarray ):
+    values = values.view() # leaves arrays that eval may share writeable
+    values.flags.writeable = False
+  return values
+
+_tabulations = cache.Wrapper( _tabulate, maxbytes=2**26 )
+_tabulated = weakref.WeakSet() # elements with values in _tabulations
+
 class PolyProduct( StdElem ):
   'multiply standard elements'
 
@@ -1507,8 +1535,8 @@ class PolyProduct( StdElem ):
     N = numpy.newaxis,
 
     shape = points.shape[:-1] + (self.std1.nshapes * self.std2.nshapes,)
-    G12 = [ ( self.std1.eval( p1, grad=i )[E+S+N+S*i+N*j]
-            * self.std2.eval( p2, grad=j )[E+N+S+N*i+S*j] ).reshape( shape + (self.std1.ndims,) * i + (self.std2.ndims,) * j )
+    G12 = [ ( self.std1.tabulate( p1, grad=i )[E+S+N+S*i+N*j]
+            * self.std2.tabulate( p2, grad=j )[E+N+S+N*i+S*j] ).reshape( shape + (self.std1.ndims,) * i + (self.std2.ndims,) * j )
             for i,j in zip( range(grad,-1,-1), range(grad+1) ) ]
 
     data = numpy.empty( shape + (self.ndims,) * grad )
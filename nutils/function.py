@@ -123,6 +123,34 @@ class Evaluable( cache.Immutable ):
       values.append(retval)
     return values[-1]
 
+  def evalensemble(self, ensemble, **evalargs):
+    '''evaluate for a sequence of argument mappings
+
+    Operations that do not depend on any :class:`Argument` are evaluated once
+    and shared between all members of ``ensemble``. Returns a list of values,
+    one for every member.'''
+
+    values = [evalargs]
+    isensemble = [False]
+    for op, indices in self.serialized:
+      dependsonarguments = isinstance(op, Argument) or any(isensemble[i] for i in indices)
+      try:
+        if isinstance(op, Argument):
+          retval = [op.evalf(arguments) for arguments in ensemble]
+        elif dependsonarguments:
+          retval = [op.evalf(*[values[i][m] if isensemble[i] else values[i] for i in indices]) for m in range(len(ensemble))]
+        else:
+          retval = op.evalf(*[values[i] for i in indices])
+      except KeyboardInterrupt:
+        raise
+      except:
+        etype, evalue, traceback = sys.exc_info()
+        excargs = etype, evalue, self, values
+        raise EvaluationError(*excargs).with_traceback(traceback)
+      values.append(retval)
+      isensemble.append(dependsonarguments)
+    return values[-1] if isensemble[-1] else [values[-1]] * len(ensemble)
+
   @log.title
   def graphviz( self ):
     'create function graph'
@@ -945,7 +973,9 @@ class Function( Array ):
     tail = trans[self.depth:]
     if tail:
       points = cache[transform.apply](tail, points)
-    fvals = cache[self.stds[index].eval](points, self.ndim-1)
+      fvals = cache[self.stds[index].eval](points, self.ndim-1)
+    else:
+      fvals = self.stds[index].tabulate(points, self.ndim-1)
     assert fvals.ndim == self.ndim+1
     if tail:
       for i, ndims in enumerate(self.shape[1:]):
@@ -14,8 +14,8 @@ solving linear systems. Matrices can be converted to numpy arrays via
 ``toarray`` or scipy matrices via ``toscipy``.
 """
 
-from . import util, numpy, log, numeric
-import functools
+from . import util, numpy, log, numeric, cache, _
+import functools, itertools, time
 
 
 class SolverInfo ( object ):
@@ -23,6 +23,7 @@ class SolverInfo ( object ):
 
   def __init__ ( self, tol, callback=None ):
     self.niter = 0
+    self.timings = {}
     self._res = numpy.empty( 16 )
     self._tol = tol
     self._callback = callback
@@ -63,31 +64,70 @@ class Matrix( object ):
   def size( self ):
     return numpy.prod( self.shape )
 
-  def cond( self, constrain=None, lconstrain=None, rconstrain=None ):
-    'condition number'
-
-    x, I, J = parsecons( constrain, lconstrain, rconstrain, self.shape )
-    matrix = self.toarray()[numpy.ix_(I,J)]
-    return numpy.linalg.cond( matrix )
-
-  def res( self, x, b=0, constrain=None, lconstrain=None, rconstrain=None, scaled=True ):
-    'residual'
-
-    x0, I, J = parsecons( constrain, lconstrain, rconstrain, self.shape )
-    res = numpy.linalg.norm( (self.matvec(x)-b)[I] )
-    if scaled:
-      res /= numpy.linalg.norm( (self.matvec(x0)-b)[I] )
-    return res
-
   def clone( self ):
     warnings.warn( 'warning: arrays are immutable; clone returns self for backwards compatibility', DeprecationWarning )
     return self
 
+class Restriction( object ):
+  '''sparse matrix restricted to a subset of rows and columns
+
+  Represents ``core[I,:][:,J]`` for boolean masks ``I`` and ``J`` without
+  copying data. Matrix-vector products and the diagonal are formed directly
+  from ``core`` through the index maps ``rows`` and ``cols``. The restricted
+  csr matrix, required by direct solvers and preconditioners, is built
+  lazily, in a single pass over the selected rows, and kept for reuse.'''
+
+  def __init__( self, core, I, J ):
+    self.core = core
+    self.rows, = I.nonzero()
+    self.cols, = J.nonzero()
+    self.shape = len(self.rows), len(self.cols)
+    self.isfull = self.shape == core.shape
+
+  def matvec( self, vec ):
+    if 'csr' in self.__dict__ or self.isfull:
+      return self.csr.dot( vec )
+    full = numpy.zeros( self.core.shape[1:]+vec.shape[1:] )
+    full[self.cols] = vec
+    return self.core.dot( full )[self.rows]
+
+  @cache.property
+  def diagonal( self ):
+    if self.isfull:
+      return self.core.diagonal()
+    n = min( self.shape )
+    return numpy.asarray( self.core[self.rows[:n],self.cols[:n]] ).ravel()
+
+  @cache.property
+  def csr( self ):
+    import scipy.sparse
+    core = scipy.sparse.csr_matrix( self.core )
+    if self.isfull:
+      return core
+    colmap = numpy.empty( core.shape[1], dtype=int )
+    colmap[:] = -1
+    colmap[self.cols] = numpy.arange( len(self.cols) )
+    starts = core.indptr[self.rows]
+    counts = core.indptr[self.rows+1] - starts
+    offsets = numpy.cumsum( counts ) - counts
+    select = numpy.arange( counts.sum() ) + numpy.repeat( starts - offsets, counts )
+    cols = colmap[core.indices[select]]
+    keep = cols >= 0
+    rowcounts = numpy.bincount( numpy.repeat( numpy.arange(len(self.rows)), counts )[keep], minlength=len(self.rows) )
+    log.debug( 'restricted {}x{} matrix to {}x{}'.format( *core.shape+self.shape ) )
+    return scipy.sparse.csr_matrix( ( core.data[select[keep]], cols[keep], numpy.concatenate([[0],numpy.cumsum(rowcounts)]) ), self.shape )
+
+  def aslinearoperator( self ):
+    import scipy.sparse.linalg
+    return scipy.sparse.linalg.LinearOperator( self.shape, self.matvec, dtype=float )
+
 class ScipyMatrix( Matrix ):
   '''matrix based on any of scipy's sparse matrices'''
 
   def __init__( self, core ):
     self.core = core
+    self._restrictions = {}
+    self._shiftinverts = {}
     Matrix.__init__( self, core.shape )
 
   matvec = lambda self, vec: self.core.dot( vec )
@@ -101,6 +141,57 @@ class ScipyMatrix( Matrix ):
   __div__ = lambda self, other: ScipyMatrix( self.core / other )
   T = property( lambda self: ScipyMatrix( self.core.transpose() ) )
 
+  def restrict( self, I, J ):
+    '''matrix restricted to rows ``I`` and columns ``J``
+
+    Returns a :class:`Restriction` for boolean masks ``I`` and ``J``. The
+    restriction is cached, such that repeated solves and preconditioners for
+    the same constraints share the index maps and the restricted csr matrix.'''
+
+    key = numpy.packbits( I ).tobytes(), numpy.packbits( J ).tobytes()
+    try:
+      restriction = self._restrictions[key]
+    except KeyError:
+      restriction = self._restrictions[key] = Restriction( self.core, I, J )
+    return restriction
+
+  def shiftinvert( self, mass, shift, free ):
+    '''inverse of the shifted matrix restricted to free entries
+
+    Returns a linear operator applying the inverse of ``self - shift * mass``,
+    restricted to rows and columns ``free``. The factorization is cached per
+    shift and mask, such that repeated eigenvalue computations with the same
+    shift factorize only once.'''
+
+    import scipy.sparse.linalg
+    key = shift, numpy.packbits( free ).tobytes()
+    try:
+      cachedmass, lu = self._shiftinverts[key]
+    except KeyError:
+      cachedmass = None
+    if cachedmass is not mass:
+      log.info( 'factorizing shifted matrix for shift {}'.format( shift ) )
+      A = self.restrict( free, free ).csr - shift * mass.restrict( free, free ).csr
+      lu = scipy.sparse.linalg.splu( A.tocsc() )
+      self._shiftinverts[key] = mass, lu
+    n = free.sum()
+    return scipy.sparse.linalg.LinearOperator( (n,n), lu.solve, dtype=float )
+
+  def cond( self, constrain=None, lconstrain=None, rconstrain=None ):
+    'condition number'
+
+    x, I, J = parsecons( constrain, lconstrain, rconstrain, self.shape )
+    return numpy.linalg.cond( self.restrict( I, J ).csr.toarray() )
+
+  def res( self, x, b=0, constrain=None, lconstrain=None, rconstrain=None, scaled=True ):
+    'residual'
+
+    x0, I, J = parsecons( constrain, lconstrain, rconstrain, self.shape )
+    res = numpy.linalg.norm( (self.matvec(x)-b)[I] )
+    if scaled:
+      res /= numpy.linalg.norm( (self.matvec(x0)-b)[I] )
+    return res
+
   def rowsupp( self, tol=0 ):
     'return row indices with nonzero/non-small entries'
 
@@ -116,14 +207,19 @@ class ScipyMatrix( Matrix ):
 
     import scipy.sparse.linalg
     solverinfo = SolverInfo( tol, callback=callback )
+    t0 = time.perf_counter()
 
     lhs, I, J = parsecons( constrain, lconstrain, rconstrain, self.shape )
-    A = self.core
-    if not I.all():
-      A = A[I,:]
-    b = ( rhs[I] if rhs is not None else 0 ) - A * lhs
+    if rhs is not None:
+      rhs = numpy.asarray( rhs, dtype=float )
+      assert rhs.ndim in (1,2) and rhs.shape[0] == self.shape[0], 'right-hand-side has shape %s, expected a vector or a block of vectors' % (rhs.shape,)
+      if rhs.ndim == 2 and lhs.ndim == 1:
+        lhs = numpy.repeat( lhs[:,_], rhs.shape[1], axis=1 )
+    restriction = self.restrict( I, J )
+    b = rhs[I] if rhs is not None else numpy.zeros( (I.sum(),)+lhs.shape[1:] )
     if not J.all():
-      A = A[:,J]
+      b = b - self.core.dot( lhs )[I]
+    A = restriction.aslinearoperator()
 
     if lhs0 is None:
       x0 = None
@@ -137,52 +233,133 @@ class ScipyMatrix( Matrix ):
       if res0 < tol:
         return (lhs0,solverinfo) if info else lhs0
 
-    if tol == 0:
+    if tol == 0 and solver not in _directsolvers:
       solver = 'spsolve'
     elif not solver:
       solver = 'cg' if symmetric else 'gmres'
+    if solver in _directsolvers: # direct solvers require the restricted matrix, irrespective of tol
+      A = restriction.csr
+    if solver == 'blockdiag': # opt-in, as detecting the blocks costs a graph traversal
+      labels = _blocklabels( A )
+      blocksizes = numpy.bincount( labels )
 
-    solverfun = getattr( scipy.sparse.linalg, solver )
     if not numpy.any(b):
-      x = numpy.zeros_like(x0)
+      x = numpy.zeros( b.shape )
+    elif solver == 'blockdiag':
+      log.info( 'solving system using block diagonal inverse ({} blocks)'.format( len(blocksizes) ) )
+      x = _blocksolve( A, labels, b )
+      solverinfo( A, b, x )
+    elif solver == 'mixedprecision':
+      log.info( 'solving system using single precision sparse direct solver with iterative refinement' )
+      x = _refinedsolve( A, b, tol, solverinfo )
+    elif solver == 'spsolve' and b.ndim == 2:
+      log.info( 'solving system for {} right-hand-sides using sparse direct solver'.format( b.shape[1] ) )
+      x = scipy.sparse.linalg.splu( A.tocsc() ).solve( b )
+      solverinfo( A, b, x )
     elif solver == 'spsolve':
       log.info( 'solving system using sparse direct solver' )
-      x = solverfun( A, b )
+      x = scipy.sparse.linalg.spsolve( A, b )
       solverinfo( A, b, x )
     else:
-      # keep scipy from making things circular by shielding the nature of A
-      A = scipy.sparse.linalg.LinearOperator( A.shape, A.__mul__, dtype=float )
+      solverfun = getattr( scipy.sparse.linalg, solver )
       if isinstance( precon, str ):
+        t = time.perf_counter()
         precon = self.getprecon( precon, constrain, lconstrain, rconstrain )
+        solverinfo.timings['precon'] = time.perf_counter() - t
       elif not precon:
         # identity operator, because scipy's native identity operator has circular references
         precon = scipy.sparse.linalg.LinearOperator( A.shape, matvec=lambda x:x, rmatvec=lambda x:x, matmat=lambda x:x, dtype=float )
-      mycallback = solverinfo if solver != 'cg' else functools.partial( solverinfo, A, b )
-      x, status = solverfun( A, b, M=precon, tol=tol, x0=x0, callback=mycallback, **solverargs )
-      assert status == 0, '%s solver failed with status %d' % (solver, status)
+      # scipy's krylov solvers take one right-hand-side at a time; the
+      # operator and preconditioner are shared between all of them
+      x = numpy.empty( b.shape )
+      for i, (bi, x0i) in enumerate( zip( b.reshape(len(b),-1).T, x0.reshape(len(b),-1).T if x0 is not None else itertools.repeat(None) ) ):
+        mycallback = solverinfo if solver != 'cg' else functools.partial( solverinfo, A, bi )
+        xi, status = solverfun( A, bi, M=precon, tol=tol, x0=x0i, callback=mycallback, **solverargs )
+        assert status == 0, '%s solver failed with status %d' % (solver, status)
+        x.reshape(len(b),-1)[:,i] = xi
       log.info( '%s solver converged in %d iterations' % (solver.upper(), solverinfo.niter) )
     lhs[J] = x
+    solverinfo.timings['solve'] = time.perf_counter() - t0 - solverinfo.timings.get( 'precon', 0 )
 
     return (lhs,solverinfo) if info else lhs
 
+  def blockinverse( self, blocks=None ):
+    '''inverse of a block diagonal matrix
+
+    Inverts a matrix that consists of decoupled blocks, such as the mass matrix
+    of a discontinuous basis, one block at a time. Blocks of equal size are
+    inverted together in a single vectorized operation. The blocks are
+    detected from the sparsity pattern unless specified by ``blocks``, a
+    sequence of index arrays that partition the matrix, for instance the dofs
+    of every element. The returned inverse is a :class:`ScipyMatrix` with the
+    same block structure.'''
+
+    assert self.shape[0] == self.shape[1], 'matrix must be square'
+    if blocks is None:
+      labels = _blocklabels( self.core )
+    else:
+      labels = numpy.empty( self.shape[0], dtype=int )
+      labels[:] = -1
+      for iblock, block in enumerate( blocks ):
+        labels[block] = iblock
+      assert labels.min() >= 0, 'blocks do not cover the full matrix'
+    return ScipyMatrix( _blockinverse( self.core, labels ) )
+
+  def condense( self, interior, rhs=None ):
+    '''static condensation of block-local dofs
+
+    Eliminates the dofs marked by boolean mask ``interior``, which are allowed
+    to couple among each other only in block diagonal fashion, like the
+    element-interior dofs of a hybridized discretization. Returns the Schur
+    complement on the remaining dofs, the condensed right hand side, and a
+    function that maps the solution on the remaining dofs to the full
+    solution vector::
+
+        S, g, expand = A.condense( interior, rhs )
+        lhs = expand( S.solve( g ) )
+    '''
+
+    assert self.shape[0] == self.shape[1], 'matrix must be square'
+    interior = numpy.asarray( interior, dtype=bool )
+    assert interior.shape == self.shape[:1]
+    skeleton = ~interior
+    rhs = numpy.zeros( self.shape[0] ) if rhs is None else numpy.asarray( rhs, dtype=float )
+    Aii = self.restrict( interior, interior ).csr
+    Aiiinv = _blockinverse( Aii, _blocklabels( Aii ) )
+    Aib = self.restrict( interior, skeleton ).csr
+    Abi = self.restrict( skeleton, interior ).csr
+    S = self.restrict( skeleton, skeleton ).csr - Abi * ( Aiiinv * Aib )
+    g = rhs[skeleton] - Abi * ( Aiiinv * rhs[interior] )
+    log.info( 'condensed {} interior dofs'.format( interior.sum() ) )
+    def expand( lhsb ):
+      lhs = numpy.empty( self.shape[0] )
+      lhs[skeleton] = lhsb
+      lhs[interior] = Aiiinv * ( rhs[interior] - Aib * lhsb )
+      return lhs
+    return ScipyMatrix( S ), g, expand
+
   def getprecon( self, name='SPLU', constrain=None, lconstrain=None, rconstrain=None ):
 
     import scipy.sparse.linalg
 
     name = name.lower()
     x, I, J = parsecons( constrain, lconstrain, rconstrain, self.shape )
-    A = self.core[I,:][:,J]
-    assert A.shape[0] == A.shape[1], 'constrained matrix must be square'
+    restriction = self.restrict( I, J )
+    assert restriction.shape[0] == restriction.shape[1], 'constrained matrix must be square'
     log.info( 'building %s preconditioner' % name )
     if name == 'splu':
-      precon = scipy.sparse.linalg.splu( A.tocsc() ).solve
+      precon = scipy.sparse.linalg.splu( restriction.csr.tocsc() ).solve
     elif name == 'spilu':
-      precon = scipy.sparse.linalg.spilu( A.tocsc(), drop_tol=1e-5, fill_factor=None, drop_rule=None, permc_spec=None, diag_pivot_thresh=None, relax=None, panel_size=None, options=None ).solve
+      precon = scipy.sparse.linalg.spilu( restriction.csr.tocsc(), drop_tol=1e-5, fill_factor=None, drop_rule=None, permc_spec=None, diag_pivot_thresh=None, relax=None, panel_size=None, options=None ).solve
     elif name == 'diag':
-      precon = numpy.reciprocal( A.diagonal() ).__mul__
+      precon = numpy.reciprocal( restriction.diagonal ).__mul__
     else:
       raise Exception( 'invalid preconditioner %r' % name )
-    return scipy.sparse.linalg.LinearOperator( A.shape, precon, dtype=float )
+    dtype = restriction.csr.dtype
+    if name != 'diag' and dtype != float: # factorization of single precision matrix
+      solve = precon
+      precon = lambda x: solve( x.astype( dtype ) )
+    return scipy.sparse.linalg.LinearOperator( restriction.shape, precon, dtype=float )
 
 class NumpyMatrix( Matrix ):
   '''matrix based on numpy array'''
@@ -201,6 +378,21 @@ class NumpyMatrix( Matrix ):
   __div__ = lambda self, other: NumpyMatrix( self.core / other )
   T = property( lambda self: NumpyMatrix( self.core.T ) )
 
+  def cond( self, constrain=None, lconstrain=None, rconstrain=None ):
+    'condition number'
+
+    x, I, J = parsecons( constrain, lconstrain, rconstrain, self.shape )
+    return numpy.linalg.cond( self.core[numpy.ix_(I,J)] )
+
+  def res( self, x, b=0, constrain=None, lconstrain=None, rconstrain=None, scaled=True ):
+    'residual'
+
+    x0, I, J = parsecons( constrain, lconstrain, rconstrain, self.shape )
+    res = numpy.linalg.norm( (self.matvec(x)-b)[I] )
+    if scaled:
+      res /= numpy.linalg.norm( (self.matvec(x0)-b)[I] )
+    return res
+
   @log.title
   def solve( self, b=None, constrain=None, lconstrain=None, rconstrain=None, tol=0, title='solving system' ):
     'solve'
@@ -209,13 +401,15 @@ class NumpyMatrix( Matrix ):
       b = numpy.zeros( self.shape[0] )
     else:
       b = numpy.asarray( b, dtype=float )
-      assert b.ndim == 1, 'right-hand-side has shape %s, expected a vector' % (b.shape,)
-      assert b.shape == self.shape[:1]
+      assert b.ndim in (1,2), 'right-hand-side has shape %s, expected a vector or a block of vectors' % (b.shape,)
+      assert b.shape[0] == self.shape[0]
 
     x, I, J = parsecons( constrain, lconstrain, rconstrain, self.shape )
     if I.all() and J.all():
       return numpy.linalg.solve( self.core, b )
 
+    if b.ndim == 2 and x.ndim == 1:
+      x = numpy.repeat( x[:,_], b.shape[1], axis=1 )
     data = self.core[I]
     x[J] = numpy.linalg.solve( data[:,J], b[I] - numpy.dot( data[:,~J], x[~J] ) )
     return x
@@ -224,8 +418,14 @@ class NumpyMatrix( Matrix ):
 # UTILITY FUNCTIONS
 
 def assemble( data, index, shape, force_dense=False ):
-  'create data from values and indices'
+  '''create data from values and indices
+
+  A two-dimensional ``data`` array holds an ensemble of values for a shared
+  index, which is assembled into a stacked array or a list of matrices that
+  share one sparsity pattern.'''
 
+  if data.ndim == 2:
+    return _assemble_ensemble( data, index, shape, force_dense )
   if len(shape) == 0:
     retval = data.sum()
   elif len(shape) == 2 and not force_dense:
@@ -241,8 +441,118 @@ def assemble( data, index, shape, force_dense=False ):
   log.debug( 'assembled', '%s(%s)' % ( retval.__class__.__name__, ','.join( str(n) for n in shape ) ) )
   return retval
 
+def _assemble_ensemble( data, index, shape, force_dense ):
+  'assemble every row of data, sharing the index computations'
+
+  if len(shape) == 0:
+    return data.sum( axis=1 )
+  flatindex = numpy.dot( numpy.cumprod( (1,)+shape[:0:-1] )[::-1], index )
+  if len(shape) == 2 and not force_dense:
+    import scipy.sparse
+    uniqueindex, inverse = numpy.unique( flatindex, return_inverse=True )
+    indices = uniqueindex % shape[1]
+    indptr = numpy.searchsorted( uniqueindex // shape[1], numpy.arange( shape[0]+1 ) )
+    retval = [ ScipyMatrix( scipy.sparse.csr_matrix( ( numpy.bincount( inverse, d, len(uniqueindex) ).astype( data.dtype, copy=False ), indices, indptr ), shape ) ) for d in data ]
+  else:
+    retval = numpy.stack([ numpy.bincount( flatindex, d, numpy.prod(shape) ).reshape( shape ).astype( data.dtype, copy=False ) for d in data ])
+    if retval.ndim == 3:
+      retval = [ NumpyMatrix( d ) for d in retval ]
+  log.debug( 'assembled', 'ensemble of %d %s(%s)' % ( len(data), retval[0].__class__.__name__, ','.join( str(n) for n in shape ) ) )
+  return retval
+
+_directsolvers = 'spsolve', 'blockdiag', 'mixedprecision'
+
+def _blocklabels( A ):
+  'label every row of a square sparse matrix by its connected block'
+
+  import scipy.sparse.csgraph
+  nblocks, labels = scipy.sparse.csgraph.connected_components( A, directed=False )
+  return labels
+
+def _blocks( A, labels ):
+  'iterate over groups of equally sized dense blocks of block diagonal matrix A'
+
+  import scipy.sparse
+  A = scipy.sparse.coo_matrix( A )
+  A.sum_duplicates()
+  assert numpy.equal( labels[A.row], labels[A.col] ).all(), 'matrix is not block diagonal'
+  order = numpy.argsort( labels, kind='mergesort' )
+  sizes = numpy.bincount( labels )
+  offsets = numpy.cumsum( sizes ) - sizes
+  localindex = numpy.empty( len(labels), dtype=int )
+  localindex[order] = numpy.arange( len(labels) ) - offsets[labels[order]]
+  for size in numpy.unique( sizes ):
+    iblocks, = numpy.equal( sizes, size ).nonzero()
+    renumber = numpy.empty( len(sizes), dtype=int )
+    renumber[iblocks] = numpy.arange( len(iblocks) )
+    select = numpy.equal( sizes[labels[A.row]], size )
+    blocks = numpy.zeros( (len(iblocks),size,size) )
+    blocks[ renumber[labels[A.row[select]]], localindex[A.row[select]], localindex[A.col[select]] ] = A.data[select]
+    dofs = order[ offsets[iblocks,_] + numpy.arange(size) ]
+    yield dofs, blocks
+
+def _blockinverse( A, labels ):
+  'invert block diagonal sparse matrix with rows grouped by labels'
+
+  import scipy.sparse
+  rows = []
+  cols = []
+  data = []
+  for dofs, blocks in _blocks( A, labels ):
+    nblocks, size = dofs.shape
+    rows.append( numpy.repeat( dofs[:,:,_], size, axis=2 ).ravel() )
+    cols.append( numpy.repeat( dofs[:,_,:], size, axis=1 ).ravel() )
+    data.append( numpy.linalg.inv( blocks ).ravel() )
+  return scipy.sparse.csr_matrix( ( numpy.concatenate(data), ( numpy.concatenate(rows), numpy.concatenate(cols) ) ), A.shape )
+
+def _blocksolve( A, labels, b ):
+  'solve block diagonal sparse system with rows grouped by labels'
+
+  x = numpy.empty( b.shape )
+  for dofs, blocks in _blocks( A, labels ):
+    x[dofs] = numpy.linalg.solve( blocks, b[dofs].reshape( dofs.shape+(-1,) ) ).reshape( dofs.shape+b.shape[1:] )
+  return x
+
+def _refinedsolve( A, b, tol, solverinfo, maxiter=32 ):
+  '''direct solve with mixed precision iterative refinement
+
+  Factorizes A in single precision and recovers double precision accuracy by
+  refinement against the double precision residual. Falls back on a double
+  precision factorization if refinement fails to converge, which happens if
+  A is too poorly conditioned for single precision.'''
+
+  import scipy.sparse.linalg
+  t = time.perf_counter()
+  lu = scipy.sparse.linalg.splu( A.astype( numpy.float32 ).tocsc() )
+  solverinfo.timings['precon'] = time.perf_counter() - t
+  bnorm = numpy.linalg.norm( b )
+  x = lu.solve( b.astype( numpy.float32 ) ).astype( float )
+  res = numpy.inf
+  best = x
+  for irefine in range( maxiter ):
+    r = b - A.dot( x )
+    newres = numpy.linalg.norm( r ) / bnorm
+    solverinfo( newres )
+    if newres < res: # keep the best iterate
+      best = x
+    if newres <= tol or newres > .5 * res: # converged or stagnated
+      res = min( res, newres )
+      break
+    res = newres
+    x = x + lu.solve( r.astype( numpy.float32 ) )
+  x = best
+  if res > max( tol, 1e3 * numpy.finfo(float).eps ):
+    log.warning( 'iterative refinement stagnated at residual {:.2e}; refactorizing in double precision'.format( res ) )
+    return scipy.sparse.linalg.splu( A.astype( float ).tocsc() ).solve( b )
+  log.info( 'iterative refinement converged in {} iterations'.format( irefine ) )
+  return x
+
 def parsecons( constrain, lconstrain, rconstrain, shape ):
-  'parse constraints'
+  '''parse constraints
+
+  Constraints are vectors of length ``shape[1]``, or blocks of shape
+  ``(shape[1],k)`` for as many right-hand-sides that share the positions of
+  the NaN entries. In the latter case the returned ``x`` is a block as well.'''
 
   I = numpy.ones( shape[0], dtype=bool )
   x = numpy.empty( shape[1] )
@@ -251,17 +561,29 @@ def parsecons( constrain, lconstrain, rconstrain, shape ):
     assert lconstrain is None
     assert rconstrain is None
     assert numeric.isarray(constrain)
-    I[:] = numpy.isnan( constrain )
-    x[:] = constrain
+    if constrain.ndim == 2:
+      x = numpy.array( constrain, dtype=float )
+      I[:] = numpy.isnan( x[:,0] )
+    else:
+      I[:] = numpy.isnan( constrain )
+      x[:] = constrain
   if lconstrain is not None:
     assert numeric.isarray(lconstrain)
-    x[:] = lconstrain
+    if lconstrain.ndim == 2:
+      x = numpy.array( lconstrain, dtype=float )
+    else:
+      x[:] = lconstrain
   if rconstrain is not None:
     assert numeric.isarray(rconstrain)
     I[:] = rconstrain
   J = numpy.isnan(x)
+  if J.ndim == 2:
+    assert ( J == J[:,:1] ).all(), 'constraints differ between right-hand-sides'
+    x[J] = 0
+    J = J[:,0]
+  else:
+    x[J] = 0
   assert numpy.sum(I) == numpy.sum(J), 'constrained matrix is not square: %dx%d' % ( numpy.sum(I), numpy.sum(J) )
-  x[J] = 0
   return x, I, J
 
 
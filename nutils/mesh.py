@@ -14,7 +14,7 @@ accompanying geometry function. Meshes can either be generated on the fly, e.g.
 provided at this point; output is handled by the :mod:`nutils.plot` module.
 """
 
-from . import topology, function, util, element, numpy, numeric, transform, log, _
+from . import topology, function, util, element, numpy, numeric, transform, log, cache, _
 import os, warnings, itertools
 
 # MESH GENERATORS
@@ -96,6 +96,7 @@ def newrectilinear( nodes, periodic=None, bnames=[['left','right'],['bottom','to
   return domain, geom
 
 @log.title
+@cache.persistent( 'topologies', 'topocache' )
 def multipatch( patches, nelems, patchverts=None, name='multipatch' ):
   '''multipatch rectilinear mesh generator
 
@@ -300,6 +301,7 @@ def multipatch( patches, nelems, patchverts=None, name='multipatch' ):
   return topo, geom
 
 @log.title
+@cache.persistent( 'topologies', 'topocache', files=['fname'] )
 def gmsh( fname, name=None ):
   """Gmsh parser
 
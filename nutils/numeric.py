@@ -10,7 +10,7 @@
 The numeric module provides methods that are lacking from the numpy module.
 """
 
-import numpy, numbers, builtins
+import numpy, numbers, builtins, pickle, hashlib
 
 _abc = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ' # indices for einsum
 
@@ -605,7 +605,14 @@ def assert_allclose64(actual, data=None):
   raise Exception(status)
 
 class const:
-  __slots__ = '__base', '__hash', '__array_struct__'
+  '''immutable, hashable array
+
+  The hash is derived from an md5 digest of the array data, which is
+  computed once, on first use, and which decides equality of arrays of equal
+  dtype and shape without comparing their data. Arrays with object dtype
+  are hashed and compared by their items instead.'''
+
+  __slots__ = '__base', '__digest', '__hash', '__array_struct__'
 
   @staticmethod
   def full(shape, fill_value):
@@ -618,12 +625,41 @@ class const:
     self.__base = numpy.array(base, dtype=dtype) if copy or not isinstance(base, numpy.ndarray) or dtype and dtype != base.dtype else base
     self.__base.flags.writeable = False
     self.__array_struct__ = self.__base.__array_struct__
-    self.__hash = hash((self.__base.shape, self.__base.dtype, tuple(self.__base.flat[::self.__base.size//32+1])))
+    self.__digest = self.__hash = None
     return self
 
+  @property
+  def digest(self):
+    '''md5 digest of dtype, shape and data, or None for object arrays'''
+
+    if self.__digest is None and not self.__base.dtype.hasobject:
+      base = self.__base
+      if base.dtype.kind in 'fc':
+        base = base + 0 # map -0. to 0., which compare equal
+      h = hashlib.md5(repr((base.dtype.str, base.shape)).encode())
+      h.update(numpy.ascontiguousarray(base).data)
+      self.__digest = h.digest()
+    return self.__digest
+
+  def __hash__(self):
+    if self.__hash is None:
+      digest = self.digest
+      self.__hash = int.from_bytes(digest[:8], 'little', signed=True) if digest is not None else hash((self.__base.shape, tuple(self.__base.flat)))
+    return self.__hash
+
   def __reduce__(self):
     return const, (self.__base, False)
 
+  def __reduce_ex__(self, protocol):
+    if protocol < 5 or self.__base.dtype.hasobject:
+      return self.__reduce__()
+    base = numpy.ascontiguousarray(self.__base)
+    return const._frombuffer, (pickle.PickleBuffer(base), base.dtype, self.__base.shape) # out-of-band if a buffer_callback is given; ascontiguousarray makes 0-d arrays 1-d
+
+  @staticmethod
+  def _frombuffer(buffer, dtype, shape):
+    return const(numpy.frombuffer(buffer, dtype).reshape(shape) if numpy.prod(shape) else numpy.empty(shape, dtype), copy=False)
+
   def __eq__(self, other):
     if self is other:
       return True
@@ -631,7 +667,12 @@ class const:
       return False
     if self.__base is other.__base:
       return True
-    if self.__hash != other.__hash or self.__base.dtype != other.__base.dtype or self.__base.shape != other.__base.shape or numpy.not_equal(self.__base, other.__base).any():
+    if self.__base.dtype != other.__base.dtype or self.__base.shape != other.__base.shape:
+      return False
+    if self.__base.dtype.hasobject:
+      if numpy.not_equal(self.__base, other.__base).any():
+        return False
+    elif self.digest != other.digest:
       return False
     # deduplicate
     self.__base = other.__base
@@ -645,6 +686,7 @@ class const:
   shape = property(lambda self: self.__base.shape)
   size = property(lambda self: self.__base.size)
   ndim = property(lambda self: self.__base.ndim)
+  nbytes = property(lambda self: self.__base.nbytes)
   flat = property(lambda self: self.__base.flat)
   T = property(lambda self: const(self.__base.T, copy=False))
 
@@ -660,7 +702,6 @@ class const:
   __div__ = lambda self, other: self.__base.__div__(other)
   __rdiv__ = lambda self, other: self.__base.__rdiv__(other)
   __pow__ = lambda self, other: self.__base.__pow__(other)
-  __hash__ = lambda self: self.__hash
   __int__ = lambda self: self.__base.__int__()
   __float__ = lambda self: self.__base.__float__()
 
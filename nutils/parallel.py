@@ -13,8 +13,8 @@ platforms, notably excluding Windows. On unsupported platforms parallel features
 will disable and a warning is printed.
 """
 
-from . import core, log, numpy, numeric
-import os, sys, multiprocessing, tempfile, mmap, traceback, signal
+from . import core, log, numpy, numeric, cache
+import os, sys, multiprocessing, tempfile, mmap, traceback, signal, pickle
 
 procid = None # current process id, None for unforked
 
@@ -67,7 +67,9 @@ def pariter( iterable, nprocs ):
 
   As a safety measure nested pariters are blocked by setting the global
   ``procid`` variable; all secundary pariters will be treated like normal
-  serial iterators.
+  serial iterators. If the ``cachestats`` property is set, the cache
+  statistics of the child processes are added to those of the main process
+  (see :func:`nutils.cache.statistics`).
   
   Parameters
   ----------
@@ -102,6 +104,7 @@ def pariter( iterable, nprocs ):
   shared_iter = multiprocessing.RawValue( 'i', nprocs ) # shared integer pointing at first unyielded item
   lock = multiprocessing.Lock() # lock to avoid race conditions in incrementing shared_iter
   children = [] # list of forked processes, non-empty only in primary process
+  statsfiles = [ tempfile.TemporaryFile( dir=core.getprop( 'shmdir', default=None ) ) for i in range( nprocs-1 ) ] if core.getprop( 'cachestats', False ) else None
 
   try:
 
@@ -109,6 +112,7 @@ def pariter( iterable, nprocs ):
       child_pid = os.fork()
       if not child_pid:
         signal.signal( signal.SIGINT, signal.SIG_IGN ) # disable sigint (ctrl+c) handler
+        stats0 = statsfiles and cache.statistics()
         break
       children.append( child_pid )
     else:
@@ -144,7 +148,12 @@ def pariter( iterable, nprocs ):
   finally:
 
     if procid != 0: # before anything else can fail:
-      os._exit( fail ) # cumminicate exit status to main process
+      try:
+        if statsfiles:
+          pickle.dump( cache.statistics( since=stats0 ), statsfiles[procid-1] )
+          statsfiles[procid-1].flush()
+      finally:
+        os._exit( fail ) # cumminicate exit status to main process
 
     procid = None # unset global variable
     totalfail = fail
@@ -153,6 +162,13 @@ def pariter( iterable, nprocs ):
       children.remove( child_pid )
       if child_status:
         totalfail += 1
+    for statsfile in statsfiles or ():
+      statsfile.seek( 0 )
+      try:
+        cache.mergestats( pickle.load( statsfile ) )
+      except EOFError: # child failed before writing
+        pass
+      statsfile.close()
     if fail: # failure in main process: exception has been reraised
       log.error( 'pariter failed in {} out of {} processes; reraising exception for main process'.format( totalfail, nprocs ) )
     elif totalfail: # failure in child process: raise exception
@@ -38,8 +38,8 @@ In addition to ``solve_linear`` the solver module defines ``newton`` and
 time dependent problems.
 """
 
-from . import function, cache, log, util, numeric
-import numpy, itertools, functools, numbers, collections
+from . import function, cache, log, util, numeric, parallel, core, _
+import numpy, itertools, functools, numbers, collections, operator, contextlib, time, json, inspect
 
 
 class Integral:
@@ -50,9 +50,11 @@ class Integral:
     shapes = {integrand.shape for integrand in self._integrands.values()}
     assert len(shapes) == 1, 'incompatible shapes: {}'.format(' != '.join(str(shape) for shape in shapes))
     self.shape, = shapes
+    self._derivatives = {}
+    self._splits = {}
 
   @classmethod
-  def multieval(cls, *integrals, fcache=None, arguments=None):
+  def multieval(cls, *integrals, fcache=None, arguments=None, ensemble=False):
     assert all(isinstance(integral, cls) for integral in integrals)
     if fcache is None:
       fcache = cache.WrapperCache()
@@ -62,9 +64,11 @@ class Integral:
         gather.setdefault(di, []).append(iint)
     retvals = [None] * len(integrals)
     for (domain, ischeme), iints in gather.items():
-      for iint, retval in zip(iints, domain.integrate([integrals[iint]._integrands[domain, ischeme] for iint in iints], ischeme=ischeme, fcache=fcache, arguments=arguments)):
+      for iint, retval in zip(iints, domain.integrate([integrals[iint]._integrands[domain, ischeme] for iint in iints], ischeme=ischeme, fcache=fcache, arguments=arguments, ensemble=ensemble)):
         if retvals[iint] is None:
           retvals[iint] = retval
+        elif isinstance(retval, list): # ensemble of matrices
+          retvals[iint] = [a + b for a, b in zip(retvals[iint], retval)]
         else:
           retvals[iint] += retval
     return retvals
@@ -74,10 +78,73 @@ class Integral:
     return retval
 
   def derivative(self, target):
+    try:
+      return self._derivatives[target]
+    except KeyError:
+      pass
     argshape = self._argshape(target)
     arg = function.Argument(target, argshape)
     seen = {}
-    return Integral([di, function.derivative(integrand, var=arg, seen=seen)] for di, integrand in self._integrands.items())
+    derivative = self._derivatives[target] = Integral([di, function.derivative(integrand, var=arg, seen=seen)] for di, integrand in self._integrands.items())
+    return derivative
+
+  def directionalderivative(self, target, direction):
+    '''derivative to ``target`` in the direction of argument ``direction``
+
+    Contracts the derivative with a :class:`nutils.function.Argument` named
+    ``direction`` of the same shape as ``target``, such that tangent vectors
+    are obtained without assembling the full jacobian.'''
+
+    try:
+      return self._derivatives[target, direction]
+    except KeyError:
+      pass
+    jacobian = self.derivative(target)
+    arg = function.Argument(direction, self._argshape(target))
+    axes = tuple(range(len(self.shape), len(jacobian.shape)))
+    derivative = self._derivatives[target, direction] = Integral([di, function.dot(integrand, arg, axes)] for di, integrand in jacobian._integrands.items())
+    return derivative
+
+  def splitlinear(self, target):
+    '''split integral in parts that are affine and nonlinear in ``target``
+
+    Integrands are separated in their additive terms, which are classified by
+    the :class:`nutils.function.Argument` dependencies of their derivative to
+    ``target``. Returns a tuple of two integrals, either of which is ``None``
+    if it has no terms.'''
+
+    try:
+      return self._splits[target]
+    except KeyError:
+      pass
+    arg = function.Argument(target, self._argshape(target))
+    parts = _groupterms(self._integrands, lambda term: _dependson(function.derivative(term, var=arg), target))
+    split = self._splits[target] = tuple(Integral(parts[isnonlinear]) if isnonlinear in parts else None for isnonlinear in (False, True))
+    return split
+
+  def affine(self, names):
+    '''decompose integral in terms that are affine in scalar arguments
+
+    Returns a dictionary that maps ``None`` and a subset of ``names`` to
+    integrals that are independent of all arguments in ``names``, such that
+    the integral equals the ``None`` component plus the sum of the other
+    components multiplied by their argument. Raises :class:`ModelError` if
+    the integral is not affine in ``names``.'''
+
+    def classify(term):
+      deps = [name for name in names if _dependson(term, name)]
+      if len(deps) > 1:
+        raise ModelError('term depends on multiple arguments {}'.format(', '.join(deps)))
+      return deps[0] if deps else None
+    components = {}
+    for name, parts in _groupterms(self._integrands, classify).items():
+      if name is not None:
+        assert self._argshape(name) == (), 'argument {!r} is not scalar'.format(name)
+        parts = util.hashlessdict([di, function.derivative(integrand, var=function.Argument(name, ()))] for di, integrand in parts.items())
+        if any(_dependson(integrand, name) for integrand in parts.values()):
+          raise ModelError('integral is not affine in {!r}'.format(name))
+      components[name] = Integral(parts)
+    return components
 
   def replace(self, arguments):
     return Integral([di, function.replace_arguments(integrand, arguments)] for di, integrand in self._integrands.items())
@@ -132,6 +199,62 @@ class Integral:
     return shape
 
 
+def _dependson(func, name):
+  'check if a function depends on argument ``name``'
+
+  return any(isinstance(dep, function.Argument) and dep._name == name for dep in func.simplified.dependencies)
+
+_linearops = function.Sum, function.InsertAxis, function.Transpose, function.Get, function.Take, function.TakeDiag, function.Mask, function.Inflate, function.Diagonalize, function.Ravel, function.Unravel
+
+def _addterms(func, maxterms=8):
+  '''additive terms of a function
+
+  Expands sums, linear operations of sums, and products of sums as long as
+  the number of terms of the product does not exceed ``maxterms``.'''
+
+  cache = {}
+  def expand(func):
+    try:
+      return cache[func]
+    except KeyError:
+      pass
+    terms = [func]
+    if isinstance(func, (function.Add, function.BlockAdd)):
+      terms = [term for arg in func.funcs for term in expand(arg)]
+    elif isinstance(func, (function.Multiply, function.Dot)):
+      func1, func2 = func.funcs
+      terms1 = expand(func1)
+      terms2 = expand(func2)
+      if 1 < len(terms1) * len(terms2) <= maxterms:
+        terms = [function.Multiply([term1, term2]) if isinstance(func, function.Multiply) else function.Dot([term1, term2], func.axes) for term1 in terms1 for term2 in terms2]
+    elif isinstance(func, _linearops):
+      subterms = expand(func.func)
+      if len(subterms) > 1:
+        terms = [func.__class__(term, *func._args[1:]) for term in subterms]
+    else:
+      simplified = func.simplified
+      if simplified is not func and isinstance(simplified, (function.Add, function.BlockAdd)):
+        terms = expand(simplified)
+    cache[func] = terms
+    return terms
+  return expand(func)
+
+def _groupterms(integrands, classify):
+  '''group the additive terms of integrands by the key returned by ``classify``
+
+  Returns a dictionary that maps keys to integrand mappings. Integrands whose
+  terms all share a single key are kept unexpanded.'''
+
+  groups = {}
+  for di, integrand in integrands.items():
+    terms = {}
+    for term in _addterms(integrand):
+      terms.setdefault(classify(term), []).append(term)
+    for key, keyterms in terms.items():
+      groups.setdefault(key, util.hashlessdict())[di] = integrand if len(terms) == 1 else functools.reduce(operator.add, keyterms)
+  return groups
+
+
 class ModelError( Exception ): pass
 
 
@@ -142,8 +265,11 @@ def solve_linear(target, residual, constrain=None, *, arguments=None, **solvearg
   ----------
   target : :class:`str`
       Name of the target: a :class:`nutils.function.Argument` in ``residual``.
-  residual : Integral
-      Residual integral, depends on ``target``
+  residual : Integral or sequence of Integrals
+      Residual integral, depends on ``target``. A sequence of residuals that
+      differ only in terms that are independent of ``target``, such as
+      several load cases, is solved using a single system matrix, which is
+      formed from the first residual.
   constrain : float vector
       Defines the fixed entries of the coefficient vector
   arguments : :class:`collections.abc.Mapping`
@@ -153,17 +279,119 @@ def solve_linear(target, residual, constrain=None, *, arguments=None, **solvearg
 
   Returns
   -------
-  vector
-      Array of ``target`` values for which ``residual == 0``'''
+  vector or list of vectors
+      Array of ``target`` values for which ``residual == 0``, or a list of
+      arrays if ``residual`` is a sequence.'''
 
-  jacobian = residual.derivative( target )
+  ismultiple = isinstance(residual, (list,tuple))
+  residuals = tuple(residual) if ismultiple else (residual,)
+  jacobian = residuals[0].derivative( target )
   if jacobian.contains(target):
     raise ModelError( 'problem is not linear' )
   assert target not in (arguments or {}), '`target` should not be defined in `arguments`'
-  argshape = residual._argshape(target)
+  argshape = residuals[0]._argshape(target)
   arguments = collections.ChainMap(arguments or {}, {target: numpy.zeros(argshape)})
-  res, jac = Integral.multieval(residual, jacobian, arguments=arguments)
-  return jac.solve( -res, constrain=constrain, **solveargs )
+  *res, jac = Integral.multieval(*residuals, jacobian, arguments=arguments)
+  if not ismultiple:
+    return jac.solve( -res[0], constrain=constrain, **solveargs )
+  lhs = jac.solve( -numpy.stack(res, axis=1), constrain=constrain, **solveargs )
+  return list(lhs.T)
+
+
+@log.title
+def eigen(stiffness, mass, nmodes, shift=0, constrain=None, batchsize=None, *, arguments=None):
+  '''solve generalized eigenvalue problem
+
+  Computes the eigenvalues ``w`` and eigenvectors ``v`` that satisfy
+  ``stiffness v = w mass v``, for the ``nmodes`` smallest eigenvalues not less
+  than ``shift``, by shift-invert Lanczos iterations. Modes are computed in
+  batches of ``batchsize``, each at a shift just past the largest eigenvalue
+  found so far; the factorizations are cached on the stiffness matrix.
+
+  Parameters
+  ----------
+  stiffness : Integral or :class:`nutils.matrix.ScipyMatrix`
+      Symmetric stiffness matrix.
+  mass : Integral or :class:`nutils.matrix.ScipyMatrix`
+      Symmetric, positive semi-definite mass matrix.
+  nmodes : :class:`int`
+      Number of modes.
+  shift : :class:`float`
+      Lower bound of the eigenvalues.
+  constrain : boolean or float vector
+      Masks the free vector entries as ``False`` (boolean) or NaN (float).
+      Eigenvectors vanish in the remaining positions, which in the float case
+      should be zero.
+  batchsize : :class:`int`
+      Number of modes computed per shift; defaults to ``nmodes``.
+  arguments : :class:`collections.abc.Mapping`
+      Defines the values for :class:`nutils.function.Argument` objects in
+      the integrals. Optional.
+
+  Returns
+  -------
+  eigenvalues : vector
+      Eigenvalues in ascending order.
+  eigenvectors : array
+      Mass normalized eigenvectors, one per row.
+  '''
+
+  import scipy.sparse.linalg
+  if isinstance(stiffness, Integral):
+    stiffness, mass = Integral.multieval(stiffness, mass, arguments=arguments)
+  n, = {stiffness.shape[0], stiffness.shape[1], mass.shape[0], mass.shape[1]}
+  if constrain is None:
+    free = numpy.ones(n, dtype=bool)
+  else:
+    assert numeric.isarray(constrain) and constrain.dtype in (bool,float) and constrain.shape == (n,), 'invalid constrain argument'
+    free = numpy.isnan(constrain) if constrain.dtype == float else ~constrain
+    assert constrain.dtype == bool or not constrain[~free].any(), 'eigenvectors require homogeneous constraints'
+  nfree = free.sum()
+  assert nmodes < nfree, 'number of modes exceeds number of free entries'
+  K = stiffness.restrict(free, free).csr
+  M = mass.restrict(free, free).csr
+  batchsize = batchsize or nmodes
+  eigvals = []
+  eigvecs = numpy.empty((nfree, 0))
+  Meigvecs = numpy.empty((nfree, 0))
+  sigma = shift
+  while len(eigvals) < nmodes:
+    k = min(batchsize, nfree-1)
+    w, v = scipy.sparse.linalg.eigsh(K, k=k, M=M, sigma=sigma, OPinv=stiffness.shiftinvert(mass, sigma, free))
+    if eigvals and not (abs(Meigvecs.T.dot(v)) > .5).any():
+      # the batch does not reach down to the known modes, such that modes in
+      # between may be missing; retry closer to the largest known eigenvalue
+      log.info('no known modes at shift {:.2e}'.format(sigma))
+      sigma = .5 * (sigma + max(eigvals))
+      continue
+    nfound = len(eigvals)
+    for wi, vi in sorted(zip(w, v.T), key=lambda item: item[0]):
+      if wi < shift or len(eigvals) == nmodes:
+        continue
+      # orthogonalize against known modes to reject modes found earlier
+      vi = vi - eigvecs.dot(Meigvecs.T.dot(vi))
+      Mvi = M.dot(vi)
+      norm = numpy.sqrt(vi.dot(Mvi))
+      if norm < .5:
+        continue
+      eigvals.append(wi)
+      eigvecs = numpy.hstack([eigvecs, vi[:,_] / norm])
+      Meigvecs = numpy.hstack([Meigvecs, Mvi[:,_] / norm])
+    log.info('found {} new modes at shift {:.2e}'.format(len(eigvals)-nfound, sigma))
+    if len(eigvals) == nfound:
+      assert k < nfree-1, 'failed to find new modes'
+      batchsize *= 2
+    elif eigvals:
+      # shift past the largest eigenvalue by a fraction of the spread of the
+      # batch, keeping the shifted matrix regular; the shift is rounded to a
+      # grid finer than the offset such that round-off does not defeat the
+      # cached factorizations
+      top = max(eigvals)
+      offset = .05 * (w.max() - w.min()) or 1e-3 * (abs(top) or 1)
+      sigma = round(top + offset, 1 - int(numpy.floor(numpy.log10(offset))))
+  modes = numpy.zeros((nmodes, n))
+  modes[:,free] = eigvecs.T
+  return numpy.array(eigvals), modes
 
 
 def solve( gen_lhs_resnorm, tol=1e-10, maxiter=numpy.inf ):
@@ -206,6 +434,63 @@ def solve( gen_lhs_resnorm, tol=1e-10, maxiter=numpy.inf ):
     return lhs
 
 
+class Telemetry:
+  '''performance record of a solver call
+
+  Accumulates the wall time and number of calls per phase of the solver, such
+  as ``residual``, ``jacobian``, ``solve`` and ``linesearch``, and a list of
+  per-iteration values such as residual norms and relaxation factors. Phases
+  may be nested, in which case the time of the inner phase is included in the
+  outer. If the ``telemetry`` property is set, the record is appended as a
+  line of JSON to ``telemetry.jsonl`` in the output directory once the solver
+  is finished.
+
+  Attributes
+  ----------
+  name : :class:`str`
+      Name of the solver.
+  timings : :class:`dict`
+      Total wall time in seconds per phase.
+  counts : :class:`dict`
+      Number of calls per phase.
+  iterations : :class:`list` of :class:`dict`
+      Recorded values per iteration.
+  '''
+
+  def __init__(self, name):
+    self.name = name
+    self.timings = collections.OrderedDict()
+    self.counts = collections.OrderedDict()
+    self.iterations = []
+    self._written = False
+
+  @contextlib.contextmanager
+  def timer(self, phase):
+    t0 = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.timings[phase] = self.timings.get(phase, 0) + time.perf_counter() - t0
+      self.counts[phase] = self.counts.get(phase, 0) + 1
+
+  def record(self, **values):
+    self.iterations.append({key: value.item() if isinstance(value, numpy.generic) else value for key, value in values.items()})
+
+  @property
+  def niter(self):
+    return len(self.iterations)
+
+  def asdict(self):
+    return dict(solver=self.name, niter=self.niter, timings=dict(self.timings), counts=dict(self.counts), iterations=self.iterations)
+
+  def write(self):
+    if self._written or not core.getprop('telemetry', False):
+      return
+    with core.open_in_outdir('telemetry.jsonl', 'a') as f:
+      f.write(json.dumps(self.asdict()) + '\n')
+    self._written = True
+
+
 def withsolve( f ):
   '''add a .solve method to (lhs,resnorm) iterators
 
@@ -216,23 +501,49 @@ def withsolve( f ):
   Shorthand for::
 
       solve( newton( target, residual ), tol )
+
+  If the wrapped generator has a ``telemetry`` parameter it receives a
+  :class:`Telemetry` object, which is accessible as the ``telemetry``
+  attribute and written when iterations end. Otherwise this attribute is
+  None.
   '''
 
+  hastelemetry = 'telemetry' in inspect.signature( f ).parameters
+
   @functools.wraps( f, updated=() )
   class wrapper:
     def __init__( self, *args, **kwargs ):
-      self.iter = f( *args, **kwargs )
+      if hastelemetry:
+        self.telemetry = Telemetry( f.__name__ )
+        self.iter = _writetelemetry( f( *args, telemetry=self.telemetry, **kwargs ), self.telemetry )
+      else:
+        self.telemetry = None
+        self.iter = f( *args, **kwargs )
     def __next__( self ):
       return next( self.iter )
     def __iter__( self ):
       return self.iter
     def solve( self, *args, **kwargs ):
-      return solve( self.iter, *args, **kwargs )
+      if self.telemetry is None:
+        return solve( self.iter, *args, **kwargs )
+      try:
+        return solve( self.iter, *args, **kwargs )
+      finally:
+        self.iter.close() # writes telemetry
   return wrapper
 
 
+def _writetelemetry( gen, telemetry ):
+  'pass through items of gen, and write telemetry when done'
+
+  try:
+    yield from gen
+  finally:
+    telemetry.write()
+
+
 @withsolve
-def newton(target, residual, jacobian=None, lhs0=None, constrain=None, nrelax=numpy.inf, minrelax=.1, maxrelax=.9, rebound=2**.5, *, arguments=None, **solveargs):
+def newton(target, residual, jacobian=None, lhs0=None, constrain=None, nrelax=numpy.inf, minrelax=.1, maxrelax=.9, rebound=2**.5, *, arguments=None, telemetry=None, **solveargs):
   '''iteratively solve nonlinear problem by gradient descent
 
   Generates targets such that residual approaches 0 using Newton procedure with
@@ -276,6 +587,10 @@ def newton(target, residual, jacobian=None, lhs0=None, constrain=None, nrelax=nu
       Defines the values for :class:`nutils.function.Argument` objects in
       `residual`.  The ``target`` should not be present in ``arguments``.
       Optional.
+  telemetry : :class:`Telemetry`
+      Record of timings per phase and of the residual norm, relaxation value
+      and number of line search steps per iteration. Provided by
+      :func:`withsolve` and accessible as ``newton(...).telemetry``.
 
   Yields
   ------
@@ -285,6 +600,8 @@ def newton(target, residual, jacobian=None, lhs0=None, constrain=None, nrelax=nu
 
   assert target not in (arguments or {}), '`target` should not be defined in `arguments`'
   argshape = residual._argshape(target)
+  if telemetry is None:
+    telemetry = Telemetry('newton')
 
   if lhs0 is None:
     lhs0 = numpy.zeros(residual.shape)
@@ -299,67 +616,132 @@ def newton(target, residual, jacobian=None, lhs0=None, constrain=None, nrelax=nu
       lhs0 = numpy.choose(numpy.isnan(constrain), [constrain, lhs0])
       constrain = ~numpy.isnan(constrain)
 
-  if jacobian is None:
+  userjacobian = jacobian is not None
+  if userjacobian:
+    linear = None
+  else:
     jacobian = residual.derivative(target)
+    linear, nonlinear = residual.splitlinear(target)
 
   if not jacobian.contains(target):
     log.info( 'problem is linear' )
-    res, jac = Integral.multieval(residual, jacobian, arguments=collections.ChainMap(arguments or {}, {target: numpy.zeros(argshape)}))
+    with telemetry.timer('assembly'):
+      res, jac = Integral.multieval(residual, jacobian, arguments=collections.ChainMap(arguments or {}, {target: numpy.zeros(argshape)}))
     cons = lhs0.copy()
     cons[~constrain] = numpy.nan
-    lhs = jac.solve( -res, constrain=cons, **solveargs )
+    with telemetry.timer('solve'):
+      lhs = jac.solve( -res, constrain=cons, **solveargs )
+    telemetry.record(resnorm=0)
     yield lhs, 0
     return
 
-  lhs = lhs0.copy()
   fcache = cache.WrapperCache()
-  res, jac = Integral.multieval(residual, jacobian, fcache=fcache, arguments=collections.ChainMap(arguments or {}, {target: lhs}))
+  res0 = 0
+  jac0 = None
+  if linear is not None:
+    # terms that are affine in target are assembled once: res = res0 + jac0 lhs
+    log.info( 'problem is partially linear' )
+    linarguments = collections.ChainMap(arguments or {}, {target: numpy.zeros(argshape)})
+    with telemetry.timer('assembly'):
+      if linear.contains(target):
+        res0, jac0 = Integral.multieval(linear, linear.derivative(target), fcache=fcache, arguments=linarguments)
+      else:
+        res0 = linear.eval(fcache=fcache, arguments=linarguments)
+    residual = nonlinear
+    jacobian = nonlinear.derivative(target)
+
+  # the first line search step, which is accepted in the common case,
+  # evaluates the residual and jacobian together; further steps require only
+  # residuals and tangents, after which the jacobian is assembled once a step
+  # is accepted. A user supplied jacobian defines the tangent and is evaluated
+  # in every step.
+  if userjacobian:
+    tangent = None
+  else:
+    direction = '_newton_direction'
+    tangent = residual.directionalderivative(target, direction)
+
+  @telemetry.timer('jacobian')
+  def evaljac(lhs):
+    'residual and jacobian'
+    res, jac = Integral.multieval(residual, jacobian, fcache=fcache, arguments=collections.ChainMap(arguments or {}, {target: lhs}))
+    if jac0 is not None:
+      res = res + jac0.matvec(lhs)
+      jac = jac + jac0
+    return res + res0, jac
+
+  @telemetry.timer('residual')
+  def evaltangent(lhs, dlhs):
+    'residual and its derivative in direction dlhs'
+    res, dres = Integral.multieval(residual, tangent, fcache=fcache, arguments=collections.ChainMap(arguments or {}, {target: lhs, direction: dlhs}))
+    if jac0 is not None:
+      res = res + jac0.matvec(lhs)
+      dres = dres + jac0.matvec(dlhs)
+    return res + res0, dres
+
+  lhs = lhs0.copy()
+  res, jac = evaljac(lhs)
   zcons = numpy.zeros(argshape)
   zcons[~constrain] = numpy.nan
   relax = 1
+  steprelax = None # relaxation value of the last update
+  nlinesearch = 0
   while True:
     resnorm = numpy.linalg.norm( res[~constrain] )
+    telemetry.record(resnorm=resnorm, relax=steprelax, linesearch=nlinesearch)
     yield lhs, resnorm
-    dlhs = -jac.solve( res, constrain=zcons, **solveargs )
+    with telemetry.timer('solve'):
+      dlhs = -jac.solve( res, constrain=zcons, **solveargs )
     relax = min( relax * rebound, 1 )
-    for irelax in itertools.count():
-      res, jac = Integral.multieval(residual, jacobian, fcache=fcache, arguments=collections.ChainMap(arguments or {}, {target: lhs+relax*dlhs}))
-      newresnorm = numpy.linalg.norm( res[~constrain] )
-      if irelax >= nrelax:
-        if newresnorm > resnorm:
-          log.warning( 'failed to decrease residual' )
-          return
-        break
-      if not numpy.isfinite( newresnorm ):
-        log.info( 'failed to evaluate residual ({})'.format( newresnorm ) )
-        newrelax = 0 # replaced by minrelax later
-      else:
-        r0 = resnorm**2
-        d0 = -2 * r0
-        r1 = newresnorm**2
-        d1 = 2 * numpy.dot( jac.matvec(dlhs)[~constrain], res[~constrain] )
-        log.info( 'line search: 0[{}]{} {}creased by {:.0f}%'.format( '---+++' if d1 > 0 else '--++--' if r1 > r0 else '------', round(relax,5), 'in' if newresnorm > resnorm else 'de', 100*abs(newresnorm/resnorm-1) ) )
-        if r1 <= r0 and d1 <= 0:
-          break
-        D = 2*r0 - 2*r1 + d0 + d1
-        if D > 0:
-          C = 3*r1 - 3*r0 - 2*d0 - d1
-          newrelax = ( numpy.sqrt(C**2-3*d0*D) - C ) / (3*D)
-          log.info( 'minimum based on 3rd order estimation: {:.3f}'.format(newrelax) )
+    with telemetry.timer('linesearch'):
+      for irelax in itertools.count():
+        if irelax == 0 or tangent is None:
+          res, newjac = evaljac(lhs+relax*dlhs)
+          dres = newjac.matvec(dlhs)
         else:
-          C = r1 - r0 - d0
-          # r1 > r0 => C > 0
-          # d1 > 0  => C = r1 - r0 - d0/2 - d0/2 > r1 - r0 - d0/2 - d1/2 = -D/2 > 0
-          newrelax = -.5 * d0 / C
-          log.info( 'minimum based on 2nd order estimation: {:.3f}'.format(newrelax) )
-        if newrelax > maxrelax:
+          res, dres = evaltangent(lhs+relax*dlhs, dlhs)
+          newjac = None
+        newresnorm = numpy.linalg.norm( res[~constrain] )
+        if irelax >= nrelax:
+          if newresnorm > resnorm:
+            log.warning( 'failed to decrease residual' )
+            return
           break
-      relax *= max( newrelax, minrelax )
+        if not numpy.isfinite( newresnorm ):
+          log.info( 'failed to evaluate residual ({})'.format( newresnorm ) )
+          newrelax = 0 # replaced by minrelax later
+        else:
+          r0 = resnorm**2
+          d0 = -2 * r0
+          r1 = newresnorm**2
+          d1 = 2 * numpy.dot( dres[~constrain], res[~constrain] )
+          log.info( 'line search: 0[{}]{} {}creased by {:.0f}%'.format( '---+++' if d1 > 0 else '--++--' if r1 > r0 else '------', round(relax,5), 'in' if newresnorm > resnorm else 'de', 100*abs(newresnorm/resnorm-1) ) )
+          if r1 <= r0 and d1 <= 0:
+            break
+          D = 2*r0 - 2*r1 + d0 + d1
+          if D > 0:
+            C = 3*r1 - 3*r0 - 2*d0 - d1
+            newrelax = ( numpy.sqrt(C**2-3*d0*D) - C ) / (3*D)
+            log.info( 'minimum based on 3rd order estimation: {:.3f}'.format(newrelax) )
+          else:
+            C = r1 - r0 - d0
+            # r1 > r0 => C > 0
+            # d1 > 0  => C = r1 - r0 - d0/2 - d0/2 > r1 - r0 - d0/2 - d1/2 = -D/2 > 0
+            newrelax = -.5 * d0 / C
+            log.info( 'minimum based on 2nd order estimation: {:.3f}'.format(newrelax) )
+          if newrelax > maxrelax:
+            break
+        relax *= max( newrelax, minrelax )
     lhs += relax * dlhs
+    steprelax, nlinesearch = relax, irelax+1
+    if newjac is not None:
+      jac = newjac
+    else:
+      res, jac = evaljac(lhs)
 
 
 @withsolve
-def pseudotime(target, residual, inertia, timestep, lhs0, residual0=None, constrain=None, *, arguments=None, **solveargs):
+def pseudotime(target, residual, inertia, timestep, lhs0, residual0=None, constrain=None, checkpoint=None, *, arguments=None, telemetry=None, **solveargs):
   '''iteratively solve nonlinear problem by pseudo time stepping
 
   Generates targets such that residual approaches 0 using hybrid of Newton and
@@ -381,10 +763,18 @@ def pseudotime(target, residual, inertia, timestep, lhs0, residual0=None, constr
       (boolean) or NaN (float). In the remaining positions the values of
       ``lhs0`` are returned unchanged (boolean) or overruled by the values in
       `constrain` (float).
+  checkpoint : :class:`str`
+      Name of a :class:`nutils.cache.Checkpoint` to which the state is saved
+      every iteration, and from which iterations resume if it exists and was
+      saved for the same problem. Optional.
   arguments : :class:`collections.abc.Mapping`
       Defines the values for :class:`nutils.function.Argument` objects in
       `residual`.  The ``target`` should not be present in ``arguments``.
       Optional.
+  telemetry : :class:`Telemetry`
+      Record of timings per phase and of the residual norm and time step per
+      iteration. Provided by :func:`withsolve` and accessible as
+      ``pseudotime(...).telemetry``.
 
   Yields
   ------
@@ -393,6 +783,8 @@ def pseudotime(target, residual, inertia, timestep, lhs0, residual0=None, constr
   '''
 
   assert target not in (arguments or {}), '`target` should not be defined in `arguments`'
+  if telemetry is None:
+    telemetry = Telemetry('pseudotime')
 
   jacobian0 = residual.derivative( target )
   jacobiant = inertia.derivative( target )
@@ -412,19 +804,40 @@ def pseudotime(target, residual, inertia, timestep, lhs0, residual0=None, constr
   zcons = util.NanVec(argshape[0])
   zcons[constrain] = 0
   lhs = lhs0.copy()
+  iiter = 0
+  thistimestep = timestep
+  resnorm0 = None
+  if checkpoint is not None:
+    key = _checkpointkey(target, residual, inertia, timestep, lhs0, constrain, arguments)
+    checkpoint = cache.Checkpoint(checkpoint, key, lhs=argshape, resnorm0=(), timestep=())
+    restart = checkpoint.load()
+    if restart:
+      iiter, state = restart
+      lhs = state['lhs']
+      resnorm0 = float(state['resnorm0'])
+      thistimestep = float(state['timestep'])
   fcache = cache.WrapperCache()
-  res, jac = Integral.multieval(residual, jacobian0+jacobiant/timestep, fcache=fcache, arguments=collections.ChainMap(arguments or {}, {target: lhs}))
-  resnorm = resnorm0 = numpy.linalg.norm( res[~constrain] )
+  with telemetry.timer('assembly'):
+    res, jac = Integral.multieval(residual, jacobian0+jacobiant/thistimestep, fcache=fcache, arguments=collections.ChainMap(arguments or {}, {target: lhs}))
+  resnorm = numpy.linalg.norm( res[~constrain] )
+  if resnorm0 is None:
+    resnorm0 = resnorm
   while True:
+    if checkpoint is not None:
+      checkpoint.save(iiter, lhs=lhs, resnorm0=resnorm0, timestep=thistimestep)
+    telemetry.record(resnorm=resnorm, timestep=thistimestep)
     yield lhs, resnorm
-    lhs -= jac.solve( res, constrain=zcons, **solveargs )
+    with telemetry.timer('solve'):
+      lhs -= jac.solve( res, constrain=zcons, **solveargs )
+    iiter += 1
     thistimestep = timestep * (resnorm0/resnorm)
     log.info( 'timestep: {:.0e}'.format(thistimestep) )
-    res, jac = Integral.multieval(residual, jacobian0+jacobiant/thistimestep, fcache=fcache, arguments=collections.ChainMap(arguments or {}, {target: lhs}))
+    with telemetry.timer('assembly'):
+      res, jac = Integral.multieval(residual, jacobian0+jacobiant/thistimestep, fcache=fcache, arguments=collections.ChainMap(arguments or {}, {target: lhs}))
     resnorm = numpy.linalg.norm( res[~constrain] )
 
 
-def thetamethod(target, residual, inertia, timestep, lhs0, theta, target0='_thetamethod_target0', constrain=None, newtontol=1e-10, *, arguments=None, **newtonargs):
+def thetamethod(target, residual, inertia, timestep, lhs0, theta, target0='_thetamethod_target0', constrain=None, newtontol=1e-10, checkpoint=None, nsteps=None, *, arguments=None, **newtonargs):
   '''solve time dependent problem using the theta method
 
   Parameters
@@ -434,7 +847,7 @@ def thetamethod(target, residual, inertia, timestep, lhs0, theta, target0='_thet
   residual : Integral
   inertia : Integral
   timestep : float
-      Initial time step, will scale up as residual decreases
+      Time step.
   lhs0 : vector
       Coefficient vector, starting point of the iterative procedure.
   theta : float
@@ -448,6 +861,14 @@ def thetamethod(target, residual, inertia, timestep, lhs0, theta, target0='_thet
       `constrain` (float).
   newtontol : float
       Residual tolerance of individual timesteps
+  checkpoint : :class:`str`
+      Name of a :class:`nutils.cache.Checkpoint` to which the state is saved
+      every timestep, and from which time stepping resumes if it exists and
+      was saved for the same problem. Iterations then start at the saved
+      step, so ``nsteps`` should be used to end at the same step as a fresh
+      run; a checkpoint beyond ``nsteps`` is not resumed. Optional.
+  nsteps : :class:`int`
+      Number of time steps, after which iterations end. Optional.
   arguments : :class:`collections.abc.Mapping`
       Defines the values for :class:`nutils.function.Argument` objects in
       `residual`.  The ``target`` should not be present in ``arguments``.
@@ -456,28 +877,409 @@ def thetamethod(target, residual, inertia, timestep, lhs0, theta, target0='_thet
   Yields
   ------
   vector
-      Coefficient vector for all timesteps after the initial condition.
+      Coefficient vector for all timesteps, starting with the initial
+      condition or the restored checkpoint.
+  '''
+
+  assert target != target0, '`target` should not be equal to `target0`'
+  assert target not in (arguments or {}), '`target` should not be defined in `arguments`'
+  assert target0 not in (arguments or {}), '`target0` should not be defined in `arguments`'
+  lhs = lhs0
+  istep = 0
+  if checkpoint is not None:
+    key = _checkpointkey(target, residual, inertia, timestep, lhs0, theta, target0, constrain, arguments)
+    checkpoint = cache.Checkpoint(checkpoint, key, lhs=lhs0.shape)
+    restart = checkpoint.load()
+    if restart and (nsteps is None or restart[0] <= nsteps):
+      istep, state = restart
+      lhs = state['lhs']
+  res = _thetaresidual(target, residual, inertia, timestep, theta, target0, lhs.shape)
+  while True:
+    if checkpoint is not None:
+      checkpoint.save(istep, lhs=lhs)
+    yield lhs
+    if nsteps is not None and istep >= nsteps:
+      return
+    lhs = newton(target, residual=res, lhs0=lhs, constrain=constrain, arguments=collections.ChainMap(arguments or {}, {target0: lhs}), **newtonargs).solve(tol=newtontol)
+    istep += 1
+
+
+def adaptivethetamethod(target, residual, inertia, timestep, lhs0, theta, errortol, target0='_thetamethod_target0', constrain=None, newtontol=1e-10, checkpoint=None, endtime=None, *, arguments=None, **newtonargs):
+  '''solve time dependent problem using the theta method with adaptive time step
+
+  The time step is adapted to keep the estimated local error below
+  tolerance. The error is estimated by comparing the solution to a linear
+  extrapolation of the previous two time steps; a step that exceeds the
+  tolerance is rejected and retried with a smaller time step, and accepted
+  steps set the next time step by proportional-integral control.
+
+  Parameters
+  ----------
+  target : :class:`str`
+      Name of the target: a :class:`nutils.function.Argument` in ``residual``.
+  residual : Integral
+  inertia : Integral
+  timestep : float
+      Initial time step.
+  lhs0 : vector
+      Coefficient vector, starting point of the iterative procedure.
+  theta : float
+      Theta value (theta=1 for implicit Euler, theta=0.5 for Crank-Nicolson)
+  errortol : float
+      Tolerance for the estimated local error of a time step, relative to the
+      norm of the coefficient vector.
+  constrain : boolean or float vector
+      Equal length to ``lhs0``, masks the free vector entries as ``False``
+      (boolean) or NaN (float). In the remaining positions the values of
+      ``lhs0`` are returned unchanged (boolean) or overruled by the values in
+      `constrain` (float).
+  newtontol : float
+      Residual tolerance of individual timesteps
+  checkpoint : :class:`str`
+      Name of a :class:`nutils.cache.Checkpoint` to which the state is saved
+      every timestep, and from which time stepping resumes if it exists and
+      was saved for the same problem, such that ``endtime`` should be used to
+      end at the same time as a fresh run. Optional.
+  endtime : float
+      Time at which iterations end; the last time step is shortened to end
+      exactly at this time. Optional.
+  arguments : :class:`collections.abc.Mapping`
+      Defines the values for :class:`nutils.function.Argument` objects in
+      `residual`.  The ``target`` should not be present in ``arguments``.
+      Optional.
+
+  Yields
+  ------
+  float, vector
+      Tuple of time and coefficient vector for all timesteps, starting with
+      the initial condition or the restored checkpoint.
   '''
 
   assert target != target0, '`target` should not be equal to `target0`'
   assert target not in (arguments or {}), '`target` should not be defined in `arguments`'
   assert target0 not in (arguments or {}), '`target0` should not be defined in `arguments`'
+
+  # the inverse time step enters the residual as an argument such that the
+  # integral, and its linear splitting, are shared between all time steps
+  invdt = '_thetamethod_invtimestep'
+  assert invdt not in (arguments or {}), '{!r} should not be defined in `arguments`'.format(invdt)
+  scaledinertia = Integral([di, integrand * function.Argument(invdt, ())] for di, integrand in inertia._integrands.items())
+  res0 = residual * theta + scaledinertia
+  res1 = residual * (1-theta) - scaledinertia
+  res = res0 + res1.replace({target: function.Argument(target0, lhs0.shape)})
+  istep = 0
+  t = 0
   lhs = lhs0
+  dt = timestep
+  prev = None # time step and coefficient vector preceding lhs
+  errprev = errortol
+  if checkpoint is not None:
+    key = _checkpointkey(target, residual, inertia, timestep, lhs0, theta, errortol, target0, constrain, arguments)
+    checkpoint = cache.Checkpoint(checkpoint, key, lhs=lhs0.shape, prevlhs=lhs0.shape, time=(), timestep=(), prevtimestep=(), errprev=())
+    restart = checkpoint.load()
+    if restart:
+      istep, state = restart
+      lhs = state['lhs']
+      t = float(state['time'])
+      dt = float(state['timestep'])
+      errprev = float(state['errprev'])
+      if istep:
+        prev = float(state['prevtimestep']), state['prevlhs']
+      if endtime is not None and t > endtime:
+        log.info( 'checkpoint lies beyond end time; starting over' )
+        istep, t, lhs, dt, prev, errprev = 0, 0, lhs0, timestep, None, errortol
+  while True:
+    if checkpoint is not None:
+      prevdt, prevlhs = prev or (0, lhs)
+      checkpoint.save(istep, lhs=lhs, prevlhs=prevlhs, time=t, timestep=dt, prevtimestep=prevdt, errprev=errprev)
+    yield t, lhs
+    if endtime is not None:
+      if t >= endtime - 1e-12 * timestep:
+        return
+      dt = min(dt, endtime - t)
+    while True:
+      if dt < 1e-12 * timestep:
+        raise ModelError( 'time step vanished at time {}'.format(t) )
+      try:
+        newlhs = newton(target, residual=res, lhs0=lhs, constrain=constrain, arguments=collections.ChainMap(arguments or {}, {target0: lhs, invdt: numpy.array(1/dt)}), **newtonargs).solve(tol=newtontol)
+      except ModelError:
+        log.info( 'newton failed to converge; rejected time step {:.2e}'.format(dt) )
+        dt /= 2
+        continue
+      if prev is None: # no error estimate for the first step
+        err = None
+        break
+      prevdt, prevlhs = prev
+      predicted = lhs + (lhs - prevlhs) * (dt / prevdt)
+      err = max( dt / (dt+prevdt) * numpy.linalg.norm(newlhs-predicted) / (numpy.linalg.norm(newlhs) or 1), 1e-10 * errortol )
+      if err <= errortol:
+        break
+      log.info( 'error {:.2e} exceeds tolerance; rejected time step {:.2e}'.format(err, dt) )
+      dt *= max( .9 * (errortol/err)**.5, .2 )
+    istep += 1
+    t += dt
+    prev = dt, lhs
+    lhs = newlhs
+    log.info( 'time {:.2e}, time step {:.2e}'.format(t, dt) )
+    if err is not None:
+      dt *= min( max( .9 * (errortol/err)**.15 * (errprev/err)**.2, .2 ), 5 )
+      errprev = err
+
+
+def _thetaresidual(target, residual, inertia, timestep, theta, target0, shape):
+  'residual of a single theta method time step from ``target0`` to ``target``'
+
   res0 = residual * theta + inertia / timestep
   res1 = residual * (1-theta) - inertia / timestep
-  res = res0 + res1.replace({target: function.Argument(target0, lhs.shape)})
-  jac = res.derivative(target)
+  return res0 + res1.replace({target: function.Argument(target0, shape)})
+
+
+def _checkpointkey(*items):
+  'digest that identifies the problem of a checkpoint; integrals are represented by their domains and integrands'
+
+  return cache.digest([[(ischeme, tuple((elem.reference, elem.transform) for elem in domain), integrand) for (domain, ischeme), integrand in item._integrands.items()] if isinstance(item, Integral) else item for item in items])
+
+
+def parareal(target, residual, inertia, timestep, lhs0, theta, nsubsteps, nslices=None, target0='_thetamethod_target0', constrain=None, newtontol=1e-10, tol=1e-8, *, arguments=None, **newtonargs):
+  '''solve time dependent problem using the parareal algorithm
+
+  Integrates the same problem as :func:`thetamethod`, in windows of
+  ``nslices`` time slices of ``nsubsteps`` time steps each. In every window a
+  coarse propagator, taking a single theta method step per slice, provides the
+  initial state of all slices. The fine propagators then integrate all slices
+  concurrently using ``nprocs`` processes, after which the slice states are
+  corrected by a sequential coarse sweep. Iterations stop when the fine
+  solution of every slice connects to the initial state of the next slice
+  within tolerance, which is guaranteed after ``nslices`` iterations.
+
+  Parameters
+  ----------
+  target : :class:`str`
+      Name of the target: a :class:`nutils.function.Argument` in ``residual``.
+  residual : Integral
+  inertia : Integral
+  timestep : float
+      Time step of the fine propagator.
+  lhs0 : vector
+      Coefficient vector, starting point of the iterative procedure.
+  theta : float
+      Theta value (theta=1 for implicit Euler, theta=0.5 for Crank-Nicolson)
+  nsubsteps : :class:`int`
+      Number of fine time steps per time slice, or the ratio of the coarse and
+      fine time steps.
+  nslices : :class:`int`
+      Number of time slices per window; defaults to ``nprocs``.
+  constrain : boolean or float vector
+      Equal length to ``lhs0``, masks the free vector entries as ``False``
+      (boolean) or NaN (float). In the remaining positions the values of
+      ``lhs0`` are returned unchanged (boolean) or overruled by the values in
+      `constrain` (float).
+  newtontol : float
+      Residual tolerance of individual timesteps
+  tol : float
+      Tolerance for the mismatch between consecutive time slices, relative to
+      the norm of the coefficient vector.
+  arguments : :class:`collections.abc.Mapping`
+      Defines the values for :class:`nutils.function.Argument` objects in
+      `residual`.  The ``target`` should not be present in ``arguments``.
+      Optional.
+
+  Yields
+  ------
+  vector
+      Coefficient vector for all fine timesteps after the initial condition.
+  '''
+
+  assert target != target0, '`target` should not be equal to `target0`'
+  assert target not in (arguments or {}), '`target` should not be defined in `arguments`'
+  assert target0 not in (arguments or {}), '`target0` should not be defined in `arguments`'
+  nprocs = core.getprop('nprocs', 1)
+  if nslices is None:
+    nslices = max(nprocs, 2)
+  finres = _thetaresidual(target, residual, inertia, timestep, theta, target0, lhs0.shape)
+  coarseres = _thetaresidual(target, residual, inertia, timestep*nsubsteps, theta, target0, lhs0.shape)
+  step = lambda res, lhs: newton(target, residual=res, lhs0=lhs, constrain=constrain, arguments=collections.ChainMap(arguments or {}, {target0: lhs}), **newtonargs).solve(tol=newtontol)
+  fine = (parallel.shzeros if nprocs > 1 else numpy.zeros)((nslices, nsubsteps)+lhs0.shape)
+  lhs = lhs0
+  yield lhs
   while True:
-    yield lhs
-    lhs = newton(target, residual=res, jacobian=jac, lhs0=lhs, constrain=constrain, arguments=collections.ChainMap(arguments or {}, {target0: lhs}), **newtonargs).solve(tol=newtontol)
+    # initial coarse sweep
+    coarse = [] # coarse propagation of every slice's initial state
+    start = [lhs]
+    for islice in range(nslices):
+      coarse.append(step(coarseres, start[-1]))
+      start.append(coarse[-1])
+    finestart = [None] * nslices # initial states of the current fine solutions
+    for iiter in log.count('iter'):
+      todo = [islice for islice in range(nslices) if finestart[islice] is None or not numpy.equal(finestart[islice], start[islice]).all()]
+      for islice in parallel.pariter(log.iter('slice', todo), nprocs):
+        fine[islice,0] = step(finres, start[islice])
+        for isubstep in range(1, nsubsteps):
+          fine[islice,isubstep] = step(finres, fine[islice,isubstep-1])
+      for islice in todo:
+        finestart[islice] = start[islice]
+      mismatch = max(numpy.linalg.norm(fine[islice,-1]-start[islice+1]) / (numpy.linalg.norm(fine[islice,-1]) or 1) for islice in range(nslices))
+      log.info('mismatch: {:.2e}'.format(mismatch))
+      if mismatch <= tol or iiter == nslices-1:
+        break
+      # coarse correction sweep; the first slice starts from an exact state
+      start[1] = fine[0,-1].copy()
+      for islice in range(1, nslices):
+        newcoarse = step(coarseres, start[islice])
+        start[islice+1] = newcoarse + fine[islice,-1] - coarse[islice]
+        coarse[islice] = newcoarse
+    log.info('window converged in {} iterations'.format(iiter+1))
+    for islice in range(nslices):
+      for isubstep in range(nsubsteps):
+        yield fine[islice,isubstep].copy()
+    lhs = fine[-1,-1].copy()
 
 
 impliciteuler = functools.partial(thetamethod, theta=1)
 cranknicolson = functools.partial(thetamethod, theta=0.5)
+adaptiveimpliciteuler = functools.partial(adaptivethetamethod, theta=1)
+adaptivecranknicolson = functools.partial(adaptivethetamethod, theta=0.5)
+
+
+def continuation(target, residual, parameter, lhs0, parameter0, steplength, constrain=None, minsteplength=None, maxsteplength=None, newtontol=1e-10, maxiter=8, *, arguments=None):
+  '''trace a solution branch by pseudo-arclength continuation
+
+  Follows the solutions of ``residual`` as a function of the scalar argument
+  ``parameter``, starting from ``parameter0``. Every step predicts a point at
+  distance ``steplength`` along the secant of the previous two points (the
+  tangent for the first step), which is corrected by chord iterations on the
+  bordered system that augments the residual with the arclength constraint.
+  The factorization of the jacobian is reused for as long as the corrector
+  converges, and renewed at the last converged point otherwise. The step
+  length adapts to the number of corrector iterations. Because arclength
+  rather than the parameter is prescribed, branches are followed through
+  limit points.
+
+  Parameters
+  ----------
+  target : :class:`str`
+      Name of the target: a :class:`nutils.function.Argument` in ``residual``.
+  residual : Integral
+  parameter : :class:`str`
+      Name of the parameter: a scalar :class:`nutils.function.Argument` in
+      ``residual``.
+  lhs0 : vector
+      Coefficient vector, starting point for the solution at ``parameter0``.
+  parameter0 : float
+      Initial parameter value.
+  steplength : float
+      Initial arclength of a continuation step. A negative value continues in
+      the direction of decreasing parameter value.
+  constrain : boolean or float vector
+      Equal length to ``lhs0``, masks the free vector entries as ``False``
+      (boolean) or NaN (float). In the remaining positions the values of
+      ``lhs0`` are returned unchanged (boolean) or overruled by the values in
+      `constrain` (float).
+  minsteplength : float
+      Step length below which continuation fails; defaults to ``1e-6`` times
+      the initial step length.
+  maxsteplength : float
+      Upper bound for the step length; defaults to 10 times the initial step
+      length.
+  newtontol : float
+      Residual tolerance of the corrector.
+  maxiter : :class:`int`
+      Maximum number of corrector iterations.
+  arguments : :class:`collections.abc.Mapping`
+      Defines the values for :class:`nutils.function.Argument` objects in
+      `residual`.  The ``target`` and ``parameter`` should not be present in
+      ``arguments``. Optional.
+
+  Yields
+  ------
+  :class:`tuple`
+      Parameter value and coefficient vector of successive points on the
+      branch, starting with the converged initial point.
+  '''
+
+  assert target != parameter, '`target` should not be equal to `parameter`'
+  assert target not in (arguments or {}), '`target` should not be defined in `arguments`'
+  assert parameter not in (arguments or {}), '`parameter` should not be defined in `arguments`'
+  assert residual._argshape(parameter) == (), '`parameter` should be a scalar argument'
+  if minsteplength is None:
+    minsteplength = 1e-6 * abs(steplength)
+  if maxsteplength is None:
+    maxsteplength = 10 * abs(steplength)
+
+  lhs = newton(target, residual, lhs0=lhs0, constrain=constrain, arguments=collections.ChainMap(arguments or {}, {parameter: numpy.array(parameter0)})).solve(tol=newtontol)
+  cons = numpy.zeros(lhs.shape)
+  if constrain is None:
+    cons[:] = numpy.nan
+  else:
+    cons[numpy.isnan(constrain) if constrain.dtype == float else ~constrain] = numpy.nan
+  free = numpy.isnan(cons)
+  jacobian = residual.derivative(target)
+  dresidual = residual.derivative(parameter)
+  fcache = cache.WrapperCache()
+  getarguments = lambda lhs, p: collections.ChainMap(arguments or {}, {target: lhs, parameter: numpy.array(p)})
+
+  def factorize(lhs, p):
+    'factorization of the jacobian on the free entries'
+    jac, = Integral.multieval(jacobian, fcache=fcache, arguments=getarguments(lhs, p))
+    return jac.getprecon('splu', constrain=cons)
+
+  p = parameter0
+  factor = factorize(lhs, p)
+  fresh = True # factorization is computed at the current point
+  res, dres = Integral.multieval(residual, dresidual, fcache=fcache, arguments=getarguments(lhs, p))
+  du = -factor.matvec(dres[free])
+  tangent = numpy.hstack([du, 1]) * numpy.sign(steplength) / numpy.sqrt(du.dot(du)+1)
+  ds = abs(steplength)
+  yield p, lhs
+
+  while True:
+    point = numpy.hstack([lhs[free], p])
+    predicted = point + ds * tangent
+    corrected = predicted.copy()
+    resnorm = numpy.inf
+    for iiter in range(maxiter):
+      full = lhs.copy()
+      full[free] = corrected[:-1]
+      res, dres = Integral.multieval(residual, dresidual, fcache=fcache, arguments=getarguments(full, corrected[-1]))
+      prevnorm, resnorm = resnorm, numpy.linalg.norm(res[free])
+      if resnorm < newtontol or resnorm > .5 * prevnorm:
+        break
+      # bordered solve: [J dres; tangent] [du; dp] = -[res; constraint]
+      a = factor.matvec(res[free])
+      b = factor.matvec(dres[free])
+      g = tangent.dot(corrected - predicted)
+      dp = (tangent[:-1].dot(a) - g) / (tangent[-1] - tangent[:-1].dot(b))
+      corrected -= numpy.hstack([a + b * dp, -dp])
+    if resnorm >= newtontol:
+      if not fresh:
+        log.info('corrector failed with residual {:.2e}; renewing factorization'.format(resnorm))
+        factor = factorize(lhs, p)
+        fresh = True
+      elif ds / 2 < minsteplength:
+        raise ModelError('continuation step vanished at parameter {}'.format(p))
+      else:
+        log.info('corrector failed with residual {:.2e}; rejected step length {:.2e}'.format(resnorm, ds))
+        ds /= 2
+      continue
+    secant = corrected - point
+    tangent = secant / numpy.linalg.norm(secant)
+    lhs = full
+    p = corrected[-1]
+    log.info('parameter {:.4e}, step length {:.2e}, {} corrector iterations'.format(p, ds, iiter))
+    yield p, lhs
+    if iiter > maxiter // 2 and not fresh: # slow convergence due to an outdated factorization
+      factor = factorize(lhs, p)
+      fresh = True
+      continue
+    if iiter > maxiter * 3 // 4:
+      ds /= 1.5
+    elif iiter <= maxiter // 4:
+      ds = min(ds * 1.5, maxsteplength)
+    fresh = False
 
 
 @log.title
-def optimize(target, functional, droptol=None, lhs0=None, constrain=None, newtontol=None, *, arguments=None):
+def optimize(target, functional, droptol=None, lhs0=None, constrain=None, newtontol=None, hessianfree=False, *, arguments=None):
   '''find the minimizer of a given functional
 
   Parameters
@@ -499,6 +1301,10 @@ def optimize(target, functional, droptol=None, lhs0=None, constrain=None, newton
       `constrain` (float).
   newtontol : float
       Residual tolerance of Newton procedure (if applicable)
+  hessianfree : :class:`bool`
+      Minimize by truncated Newton-CG iterations that require only gradients
+      and Hessian-vector products, rather than assembling the Hessian.
+      Requires ``newtontol``; does not support ``droptol``.
 
   Yields
   ------
@@ -520,6 +1326,12 @@ def optimize(target, functional, droptol=None, lhs0=None, constrain=None, newton
     if constrain.dtype == float:
       lhs0 = numpy.choose(numpy.isnan(constrain), [constrain, lhs0])
       constrain = ~numpy.isnan(constrain)
+  if hessianfree:
+    assert droptol is None, '`droptol` is not supported in hessian free mode'
+    assert newtontol is not None, 'newton tolerance `newtontol` must be specified in hessian free mode'
+    lhs, value = _newtoncg(target, functional, lhs0, constrain, newtontol, arguments or {})
+    log.info('optimum: {:.2e}'.format(value))
+    return lhs
   residual = functional.derivative(target)
   jacobian = residual.derivative(target)
   f0, res, jac = Integral.multieval(functional, residual, jacobian, arguments=collections.ChainMap(arguments or {}, {target: lhs0}))
@@ -537,3 +1349,174 @@ def optimize(target, functional, droptol=None, lhs0=None, constrain=None, newton
   log.info('optimum: {:.2e}'.format(value))
   lhs[nandofs] = numpy.nan
   return lhs
+
+
+def _newtoncg(target, functional, lhs0, constrain, tol, arguments, armijo=1e-4, maxiter=None):
+  '''hessian free minimization by truncated Newton-CG
+
+  The search direction solves the Newton system by conjugate gradients up to
+  a forcing tolerance, with Hessian-vector products obtained as directional
+  derivatives of the gradient. The conjugate gradients are capped at
+  ``maxiter`` iterations, by default the number of free dofs, beyond which the
+  truncated direction is used. Steps are backtracked until the Armijo
+  condition holds.'''
+
+  gradient = functional.derivative(target)
+  direction = '_optimize_direction'
+  hessvec = gradient.directionalderivative(target, direction)
+  free = ~constrain
+  if maxiter is None:
+    maxiter = free.sum() # exact arithmetic converges within as many iterations
+  lhs = lhs0.copy()
+  fcache = cache.WrapperCache()
+  value, grad = Integral.multieval(functional, gradient, fcache=fcache, arguments=collections.ChainMap(arguments, {target: lhs}))
+  for inewton in itertools.count():
+    grad[constrain] = 0
+    gradnorm = numpy.linalg.norm(grad)
+    log.info('iter {}: value {:.2e}, gradient {:.2e}'.format(inewton, value, gradnorm))
+    if gradnorm <= tol:
+      return lhs, value
+    # truncated conjugate gradients for hessian * dlhs = -gradient
+    cgtol = min(.5, numpy.sqrt(gradnorm)) * gradnorm
+    dlhs = numpy.zeros_like(lhs)
+    r = -grad
+    d = r.copy()
+    for icg in range(maxiter):
+      Hd = hessvec.eval(fcache=fcache, arguments=collections.ChainMap(arguments, {target: lhs, direction: d}))
+      Hd[constrain] = 0
+      dHd = numpy.dot(d, Hd)
+      if dHd <= 0: # negative curvature
+        if icg == 0:
+          dlhs = d
+        break
+      rr = numpy.dot(r, r)
+      alpha = rr / dHd
+      dlhs += alpha * d
+      r -= alpha * Hd
+      if numpy.linalg.norm(r) <= cgtol:
+        break
+      d = r + (numpy.dot(r, r) / rr) * d
+    else: # a truncated direction remains a descent direction
+      log.warning('conjugate gradients did not converge in {} iterations'.format(maxiter))
+    log.info('search direction from {} conjugate gradient iterations'.format(icg+1))
+    slope = numpy.dot(grad, dlhs)
+    relax = 1
+    while True:
+      newvalue, newgrad = Integral.multieval(functional, gradient, fcache=fcache, arguments=collections.ChainMap(arguments, {target: lhs+relax*dlhs}))
+      if newvalue <= value + armijo * relax * slope:
+        break
+      if relax < 1e-10:
+        raise ModelError('line search failed to decrease functional')
+      relax /= 2
+    lhs += relax * dlhs
+    value, grad = newvalue, newgrad
+
+
+class ROM:
+  '''reduced order model of a linear problem with affine parameter dependence
+
+  The residual is decomposed with :meth:`Integral.affine` in terms that are
+  affine in the scalar arguments ``parameters``, whose vectors and matrices
+  are assembled once. Solutions for a set of parameter values, obtained with
+  :meth:`snapshot`, span a reduced basis by proper orthogonal decomposition in
+  :meth:`build`. Subsequent calls to :meth:`solve` project the affine terms
+  onto this basis and solve a small dense system.
+
+  Parameters
+  ----------
+  target : :class:`str`
+      Name of the target: a :class:`nutils.function.Argument` in ``residual``.
+  residual : Integral
+      Residual integral, linear in ``target`` and affine in ``parameters``.
+  parameters : sequence of :class:`str`
+      Names of scalar :class:`nutils.function.Argument` objects.
+  constrain : float vector
+      Defines the fixed entries of the coefficient vector, independent of the
+      parameters.
+  arguments : :class:`collections.abc.Mapping`
+      Defines the values for other :class:`nutils.function.Argument` objects
+      in `residual`. Optional.
+  '''
+
+  def __init__(self, target, residual, parameters, constrain=None, *, arguments=None):
+    assert target not in (arguments or {}), '`target` should not be defined in `arguments`'
+    assert not any(name in (arguments or {}) for name in parameters), '`parameters` should not be defined in `arguments`'
+    if residual.derivative(target).contains(target):
+      raise ModelError('problem is not linear')
+    self.target = target
+    self.residual = residual
+    self.parameters = tuple(parameters)
+    self.arguments = arguments or {}
+    argshape = residual._argshape(target)
+    assert len(argshape) == 1, 'target should be a vector'
+    self.lift = numpy.zeros(argshape)
+    self.free = numpy.ones(argshape, dtype=bool)
+    if constrain is not None:
+      self.free = numpy.isnan(constrain)
+      self.lift[~self.free] = constrain[~self.free]
+    components = residual.affine(self.parameters)
+    names = tuple(components)
+    integrals = [components[name] for name in names]
+    islinear = [integral.contains(target) for integral in integrals]
+    with log.context('offline'):
+      values = Integral.multieval(*integrals, *[integral.derivative(target) for integral, linear in zip(integrals, islinear) if linear], arguments=collections.ChainMap(self.arguments, {target: numpy.zeros(argshape)}))
+    matrices = iter(values[len(names):])
+    self.affine = [(name, vec, next(matrices) if linear else None) for name, vec, linear in zip(names, values, islinear)]
+    self.snapshots = []
+    self.basis = None
+
+  def _theta(self, name, parameters):
+    return 1 if name is None else parameters[name]
+
+  def _checkparameters(self, parameters):
+    assert sorted(parameters) == sorted(self.parameters), 'expected values for {}'.format(', '.join(self.parameters))
+
+  def snapshot(self, **parameters):
+    'full order solution, stored for the reduced basis'
+
+    self._checkparameters(parameters)
+    res = sum(self._theta(name, parameters) * vec for name, vec, mat in self.affine)
+    jac = functools.reduce(operator.add, [mat * self._theta(name, parameters) for name, vec, mat in self.affine if mat is not None])
+    cons = numpy.where(self.free, numpy.nan, self.lift)
+    lhs = jac.solve(-res, constrain=cons)
+    self.snapshots.append(lhs)
+    return lhs
+
+  def build(self, tol=1e-8, maxsize=None):
+    '''construct reduced basis from snapshots
+
+    Retains the left singular vectors of the lifted snapshot matrix with
+    singular values above ``tol`` relative to the largest, up to ``maxsize``
+    vectors, and projects the affine terms onto them.'''
+
+    assert self.snapshots, 'no snapshots available'
+    U, S, V = numpy.linalg.svd(numpy.stack(self.snapshots, axis=1) - self.lift[:,_], full_matrices=False)
+    size = numpy.sum(S > tol * S[0])
+    if maxsize is not None:
+      size = min(size, maxsize)
+    log.info('reduced basis of size {} from {} snapshots'.format(size, len(self.snapshots)))
+    self.basis = U[:,:size]
+    self.reduced = []
+    for name, vec, mat in self.affine:
+      if mat is not None:
+        MV = numpy.stack([mat.matvec(v) for v in self.basis.T], axis=1)
+        vec = vec + mat.matvec(self.lift)
+        mat = self.basis.T.dot(MV)
+      self.reduced.append((name, self.basis.T.dot(vec), mat))
+
+  def solve(self, **parameters):
+    'reduced order solution'
+
+    assert self.basis is not None, 'reduced basis not built'
+    self._checkparameters(parameters)
+    res = sum(self._theta(name, parameters) * vec for name, vec, mat in self.reduced)
+    jac = sum(self._theta(name, parameters) * mat for name, vec, mat in self.reduced if mat is not None)
+    return self.lift + self.basis.dot(numpy.linalg.solve(jac, -res))
+
+  def errorindicator(self, lhs, **parameters):
+    'norm of the full residual over the free entries'
+
+    self._checkparameters(parameters)
+    arguments = {name: numpy.array(float(value)) for name, value in parameters.items()}
+    res = self.residual.eval(arguments=collections.ChainMap(self.arguments, arguments, {self.target: lhs}))
+    return numpy.linalg.norm(res[self.free])
@@ -28,11 +28,19 @@ import warnings, functools, collections.abc, itertools, functools, operator
 
 _identity = lambda x: x
 
+# bounds for function caches that live for a single sweep over the elements;
+# caching is disabled for functions that are rarely called with repeated
+# arguments, as is typical for unstructured and trimmed meshes
+_sweepcache = functools.partial( cache.WrapperCache, maxbytes=2**28, minhitrate=.05 )
+_persistent = functools.partial( cache.persistent, 'topologies', 'topocache' ) # stores topologies and bases if topocache is set
+
 class Topology( object ):
   'topology base class'
 
   # subclass needs to implement: .elements
 
+  _persistkey = None # set for topologies that are stored on disk, see cache.persistent
+
   def __init__( self, ndims ):
     'constructor'
 
@@ -124,6 +132,7 @@ class Topology( object ):
   bubblefunc  = lambda self, *args, **kwargs: self.basis( 'bubble', *args, **kwargs )
   discontfunc = lambda self, *args, **kwargs: self.basis( 'discont', *args, **kwargs )
 
+  @_persistent()
   def basis( self, name, *args, **kwargs ):
     if self.ndims == 0:
       return function.asarray( [1] )
@@ -135,7 +144,7 @@ class Topology( object ):
   def elem_eval( self, funcs, ischeme, separate=False, geometry=None, asfunction=False, edit=_identity, *, arguments=None ):
     'element-wise evaluation'
 
-    fcache = cache.WrapperCache()
+    fcache = _sweepcache()
 
     assert not separate or not asfunction, '"separate" and "asfunction" are mutually exclusive'
     if geometry:
@@ -198,20 +207,34 @@ class Topology( object ):
     retvals = self.elem_eval( (1,)+funcs, geometry=geometry, ischeme=ischeme, arguments=arguments )
     return [ v / retvals[0][(slice(None),)+(_,)*(v.ndim-1)] for v in retvals[1:] ]
 
-  def _integrate( self, funcs, ischeme, fcache=None, arguments=None ):
+  def _integrate( self, funcs, ischeme, fcache=None, arguments=None, dtype=float, ensemble=False ):
 
     if arguments is None:
       arguments = {}
 
+    # In ensemble mode all arguments have a leading batch axis. Members share
+    # the evaluation of argument independent functions and the index arrays.
+
+    if ensemble:
+      assert arguments, 'ensemble mode requires arguments with a leading batch axis'
+      lengths = { name: len(value) for name, value in arguments.items() }
+      assert len( set( lengths.values() ) ) == 1, 'ensemble arguments differ in number of members: {}'.format( ', '.join( '{}={}'.format( name, n ) for name, n in sorted( lengths.items() ) ) )
+      nmembers, = set( lengths.values() )
+      members = [ { name: numpy.asarray( value )[imember,...] for name, value in arguments.items() } for imember in range(nmembers) ]
+      arguments = members[0]
+
     # Functions may consist of several blocks, such as originating from
     # chaining. Here we make a list of all blocks consisting of triplets of
-    # argument id, evaluable index, and evaluable values.
+    # argument id, evaluable index, and evaluable values, and the functions
+    # for block sizes and values. With the treecache property set these are
+    # stored on disk, together with their evaluation plans.
 
-    blocks = [(ifunc, function.Tuple(ind), f.simplified)
-      for ifunc, func in enumerate(funcs)
-        for ind, f in function.blocks(function.zero_argument_derivatives(func))]
-
-    block2func, indices, values = zip( *blocks ) if blocks else ([],[],[])
+    compute = functools.partial( _integrationplan, funcs )
+    block2func, indices, values, sizefunc, valueindexfunc, plans = cache.persist( 'integrationplans', funcs, compute ) if core.getprop( 'treecache', False ) else compute()
+    for func, ordereddeps, dependencytree in plans:
+      if 'ordereddeps' not in func.__dict__:
+        func.ordereddeps = ordereddeps
+        func.dependencytree = dependencytree
 
     log.debug( 'integrating %s distinct blocks' % '+'.join(
       str(block2func.count(ifunc)) for ifunc in range(len(funcs)) ) )
@@ -220,15 +243,14 @@ class Topology( object ):
       function.Tuple(values).graphviz()
 
     if fcache is None:
-      fcache = cache.WrapperCache()
+      fcache = _sweepcache()
 
     # To allocate (shared) memory for all block data we evaluate indexfunc to
     # build an nblocks x nelems+1 offset array, and nblocks index lists of
     # length nelems.
 
-    offsets = numpy.zeros((len(blocks), len(self)+1), dtype=int)
-    if blocks:
-      sizefunc = function.stack([f.size for ifunc, ind, f in blocks]).simplified
+    offsets = numpy.zeros((len(values), len(self)+1), dtype=int)
+    if values:
       for ielem, elem in enumerate(self):
         n, = sizefunc.eval(_transforms=(elem.transform, elem.opposite), _cache=fcache, **arguments)
         offsets[:,ielem+1] = offsets[:,ielem] + n
@@ -248,7 +270,7 @@ class Topology( object ):
     nprocs = min( core.getprop( 'nprocs', 1 ), len(self) )
     empty = parallel.shzeros if nprocs > 1 else numpy.empty
     data_index = [
-      ( empty( n, dtype=float ),
+      ( empty( (nmembers,n) if ensemble else n, dtype=dtype ),
         empty( (funcs[ifunc].ndim,n), dtype=int ) )
             for ifunc, n in enumerate(nvals) ]
 
@@ -258,15 +280,20 @@ class Topology( object ):
     # data_index is filled in the same loop. It does not use valuefunc data but
     # benefits from parallel speedup.
 
-    valueindexfunc = function.Tuple(function.Tuple([value]+list(index)) for value, index in zip(values, indices))
     for ielem, elem in parallel.pariter( log.enumerate( 'elem', self ), nprocs=nprocs ):
       ipoints, iweights = ischeme[elem] if isinstance(ischeme,collections.abc.Mapping) else fcache[elem.reference.getischeme]( ischeme )
       assert iweights is not None, 'no integration weights found'
-      for iblock, (intdata, *indices) in enumerate(valueindexfunc.eval(_transforms=(elem.transform, elem.opposite), _points=ipoints, _cache=fcache, **arguments)):
+      evalargs = dict( _transforms=(elem.transform, elem.opposite), _points=ipoints, _cache=fcache )
+      if ensemble:
+        membervalues = valueindexfunc.evalensemble( members, **evalargs )
+      else:
+        membervalues = [ valueindexfunc.eval( **evalargs, **arguments ) ]
+      for iblock, blockvalues in enumerate( zip( *membervalues ) ):
         s = slice(*offsets[iblock,ielem:ielem+2])
         data, index = data_index[ block2func[iblock] ]
-        w_intdata = numeric.dot( iweights, intdata )
-        data[s] = w_intdata.ravel()
+        for imember, (intdata, *indices) in enumerate( blockvalues ):
+          w_intdata = numeric.dot( iweights, intdata )
+          ( data[imember] if ensemble else data )[s] = w_intdata.ravel()
         si = (slice(None),) + (_,) * (w_intdata.ndim-1)
         for idim, (ii,) in enumerate(indices):
           index[idim,s].reshape(w_intdata.shape)[...] = ii[si]
@@ -278,14 +305,20 @@ class Topology( object ):
 
   @log.title
   @core.single_or_multiple
-  def integrate( self, funcs, ischeme='gauss', degree=None, geometry=None, force_dense=False, fcache=None, edit=_identity, *, arguments=None ):
-    'integrate'
+  def integrate( self, funcs, ischeme='gauss', degree=None, geometry=None, force_dense=False, fcache=None, edit=_identity, *, arguments=None, dtype=float, ensemble=False ):
+    '''integrate
+
+    Values are assembled in ``dtype``; ``numpy.float32`` halves the memory of
+    matrices that only serve as preconditioner. If ``ensemble`` is true, all
+    ``arguments`` have a leading batch axis; the results are stacked arrays or
+    lists of matrices sharing one sparsity pattern, obtained from a single
+    element loop.'''
 
     if degree is not None:
       ischeme += str(degree)
     iwscale = function.J( geometry, self.ndims ) if geometry else 1
     integrands = [ function.asarray( edit( func * iwscale ) ) for func in funcs ]
-    data_index = self._integrate( integrands, ischeme, fcache, arguments )
+    data_index = self._integrate( integrands, ischeme, fcache, arguments, dtype, ensemble )
     return [ matrix.assemble( data, index, integrand.shape, force_dense ) for integrand, (data,index) in zip( integrands, data_index ) ]
 
   @log.title
@@ -313,23 +346,29 @@ class Topology( object ):
 
     if degree is not None:
       ischeme += str(degree)
+    fun = function.asarray( fun )
+    # a scalar basis onto which an array valued function is projected yields
+    # a block of coefficient vectors that share a single system matrix
+    extrashape = fun.shape if len( onto.shape ) == 1 else ()
     if constrain is None:
-      constrain = util.NanVec( onto.shape[0] )
+      constrain = util.NanVec( onto.shape[:1]+extrashape )
     else:
       constrain = constrain.copy()
     if exact_boundaries:
       constrain |= self.boundary.project( fun, onto, geometry, constrain=constrain, title='boundaries', ischeme=ischeme, tol=tol, droptol=droptol, ptype=ptype, edit=edit, arguments=arguments )
     assert isinstance( constrain, util.NanVec )
-    assert constrain.shape == onto.shape[:1]
+    assert constrain.shape == onto.shape[:1]+extrashape
+    assert not extrashape or ptype == 'lsqr', 'projection of array valued functions requires lsqr projection'
 
     avg_error = None # setting this depends on projection type
 
     if ptype == 'lsqr':
       assert ischeme is not None, 'please specify an integration scheme for lsqr-projection'
-      fun2 = function.asarray( fun )**2
+      fun2 = fun**2
       if len( onto.shape ) == 1:
         Afun = function.outer( onto )
-        bfun = onto * fun
+        bfun = onto[(...,)+(_,)*fun.ndim] * fun
+        fun2 = fun2.sum()
       elif len( onto.shape ) == 2:
         Afun = function.outer( onto ).sum( 2 )
         bfun = function.sum( onto * fun, -1 )
@@ -339,16 +378,21 @@ class Topology( object ):
         raise Exception
       assert fun2.ndim == 0
       A, b, f2, area = self.integrate( [Afun,bfun,fun2,1], geometry=geometry, ischeme=ischeme, edit=edit, arguments=arguments, title='building system' )
+      if extrashape:
+        b = ( b.toarray() if isinstance( b, matrix.Matrix ) else b ).reshape( b.shape[0], -1 )
       N = A.rowsupp(droptol)
+      if extrashape:
+        N = numpy.repeat( N[:,_], numpy.prod(extrashape), axis=1 ).reshape( constrain.shape )
       if numpy.equal(b, 0).all():
         constrain[~constrain.where&N] = 0
         avg_error = 0.
       else:
         solvecons = constrain.copy()
         solvecons[~(constrain.where|N)] = 0
-        u = A.solve( b, solvecons, tol=tol, symmetric=True, precon=precon, **solverargs )
+        u = A.solve( b, solvecons.reshape(b.shape), tol=tol, symmetric=True, precon=precon, **solverargs )
+        err2 = f2 - numpy.sum( (2*b-A.matvec(u)) * u ) # can be negative ~zero due to rounding errors
+        u = u.reshape( constrain.shape )
         constrain[N] = u[N]
-        err2 = f2 - numpy.dot( 2*b-A.matvec(u), u ) # can be negative ~zero due to rounding errors
         avg_error = numpy.sqrt( err2 ) / area if err2 > 0 else 0
 
     elif ptype == 'convolute':
@@ -412,6 +456,7 @@ class Topology( object ):
     simplices = [ simplex for elem in self for simplex in elem.simplices ]
     return UnstructuredTopology( self.ndims, simplices )
 
+  @_persistent()
   def refined_by( self, refine ):
     'create refined space by refining dofs in existing one'
 
@@ -441,13 +486,14 @@ class Topology( object ):
     return self if n <= 0 else self.refined.refine( n-1 )
 
   @log.title
+  @_persistent()
   def trim( self, levelset, maxrefine, ndivisions=8, name='trimmed', leveltopo=None, *, arguments=None ):
     'trim element along levelset'
 
     if arguments is None:
       arguments = {}
 
-    fcache = cache.WrapperCache()
+    fcache = _sweepcache()
     levelset = function.zero_argument_derivatives(levelset).simplified
     if leveltopo is None:
       ischeme = 'vertex{}'.format(maxrefine)
@@ -1832,6 +1878,7 @@ class HierarchicalTopology( Topology ):
     return UnstructuredTopology( self.ndims-1, interfaces )
 
   @log.title
+  @_persistent()
   def basis( self, name, *args, **kwargs ):
     'build hierarchical function space'
 
@@ -2149,6 +2196,18 @@ DimAxis.isdim = True
 BndAxis = collections.namedtuple( 'BndAxis', ['i','j','ibound','side'] )
 BndAxis.isdim = False
 
+def _integrationplan( funcs ):
+  'blocks of integrands, their size and value functions, and evaluation plans'
+
+  blocks = [(ifunc, function.Tuple(ind), f.simplified)
+    for ifunc, func in enumerate(funcs)
+      for ind, f in function.blocks(function.zero_argument_derivatives(func))]
+  block2func, indices, values = zip( *blocks ) if blocks else ([],[],[])
+  sizefunc = function.stack([f.size for f in values]).simplified if blocks else None
+  valueindexfunc = function.Tuple(function.Tuple([value]+list(index)) for value, index in zip(values, indices))
+  plans = [ ( func, func.ordereddeps, func.dependencytree ) for func in ( sizefunc, valueindexfunc ) if func is not None ]
+  return block2func, indices, values, sizefunc, valueindexfunc, plans
+
 def common_refine( topo1, topo2 ):
   assert topo1.ndims == topo2.ndims
   elements = []
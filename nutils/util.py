@@ -511,12 +511,50 @@ class frozenmultiset(collections.abc.Container):
 
   isdisjoint = lambda self, other: not any(item in self.__items for item in other)
 
+def binder(signature, annotations=()):
+  '''fast equivalent of binding arguments to a signature
+
+  Returns a function that takes arguments according to ``signature`` and
+  returns the tuple of all argument values with defaults applied, like
+  ``bound.args`` after :meth:`inspect.Signature.bind` and
+  :meth:`inspect.BoundArguments.apply_defaults`. Conversion functions in
+  ``annotations``, a sequence of ``(name, op)`` pairs, are applied to the
+  corresponding values. The function is generated from the signature, such
+  that binding costs a single python call. Returns None for signatures with
+  positional-only, variable or keyword-only parameters, which are not
+  supported.'''
+
+  params = list(signature.parameters.values())
+  if any(param.kind != param.POSITIONAL_OR_KEYWORD for param in params):
+    return None
+  namespace = {}
+  args = []
+  for i, param in enumerate(params):
+    if param.default is param.empty:
+      args.append(param.name)
+    else:
+      namespace['_default{}'.format(i)] = param.default
+      args.append('{}=_default{}'.format(param.name, i))
+  values = [param.name for param in params]
+  for name, op in annotations:
+    i = values.index(name)
+    namespace['_op{}'.format(i)] = op
+    values[i] = '_op{}({})'.format(i, name)
+  exec('def bind({}):\n  return {},'.format(', '.join(args), ', '.join(values)) if values else 'def bind():\n  return ()', namespace)
+  return namespace['bind']
+
 def enforcetypes(f, signature=None):
   if signature is None:
     signature = inspect.signature(f)
   annotations = [(param.name, param.annotation) for param in signature.parameters.values() if param.annotation != param.empty]
   if not annotations:
     return f
+  bind = binder(signature, annotations)
+  if bind is not None:
+    @functools.wraps(f)
+    def wrapped(*args, **kwargs):
+      return f(*bind(*args, **kwargs))
+    return wrapped
   @functools.wraps(f)
   def wrapped(*args, **kwargs):
     bound = signature.bind(*args, **kwargs)
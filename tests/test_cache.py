@@ -1,6 +1,6 @@
 from nutils import *
 from . import *
-import sys
+import sys, os, tempfile, numpy, inspect, subprocess, unittest.mock
 
 class refcount(TestCase):
 
@@ -15,3 +15,417 @@ class refcount(TestCase):
   def test_remove(self):
     keep = set(k for k, v in self.d.items() if sys.getrefcount(v) > 4)
     assert keep == {'referenced'}
+
+class checkpoint(ContextTestCase):
+
+  def setUpContext(self, stack):
+    super().setUpContext(stack)
+    self.cachedir = stack.enter_context(tempfile.TemporaryDirectory())
+
+  def test_empty(self):
+    __cachedir__ = self.cachedir
+    self.assertIsNone(cache.Checkpoint('test', x=[3]).load())
+
+  def test_restore(self):
+    __cachedir__ = self.cachedir
+    for i in range(5):
+      cache.Checkpoint('test', x=[3], t=()).save(i, x=numpy.arange(3)+i, t=i/2)
+    i, state = cache.Checkpoint('test', x=[3], t=()).load()
+    self.assertEqual(i, 4)
+    numpy.testing.assert_array_equal(state['x'], [4,5,6])
+    self.assertEqual(state['t'], 2)
+    self.assertEqual(os.path.getsize(os.path.join(self.cachedir, 'test')), 16+2*(16+4*8))
+
+  def test_interrupted(self):
+    __cachedir__ = self.cachedir
+    checkpoint = cache.Checkpoint('test', x=[3])
+    checkpoint.save(0, x=numpy.zeros(3))
+    checkpoint.save(1, x=numpy.ones(3))
+    checkpoint.slots['x'][(checkpoint.seq+1)%2] = numpy.nan # partial write of the next save
+    i, state = cache.Checkpoint('test', x=[3]).load()
+    self.assertEqual(i, 1)
+    numpy.testing.assert_array_equal(state['x'], 1)
+
+  def test_incompatible(self):
+    __cachedir__ = self.cachedir
+    cache.Checkpoint('test', x=[3]).save(0, x=numpy.zeros(3))
+    self.assertIsNone(cache.Checkpoint('test', x=[4]).load())
+
+  def test_key(self):
+    __cachedir__ = self.cachedir
+    cache.Checkpoint('test', 'a', x=[3]).save(0, x=numpy.zeros(3))
+    self.assertIsNone(cache.Checkpoint('test', 'b', x=[3]).load())
+    cache.Checkpoint('test', 'b', x=[3]).save(1, x=numpy.ones(3))
+    self.assertEqual(cache.Checkpoint('test', 'b', x=[3]).load()[0], 1)
+
+class filecache(ContextTestCase):
+
+  def setUpContext(self, stack):
+    super().setUpContext(stack)
+    self.cachedir = stack.enter_context(tempfile.TemporaryDirectory())
+    self.ncalls = 0
+
+  def array(self, n, scale=1):
+    self.ncalls += 1
+    return numpy.arange(n) * scale
+
+  def listing(self, n):
+    self.ncalls += 1
+    return list(range(n))
+
+  def test_orderindependent(self):
+    __cachedir__ = self.cachedir
+    fcache = cache.FileCache('test')
+    a = fcache(self.array, 3)
+    b = fcache(self.array, 4, scale=2)
+    self.assertEqual(self.ncalls, 2)
+    fcache = cache.FileCache('test')
+    numpy.testing.assert_array_equal(fcache(self.array, 4, scale=2), b)
+    numpy.testing.assert_array_equal(fcache(self.array, 3), a)
+    self.assertEqual(self.ncalls, 2)
+    fcache(self.array, 3, scale=3)
+    self.assertEqual(self.ncalls, 3)
+
+  def test_memmap(self):
+    __cachedir__ = self.cachedir
+    cache.FileCache('test')(self.array, 3)
+    a = cache.FileCache('test')(self.array, 3)
+    self.assertIsInstance(a, numpy.memmap)
+    self.assertFalse(a.flags.writeable)
+
+  def test_pickle(self):
+    __cachedir__ = self.cachedir
+    cache.FileCache('test')(self.listing, 3)
+    self.assertEqual(cache.FileCache('test')(self.listing, 3), [0,1,2])
+    self.assertEqual(self.ncalls, 1)
+
+  def test_namespace(self):
+    __cachedir__ = self.cachedir
+    cache.FileCache('a')(self.array, 3)
+    cache.FileCache('b')(self.array, 3)
+    self.assertEqual(self.ncalls, 2)
+
+  def test_recache(self):
+    __cachedir__ = self.cachedir
+    cache.FileCache('test')(self.array, 3)
+    __recache__ = True
+    cache.FileCache('test')(self.array, 3)
+    self.assertEqual(self.ncalls, 2)
+
+  def test_evict(self):
+    __cachedir__ = self.cachedir
+    fcache = cache.FileCache('test')
+    for n in 1000, 2000, 3000:
+      fcache(self.array, n)
+    os.utime(os.path.join(fcache.path, fcache._key(self.array, (1000,), {})+'.npy'), (0, 0)) # least recently used
+    fcache.evict(maxsize=(2000+3000)*8+256)
+    fcache(self.array, 2000)
+    fcache(self.array, 3000)
+    self.assertEqual(self.ncalls, 3)
+    fcache(self.array, 1000)
+    self.assertEqual(self.ncalls, 4)
+
+  def test_lockfiles(self):
+    __cachedir__ = self.cachedir
+    fcache = cache.FileCache('test')
+    for n in 1, 2, 1:
+      fcache(self.array, n)
+    self.assertFalse([filename for filename in os.listdir(fcache.path) if filename.endswith('.lock')])
+
+  def test_evictestimate(self):
+    __cachedir__ = self.cachedir
+    fcache = cache.FileCache('test')
+    evicted = []
+    evict = fcache.evict
+    fcache.evict = lambda: evicted.append(evict())
+    for n in 1, 2, 3:
+      fcache(self.array, n)
+    self.assertEqual(len(evicted), 1) # only the first write measures the store
+    __cachesize__ = fcache.size + 100
+    fcache(self.array, 4)
+    self.assertEqual(len(evicted), 2)
+
+class persist(TestCase):
+
+  def test_unwritable(self):
+    with tempfile.TemporaryDirectory() as __cachedir__, unittest.mock.patch.object(cache, 'open', side_effect=PermissionError, create=True):
+      self.assertEqual(cache.persist('test', 'key', lambda: 'value'), 'value')
+
+class wrapper(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.ncalls = 0
+
+  def func(self, n):
+    self.ncalls += 1
+    return numpy.arange(n, dtype=float)
+
+  def test_unbounded(self):
+    wrapper = cache.Wrapper(self.func)
+    for n in 1, 2, 1, 2:
+      wrapper(n)
+    self.assertEqual((self.ncalls, wrapper.hits, wrapper.nbytes), (2, 2, 24))
+
+  def test_maxsize(self):
+    wrapper = cache.Wrapper(self.func, maxsize=2)
+    for n in 1, 2, 1, 3, 1, 2:
+      wrapper(n)
+    self.assertEqual(self.ncalls, 4) # 2 is evicted before 1, which was used more recently
+    self.assertEqual(list(wrapper.cache), [(1,), (2,)])
+    self.assertEqual(wrapper.nbytes, 24)
+
+  def test_maxbytes(self):
+    wrapper = cache.Wrapper(self.func, maxbytes=40)
+    for n in 4, 1, 2:
+      wrapper(n)
+    self.assertEqual(list(wrapper.cache), [(1,), (2,)])
+    self.assertEqual(wrapper.nevicted, 1)
+
+  def test_const(self):
+    wrapper = cache.Wrapper(lambda n: (numeric.const(numpy.arange(n, dtype=float)), numeric.const(numpy.ones(n))), maxbytes=100)
+    wrapper(4)
+    self.assertEqual(wrapper.nbytes, 64)
+    wrapper(3)
+    self.assertEqual(list(wrapper.cache), [(3,)]) # bounded by the size of const arrays
+    self.assertEqual(wrapper.nevicted, 1)
+
+  def test_del_shutdown(self):
+    wrapper = cache.Wrapper(self.func)
+    with unittest.mock.patch.object(cache, '_retired', None): # as during interpreter shutdown
+      wrapper.__del__()
+
+  def test_minhitrate(self):
+    wrapper = cache.Wrapper(self.func, minhitrate=.5, probe=10)
+    for n in range(10):
+      wrapper(n % 8)
+    self.assertFalse(wrapper.enabled)
+    self.assertEqual(wrapper.nbytes, 0)
+    wrapper(0)
+    self.assertEqual(self.ncalls, 9)
+    self.assertEqual(wrapper.hits, 2)
+
+  def test_enabled(self):
+    wrapper = cache.Wrapper(self.func, minhitrate=.5, probe=10)
+    for n in range(10):
+      wrapper(n % 4)
+    self.assertTrue(wrapper.enabled)
+    self.assertEqual(self.ncalls, 4)
+
+  def test_wrappercache(self):
+    fcache = cache.WrapperCache(maxsize=1)
+    fcache[self.func](1)
+    fcache[self.func](2)
+    self.assertEqual(fcache[self.func].maxsize, 1)
+    self.assertEqual(fcache.nbytes, 16)
+
+class stats(TestCase):
+
+  def func(self, n):
+    return numpy.arange(n, dtype=float)
+
+  def test_wrapper(self):
+    wrapper = cache.Wrapper(self.func, maxsize=1)
+    for n in 1, 1, 2, 1:
+      wrapper(n)
+    self.assertEqual(wrapper.name, __name__+'.stats.func')
+    stats = wrapper.stats
+    self.assertEqual(stats['calls'], 4)
+    self.assertEqual((stats['hits'], stats['misses'], stats['evicted'], stats['nbytes']), (1, 3, 2, 8))
+    self.assertGreaterEqual(stats['saved'], 0)
+
+  def test_since(self):
+    stats0 = cache.statistics()
+    wrapper = cache.Wrapper(self.func)
+    for n in 1, 1, 1:
+      wrapper(n)
+    stats = cache.statistics(since=stats0)['functions'][wrapper.name]
+    self.assertEqual((stats['calls'], stats['hits'], stats['misses'], stats['nbytes']), (3, 2, 1, 8))
+
+  def test_retired(self):
+    stats0 = cache.statistics()
+    wrapper = cache.Wrapper(self.func)
+    wrapper(1)
+    wrapper(1)
+    del wrapper
+    stats = cache.statistics(since=stats0)['functions'][__name__+'.stats.func']
+    self.assertEqual((stats['calls'], stats['hits']), (2, 1))
+    self.assertNotIn('nbytes', stats)
+
+  def test_immutable(self):
+    class T(cache.Immutable):
+      def __init__(self, a):
+        pass
+      @cache.property
+      def b(self):
+        return self._args
+    T(1).b
+    T(1).b
+    stats = cache.statistics()
+    classstats = stats['classes'][__name__+'.stats.test_immutable.<locals>.T']
+    self.assertEqual((classstats['live'], classstats['hits'], classstats['misses']), (1, 1, 1))
+    propertystats = stats['properties'][__name__+'.stats.test_immutable.<locals>.T.b']
+    self.assertEqual((propertystats['hits'], propertystats['misses']), (1, 1))
+
+  def test_merge(self):
+    stats0 = cache.statistics()
+    cache.mergestats({'functions': {'child.func': dict(calls=3, hits=2, misses=1, evicted=0, nbytes=8, saved=.5)}, 'classes': {}, 'properties': {}})
+    stats = cache.statistics(since=stats0)['functions']['child.func']
+    self.assertEqual(stats, dict(calls=3, hits=2, misses=1, evicted=0, saved=.5))
+
+  def test_pariter(self):
+    __cachestats__ = True
+    wrapper = cache.Wrapper(self.func)
+    stats0 = cache.statistics()
+    for i in parallel.pariter(range(4), 2):
+      wrapper(1)
+    stats = cache.statistics(since=stats0)['functions'][wrapper.name]
+    self.assertEqual(stats['calls'], 4)
+    self.assertEqual(stats['misses'], 2)
+
+class digest(TestCase):
+
+  def test_sharing(self):
+    a = numpy.arange(3)
+    self.assertEqual(cache.digest((a, a)), cache.digest((a, a.copy())))
+
+  def test_distinct(self):
+    self.assertNotEqual(cache.digest(numpy.arange(3)), cache.digest(numpy.arange(3.)))
+    self.assertNotEqual(cache.digest((1,2)), cache.digest([1,2]))
+    self.assertNotEqual(cache.digest({'a': 1}), cache.digest({'a': 2}))
+
+  def test_order(self):
+    self.assertEqual(cache.digest(frozenset(['a', 'b'])), cache.digest(frozenset(['b', 'a'])))
+    self.assertEqual(cache.digest({'a': 1, 'b': 2}), cache.digest({'b': 2, 'a': 1}))
+
+  def test_reproducible(self):
+    script = 'from nutils import cache, function; print(cache.digest((function.Argument("a", (2,)), {"x", "y"})))'
+    digests = set()
+    for seed in '1', '2':
+      env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=os.pathsep.join(sys.path))
+      digests.add(subprocess.check_output([sys.executable, '-c', script], env=env))
+    self.assertEqual(len(digests), 1)
+
+  def test_persistkey(self):
+    domain, geom = mesh.rectilinear([2])
+    with self.assertRaises(ValueError):
+      cache.digest(domain)
+
+class outofband(TestCase):
+
+  def roundtrip(self, obj):
+    with tempfile.TemporaryFile() as f:
+      cache._dump(obj, f)
+      f.seek(0)
+      return cache._load(f)
+
+  def test_dedup(self):
+    a = numeric.const(numpy.arange(1000.))
+    b = numeric.const(numpy.arange(1000.))
+    small = numeric.const([1, 2])
+    a_, b_, small_, nested = self.roundtrip((a, b, small, [a, {'b': b}]))
+    self.assertIs(a_, b_)
+    self.assertIs(nested[0], a_)
+    self.assertIs(nested[1]['b'], a_)
+    self.assertEqual(a_, a)
+    self.assertEqual(small_, small)
+
+  def test_mapped(self):
+    a = numeric.const(numpy.arange(1000.).reshape(10, 100).T)
+    a_, = self.roundtrip((a,))
+    self.assertEqual(a_, a)
+    array = numpy.asarray(a_)
+    self.assertFalse(array.flags.writeable)
+    self.assertFalse(array.flags.owndata)
+
+  def test_immutable(self):
+    f = function.Argument('a', (2,)) * numeric.const(numpy.arange(2000.).reshape(1000,2))
+    self.assertIs(self.roundtrip(f), f)
+
+  def test_empty(self):
+    self.assertEqual(self.roundtrip({'a': 1}), {'a': 1})
+
+class binder(TestCase):
+
+  def check(self, f, *args, **kwargs):
+    signature = inspect.signature(f)
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    self.assertEqual(util.binder(signature)(*args, **kwargs), bound.args)
+
+  def test_positional(self):
+    self.check(lambda a, b, c=3: None, 1, 2)
+    self.check(lambda a, b, c=3: None, 1, 2, 4)
+    self.check(lambda: None)
+
+  def test_keyword(self):
+    self.check(lambda a, b, c=3: None, 1, c=4, b=2)
+    with self.assertRaises(TypeError):
+      util.binder(inspect.signature(lambda a, b: None))(1, c=2)
+
+  def test_annotations(self):
+    signature = inspect.signature(lambda a, b=(1,2): None)
+    bind = util.binder(signature, [('b', numpy.array)])
+    a, b = bind('a')
+    self.assertEqual(a, 'a')
+    numpy.testing.assert_array_equal(b, [1,2])
+
+  def test_unsupported(self):
+    self.assertIsNone(util.binder(inspect.signature(lambda *args: None)))
+    self.assertIsNone(util.binder(inspect.signature(lambda a, *, b: None)))
+
+  def test_immutable(self):
+    class T(cache.Immutable):
+      def __init__(self, a, b:tuple=[1]):
+        self.b = b
+    self.assertIs(T(1), T(a=1, b=(1,)))
+    self.assertEqual(T(1).b, (1,))
+
+class intern(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    class T(cache.Immutable):
+      _keepalive = 0
+      def __init__(self, a):
+        pass
+    self.T = T
+
+  def test_identity(self):
+    a = self.T(1)
+    self.assertIs(self.T(1), a)
+    self.assertIsNot(self.T(2), a)
+    self.assertEqual(self.T.internstats, dict(live=1, hits=1, misses=2))
+
+  def test_collect(self):
+    a = self.T(1)
+    b = self.T(2)
+    self.assertEqual(self.T.internstats['live'], 2)
+    del b
+    self.assertEqual(self.T.internstats['live'], 1)
+    c = self.T(2)
+    self.assertEqual(self.T.internstats, dict(live=2, hits=0, misses=3))
+
+  def test_flat(self):
+    objs = [self.T(i) for i in range(10)]
+    for i in range(10000):
+      self.T(i)
+    self.assertEqual(self.T.internstats['live'], 10)
+
+  def test_keepalive(self):
+    class T(cache.Immutable):
+      _keepalive = 2
+      def __init__(self, a):
+        pass
+    for i in range(5):
+      T(i)
+    self.assertEqual(T.internstats, dict(live=2, hits=0, misses=5))
+    T(4)
+    self.assertEqual(T.internstats['hits'], 1)
+
+  def test_threads(self):
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+      objs = list(pool.map(self.T, [i % 10 for i in range(1000)]))
+    for i, obj in enumerate(objs):
+      self.assertIs(obj, objs[i % 10])
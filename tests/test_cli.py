@@ -55,6 +55,28 @@ class run(ContextTestCase):
       self.assertIsNotNone(status)
       self.assertEqual(status.code, 0)
 
+  def test_cachestats(self):
+    _savestreams = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = io.StringIO()
+    try:
+      if self.method == 'run':
+        nutils.cli.run(main, args=['--outrootdir',self.outrootdir,'--pdb=false','--symlink=xyz','--cachestats=true'], scriptname=self.scriptname)
+      else:
+        nutils.cli.choose(main, args=['--outrootdir',self.outrootdir,'--pdb=false','--symlink=xyz','--cachestats=true','main'], scriptname=self.scriptname)
+    except SystemExit as e:
+      status = e
+    else:
+      status = None
+    finally:
+      sys.stdout, sys.stderr = _savestreams
+
+    with self.subTest('cachestats'):
+      self.assertTrue(os.path.isfile(os.path.join(self.outrootdir,'xyz','cachestats.json')), 'cache statistics not found')
+
+    with self.subTest('exitstatus'):
+      self.assertIsNotNone(status)
+      self.assertEqual(status.code, 0)
+
   def test_bad(self):
     _savestreams = sys.stdout, sys.stderr
     sys.stdout = sys.stderr = stringio = io.StringIO()
@@ -1,5 +1,6 @@
 from nutils import *
 from . import *
+import weakref, gc
 
 @parametrize
 class elem(TestCase):
@@ -42,3 +43,45 @@ elem('square', ndims=[1,1], exactcentroid=[.5]*2)
 elem('hexagon', ndims=[1,1,1], exactcentroid=[.5]*3)
 elem('prism1', ndims=[2,1], exactcentroid=[1/3,1/3,1/2])
 elem('prism2', ndims=[1,2], exactcentroid=[1/2,1/3,1/3])
+
+class tabulate(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.std = element.PolyLine(element.PolyLine.bernstein_poly(2))**2
+    self.points, weights = (element.getsimplex(1)**2).getischeme('gauss3')
+
+  def test_values(self):
+    for grad in range(3):
+      numpy.testing.assert_array_equal(self.std.tabulate(self.points, grad), self.std.eval(self.points, grad))
+
+  def test_shared(self):
+    values = self.std.tabulate(self.points, 1)
+    self.assertIs(self.std.tabulate(numeric.const(self.points), 1), values)
+    self.assertFalse(values.flags.writeable)
+    with self.assertRaises(ValueError):
+      values[...] = 0
+
+  def test_eval_writeable(self):
+    self.std.tabulate(self.points, 2)
+    values = self.std.eval(self.points, 2)
+    self.assertTrue(values.flags.writeable)
+    values[...] = 0
+    numpy.testing.assert_array_equal(self.std.tabulate(self.points, 2), self.std.eval(self.points, 2)) # tabulation is unaffected
+
+  def test_released(self):
+    std = element.PolyLine(numeric.const([[.5, .25], [.5, .75]]))
+    points, weights = element.getsimplex(1).getischeme('gauss3')
+    std.tabulate(points, 1)
+    nentries = len(element._tabulations.cache)
+    ref = weakref.ref(std)
+    del std
+    element.PolyLine._recent.clear() # recently interned elements are kept alive
+    gc.collect()
+    self.assertIsNone(ref())
+    self.assertEqual(len(element._tabulations.cache), nentries-1)
+    self.assertFalse([args for args in element._tabulations.cache if args[0]() is None])
+
+  def test_unhashable(self):
+    points = numpy.array(self.points)
+    numpy.testing.assert_array_equal(self.std.tabulate(points), self.std.eval(points))
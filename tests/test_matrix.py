@@ -0,0 +1,189 @@
+from nutils import matrix, mesh, function
+from . import *
+import numpy, unittest.mock
+
+
+class blockdiagonal(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    domain, geom = mesh.rectilinear([4,3])
+    basis = domain.basis('discont', degree=2)
+    self.M = domain.integrate(function.outer(basis), geometry=geom, ischeme='gauss4')
+    self.ndofs = len(basis)
+    self.elemdofs = numpy.arange(self.ndofs).reshape(len(domain), -1)
+
+  def test_blockinverse(self):
+    Minv = self.M.blockinverse()
+    numpy.testing.assert_almost_equal((Minv * self.M).toarray(), numpy.eye(self.ndofs), decimal=10)
+
+  def test_blockinverse_given(self):
+    Minv = self.M.blockinverse(blocks=self.elemdofs)
+    numpy.testing.assert_almost_equal(Minv.toarray(), numpy.linalg.inv(self.M.toarray()), decimal=8)
+
+  def test_solve(self):
+    rhs = numpy.arange(self.ndofs, dtype=float)
+    lhs = self.M.solve(rhs, solver='blockdiag')
+    numpy.testing.assert_almost_equal(self.M.matvec(lhs), rhs, decimal=10)
+    numpy.testing.assert_almost_equal(lhs, self.M.solve(rhs), decimal=10)
+
+  def test_optin(self):
+    rhs = numpy.arange(self.ndofs, dtype=float)
+    with unittest.mock.patch.object(matrix, '_blocklabels', side_effect=AssertionError('blocks detected')):
+      self.M.solve(rhs) # the default direct solve does not look for blocks
+
+  def test_solve_constrained(self):
+    rhs = numpy.arange(self.ndofs, dtype=float)
+    cons = numpy.empty(self.ndofs)
+    cons[:] = numpy.nan
+    cons[self.elemdofs[:,0]] = 1
+    lhs = self.M.solve(rhs, constrain=cons, solver='blockdiag')
+    numpy.testing.assert_almost_equal(lhs, self.M.solve(rhs, constrain=cons, solver='spsolve'), decimal=10)
+
+
+class condense(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    domain, geom = mesh.rectilinear([4,4])
+    basis = domain.basis('spline', degree=2)
+    self.A = domain.integrate(function.outer(basis.grad(geom)).sum(-1) + function.outer(basis), geometry=geom, ischeme='gauss4')
+    self.rhs = numpy.sin(numpy.arange(len(basis)))
+    # mark a set of mutually decoupled dofs as interior
+    A = self.A.toarray()
+    self.interior = numpy.zeros(len(basis), dtype=bool)
+    for idof in range(len(basis)):
+      if not (A[idof, self.interior] != 0).any():
+        self.interior[idof] = True
+
+  def test_solve(self):
+    S, g, expand = self.A.condense(self.interior, self.rhs)
+    self.assertEqual(S.shape, (len(self.rhs)-self.interior.sum(),)*2)
+    lhs = expand(S.solve(g))
+    numpy.testing.assert_almost_equal(lhs, numpy.linalg.solve(self.A.toarray(), self.rhs), decimal=10)
+
+
+class multiplerhs(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    domain, geom = mesh.rectilinear([4,4])
+    basis = domain.basis('spline', degree=2)
+    self.A = domain.integrate(function.outer(basis.grad(geom)).sum(-1), geometry=geom, ischeme='gauss4')
+    self.B = numpy.sin(numpy.arange(3*len(basis))).reshape(len(basis), 3)
+    self.cons = numpy.empty(len(basis))
+    self.cons[:] = numpy.nan
+    self.cons[:4] = 1
+
+  def assert_columnwise(self, X):
+    self.assertEqual(X.shape, self.B.shape)
+    for i in range(self.B.shape[1]):
+      numpy.testing.assert_almost_equal(X[:,i], self.A.solve(self.B[:,i], constrain=self.cons), decimal=8)
+
+  def test_direct(self):
+    self.assert_columnwise(self.A.solve(self.B, constrain=self.cons))
+
+  def test_krylov(self):
+    self.assert_columnwise(self.A.solve(self.B, constrain=self.cons, tol=1e-12, symmetric=True, precon='diag'))
+
+  def test_numpy(self):
+    A = matrix.NumpyMatrix(self.A.toarray())
+    self.assert_columnwise(A.solve(self.B, constrain=self.cons))
+
+  def test_blockconstrain(self):
+    cons = numpy.repeat(self.cons[:,numpy.newaxis], self.B.shape[1], axis=1)
+    cons[:4] = [1, 2, 3]
+    X = self.A.solve(self.B, constrain=cons)
+    for i in range(self.B.shape[1]):
+      numpy.testing.assert_almost_equal(X[:,i], self.A.solve(self.B[:,i], constrain=cons[:,i]), decimal=8)
+
+
+class restriction(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    domain, geom = mesh.rectilinear([3,3])
+    basis = domain.basis('spline', degree=2)
+    self.A = domain.integrate(function.outer(basis.grad(geom)).sum(-1) + function.outer(basis, basis*geom[0]), geometry=geom, ischeme='gauss4')
+    self.I = numpy.arange(len(basis)) % 3 != 0
+    self.J = numpy.arange(len(basis)) % 3 != 1
+    self.Adense = self.A.toarray()[numpy.ix_(self.I, self.J)]
+
+  def test_csr(self):
+    numpy.testing.assert_array_equal(self.A.restrict(self.I, self.J).csr.toarray(), self.Adense)
+
+  def test_matvec(self):
+    x = numpy.sin(numpy.arange(self.J.sum()))
+    numpy.testing.assert_almost_equal(self.A.restrict(self.I, self.J).matvec(x), self.Adense.dot(x), decimal=14)
+
+  def test_diagonal(self):
+    numpy.testing.assert_array_equal(self.A.restrict(self.I, self.J).diagonal, self.Adense.diagonal())
+
+  def test_cached(self):
+    self.assertIs(self.A.restrict(self.I, self.J), self.A.restrict(self.I.copy(), self.J.copy()))
+    self.assertIsNot(self.A.restrict(self.I, self.J), self.A.restrict(self.J, self.I))
+
+  def test_spsolve_tol(self):
+    rhs = numpy.sin(numpy.arange(self.A.shape[0]))
+    cons = numpy.where(self.I, numpy.nan, 1.)
+    for constrain in None, cons:
+      with self.subTest(constrained=constrain is not None):
+        lhs = self.A.solve(rhs, constrain=constrain, solver='spsolve', tol=1e-10)
+        numpy.testing.assert_almost_equal(lhs, self.A.solve(rhs, constrain=constrain), decimal=12)
+
+  def test_cond(self):
+    cons = numpy.where(self.I, numpy.nan, 0.)
+    numpy.testing.assert_almost_equal(self.A.cond(constrain=cons), numpy.linalg.cond(self.A.toarray()[numpy.ix_(self.I, self.I)]), decimal=8)
+    numpy.testing.assert_almost_equal(matrix.NumpyMatrix(self.A.toarray()).cond(constrain=cons), self.A.cond(constrain=cons), decimal=8)
+
+
+class mixedprecision(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    domain, geom = mesh.rectilinear([numpy.linspace(0,1,9)]*2)
+    basis = domain.basis('spline', degree=2)
+    self.integrand = function.outer(basis.grad(geom)).sum(-1) + function.outer(basis)
+    self.domain = domain
+    self.geom = geom
+    self.A = domain.integrate(self.integrand, geometry=geom, ischeme='gauss4')
+    self.rhs = numpy.sin(numpy.arange(len(basis)))
+    self.cons = numpy.empty(len(basis))
+    self.cons[:] = numpy.nan
+    self.cons[::7] = 0
+
+  def test_solve(self):
+    lhs, info = self.A.solve(self.rhs, constrain=self.cons, solver='mixedprecision', info=True)
+    numpy.testing.assert_almost_equal(lhs, self.A.solve(self.rhs, constrain=self.cons), decimal=12)
+    self.assertGreater(info.niter, 1)
+
+  def test_stagnated(self):
+    # a factorization whose first solve is accurate and whose corrections diverge
+    exact = self.A.solve(self.rhs)
+    class lu:
+      nsolves = 0
+      def solve(rhs):
+        lu.nsolves += 1
+        return exact * (1+1e-13) if lu.nsolves == 1 else numpy.ones_like(exact)
+    with unittest.mock.patch('scipy.sparse.linalg.splu', return_value=lu):
+      lhs = self.A.solve(self.rhs, solver='mixedprecision', tol=1e-14)
+    self.assertEqual(lu.nsolves, 2)
+    numpy.testing.assert_allclose(lhs, exact, rtol=1e-12) # the best iterate is returned
+
+  def test_timings(self):
+    lhs, info = self.A.solve(self.rhs, constrain=self.cons, solver='mixedprecision', info=True)
+    self.assertEqual(set(info.timings), {'precon', 'solve'})
+
+  def test_multiplerhs(self):
+    B = numpy.stack([self.rhs, self.rhs[::-1]], axis=1)
+    X = self.A.solve(B, constrain=self.cons, solver='mixedprecision')
+    for i in range(2):
+      numpy.testing.assert_almost_equal(X[:,i], self.A.solve(B[:,i], constrain=self.cons), decimal=12)
+
+  def test_float32precon(self):
+    A32 = self.domain.integrate(self.integrand, geometry=self.geom, ischeme='gauss4', dtype=numpy.float32)
+    self.assertEqual(A32.toscipy().dtype, numpy.float32)
+    numpy.testing.assert_allclose(A32.toarray(), self.A.toarray(), rtol=1e-5, atol=1e-7)
+    precon = A32.getprecon('splu', constrain=self.cons)
+    lhs = self.A.solve(self.rhs, constrain=self.cons, tol=1e-12, symmetric=True, precon=precon)
+    numpy.testing.assert_almost_equal(lhs, self.A.solve(self.rhs, constrain=self.cons), decimal=10)
@@ -1,5 +1,6 @@
 from nutils import *
 from . import *
+import tempfile, os
 
 @parametrize
 class gmsh(TestCase):
@@ -239,6 +240,20 @@ class gmshrect(TestCase):
     volumes = self.domain.boundary.integrate(self.geom*self.geom.normal(), geometry=self.geom, ischeme='gauss1')
     numpy.testing.assert_almost_equal(volumes, 2, decimal=10)
 
+  def test_topocache(self):
+    with tempfile.TemporaryDirectory() as __cachedir__:
+      __topocache__ = True
+      fname = os.path.join(__cachedir__, 'mesh.msh')
+      with open(fname, 'w') as f:
+        f.write(self.gmshrectdata)
+      domain, geom = mesh.gmsh(fname)
+      domain_, geom_ = mesh.gmsh(self.gmshrectdata.splitlines(keepends=True))
+      self.assertEqual(len(os.listdir(os.path.join(__cachedir__, 'topologies'))), 2)
+      self.assertIs(mesh.gmsh(fname)[1], geom)
+      self.assertIs(mesh.gmsh(iter(self.gmshrectdata.splitlines(keepends=True)))[1], geom_)
+      self.assertEqual(len(os.listdir(os.path.join(__cachedir__, 'topologies'))), 2)
+      numpy.testing.assert_almost_equal(domain_.integrate(1, geometry=geom_, ischeme='gauss1'), 2, decimal=10)
+
   def test_subvolume(self):
     for group in 'left', 'right':
       with self.subTest(group):
@@ -1,5 +1,5 @@
 from nutils import *
-import unittest
+import unittest, pickle
 from . import parametrize
 
 @parametrize
@@ -38,3 +38,68 @@ class searchsorted(unittest.TestCase):
 
   def test_strings(self):
     self.assertEqual(numeric.searchsorted( ['bar','foo','fool'], 'food' ), 2)
+
+class const(unittest.TestCase):
+
+  def test_pickle(self):
+    a = numeric.const(numpy.arange(6.).reshape(2,3).T)
+    for protocol in range(pickle.HIGHEST_PROTOCOL+1):
+      with self.subTest(protocol):
+        self.assertEqual(pickle.loads(pickle.dumps(a, protocol)), a)
+
+  def test_pickle_scalar(self):
+    a = numeric.const(numpy.float64(1.5))
+    for protocol in range(pickle.HIGHEST_PROTOCOL+1):
+      with self.subTest(protocol):
+        a_ = pickle.loads(pickle.dumps(a, protocol))
+        self.assertEqual(a_.shape, ())
+        self.assertEqual(a_, a)
+
+  @unittest.skipIf(pickle.HIGHEST_PROTOCOL < 5, 'out-of-band buffers require pickle protocol 5')
+  def test_outofband_scalar(self):
+    a = numeric.const(numpy.float64(1.5))
+    buffers = []
+    a_ = pickle.loads(pickle.dumps(a, 5, buffer_callback=buffers.append), buffers=buffers)
+    self.assertEqual(a_.shape, ())
+    self.assertEqual(a_, a)
+
+  @unittest.skipIf(pickle.HIGHEST_PROTOCOL < 5, 'out-of-band buffers require pickle protocol 5')
+  def test_outofband(self):
+    a = numeric.const(numpy.arange(10000.).reshape(100,100))
+    buffers = []
+    data = pickle.dumps(a, 5, buffer_callback=buffers.append)
+    self.assertEqual(len(buffers), 1)
+    self.assertLess(len(data), a.size*a.dtype.itemsize)
+    a_ = pickle.loads(data, buffers=buffers)
+    self.assertEqual(a_, a)
+    self.assertFalse(numpy.asarray(a_).flags.writeable)
+
+  def test_equal(self):
+    a = numeric.const(numpy.arange(10**6.))
+    b = numeric.const(numpy.arange(10**6.))
+    c = numeric.const(numpy.arange(1, 10**6+1.))
+    self.assertEqual(hash(a), hash(b))
+    self.assertEqual(a, b)
+    self.assertNotEqual(a, c)
+    self.assertNotEqual(a, numeric.const(numpy.arange(10**6)))
+    self.assertEqual(len({a, b, c}), 2)
+
+  def test_digest(self):
+    a = numeric.const(numpy.arange(10**6.))
+    self.assertIs(a.digest, a.digest)
+    self.assertEqual(a.digest, numeric.const(numpy.arange(10**6.)).digest)
+    self.assertNotEqual(a.digest, a.reshape(1000, 1000).digest)
+    self.assertEqual(numeric.const(numpy.arange(6.).reshape(2,3).T).digest, numeric.const(numpy.arange(6.).reshape(2,3).T.copy()).digest)
+
+  def test_negativezero(self):
+    a = numeric.const([0., 1.])
+    b = numeric.const([-0., 1.])
+    self.assertEqual(a, b)
+    self.assertEqual(hash(a), hash(b))
+
+  def test_object(self):
+    a = numeric.const(numpy.array([None, 'a'], dtype=object))
+    self.assertIsNone(a.digest)
+    self.assertEqual(a, numeric.const(numpy.array([None, 'a'], dtype=object)))
+    self.assertEqual(hash(a), hash(numeric.const(numpy.array([None, 'a'], dtype=object))))
+    self.assertNotEqual(a, numeric.const(numpy.array([None, 'b'], dtype=object)))
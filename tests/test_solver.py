@@ -1,6 +1,6 @@
-from nutils import solver, mesh, function
+from nutils import solver, mesh, function, log
 from . import *
-import numpy
+import numpy, tempfile, os, json, io
 
 
 class laplace(TestCase):
@@ -14,6 +14,7 @@ class laplace(TestCase):
     u = basis.dot(dofs)
     self.residual = domain.integral((basis.grad(geom) * u.grad(geom)).sum(-1), geometry=geom, degree=2) \
                   + domain.boundary['top'].integral(basis, geometry=geom, degree=2)
+    self.load = domain.integral(basis * geom[0], geometry=geom, degree=2)
 
   def test_res(self):
     for name in 'direct', 'newton':
@@ -26,6 +27,34 @@ class laplace(TestCase):
         resnorm = numpy.linalg.norm(res[~self.cons.where])
         self.assertLess(resnorm, 1e-13)
 
+  def test_multiple(self):
+    residual2 = self.residual + self.load
+    lhs1, lhs2 = solver.solve_linear('dofs', residual=[self.residual, residual2], constrain=self.cons)
+    numpy.testing.assert_almost_equal(lhs1, solver.solve_linear('dofs', residual=self.residual, constrain=self.cons), decimal=13)
+    numpy.testing.assert_almost_equal(lhs2, solver.solve_linear('dofs', residual=residual2, constrain=self.cons), decimal=13)
+
+
+class nonlinear(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    domain, geom = mesh.rectilinear([numpy.linspace(0,1,5)])
+    basis = domain.basis('discont', degree=0)
+    u = basis.dot(function.Argument('dofs', [len(basis)]))
+    self.residual = domain.integral(basis * function.arctan2(u - geom[0], 1), geometry=geom, degree=2) # no affine part
+    self.lhs0 = numpy.full(len(basis), 5.) # outside the convergence radius of plain newton
+
+  def test_linesearch(self):
+    self.assertIsNone(self.residual.splitlinear('dofs')[0])
+    newton = solver.newton('dofs', residual=self.residual, lhs0=self.lhs0)
+    numpy.testing.assert_almost_equal(newton.solve(tol=1e-10), [.125, .375, .625, .875], decimal=10)
+    telemetry = newton.telemetry
+    self.assertLess(telemetry.iterations[1]['relax'], 1)
+    nretries = sum(it['linesearch']-1 for it in telemetry.iterations[1:])
+    self.assertGreater(nretries, 0)
+    self.assertEqual(telemetry.counts['residual'], nretries) # retries evaluate residuals and tangents only
+    self.assertEqual(telemetry.counts['jacobian'], telemetry.niter + sum(it['linesearch'] > 1 for it in telemetry.iterations[1:]))
+
 
 class navierstokes(TestCase):
 
@@ -60,9 +89,60 @@ class navierstokes(TestCase):
   def test_newton(self):
     self.assert_resnorm(solver.newton('dofs', residual=self.residual, lhs0=self.lhs0, constrain=self.cons).solve(tol=self.tol, maxiter=2))
 
+  def test_telemetry(self):
+    newton = solver.newton('dofs', residual=self.residual, lhs0=self.lhs0, constrain=self.cons)
+    lhs = newton.solve(tol=self.tol)
+    telemetry = newton.telemetry
+    self.assertEqual([it['resnorm'] < self.tol for it in telemetry.iterations], [False] * (telemetry.niter-1) + [True])
+    self.assertIsNone(telemetry.iterations[0]['relax'])
+    self.assertEqual(telemetry.counts['solve'], telemetry.niter-1)
+    self.assertEqual(telemetry.counts['jacobian'], telemetry.niter)
+    self.assertEqual(telemetry.counts.get('residual', 0), sum(it['linesearch']-1 for it in telemetry.iterations[1:])) # one sweep per step accepted at first try
+    self.assertGreaterEqual(telemetry.timings['linesearch'], 0)
+
+  def test_jacobian(self):
+    newton = solver.newton('dofs', residual=self.residual, jacobian=self.residual.derivative('dofs'), lhs0=self.lhs0, constrain=self.cons)
+    self.assert_resnorm(newton.solve(tol=self.tol))
+    self.assertNotIn('residual', newton.telemetry.counts) # the supplied jacobian defines the tangent
+
+  def test_telemetry_jsonl(self):
+    __telemetry__ = True
+    with tempfile.TemporaryDirectory() as __outdir__:
+      solver.newton('dofs', residual=self.residual, lhs0=self.lhs0, constrain=self.cons).solve(tol=self.tol)
+      solver.pseudotime('dofs', residual=self.residual, inertia=self.inertia, timestep=1, lhs0=self.lhs0, constrain=self.cons).solve(tol=self.tol)
+      with open(os.path.join(__outdir__, 'telemetry.jsonl')) as f:
+        records = [json.loads(line) for line in f]
+    self.assertEqual([record['solver'] for record in records], ['newton', 'pseudotime'])
+    for record in records:
+      self.assertEqual(record['niter'], len(record['iterations']))
+      self.assertIn('solve', record['timings'])
+
+  def test_splitlinear(self):
+    linear, nonlinear = self.residual.splitlinear('dofs')
+    self.assertFalse(linear.derivative('dofs').contains('dofs'))
+    self.assertTrue(nonlinear.derivative('dofs').contains('dofs'))
+    lhs = numpy.sin(numpy.arange(len(self.lhs0)))
+    numpy.testing.assert_almost_equal((linear + nonlinear).eval(arguments=dict(dofs=lhs)), self.residual.eval(arguments=dict(dofs=lhs)), decimal=13)
+
+  def test_directionalderivative(self):
+    lhs = numpy.sin(numpy.arange(len(self.lhs0)))
+    dlhs = numpy.cos(numpy.arange(len(self.lhs0)))
+    tangent = self.residual.directionalderivative('dofs', 'ddofs').eval(arguments=dict(dofs=lhs, ddofs=dlhs))
+    jac = self.residual.derivative('dofs').eval(arguments=dict(dofs=lhs))
+    numpy.testing.assert_almost_equal(tangent, jac.matvec(dlhs), decimal=12)
+
   def test_pseudotime(self):
     self.assert_resnorm(solver.pseudotime('dofs', residual=self.residual, lhs0=self.lhs0, constrain=self.cons, inertia=self.inertia, timestep=1).solve(tol=self.tol, maxiter=3))
 
+  def test_pseudotime_checkpoint(self):
+    with tempfile.TemporaryDirectory() as __cachedir__:
+      gen1 = solver.pseudotime('dofs', residual=self.residual, lhs0=self.lhs0, constrain=self.cons, inertia=self.inertia, timestep=1, checkpoint='pseudotime')
+      for iiter, (lhs, resnorm) in zip(range(2), gen1):
+        pass
+      gen2 = solver.pseudotime('dofs', residual=self.residual, lhs0=self.lhs0, constrain=self.cons, inertia=self.inertia, timestep=1, checkpoint='pseudotime')
+      numpy.testing.assert_array_equal(next(gen2)[0], lhs)
+      numpy.testing.assert_almost_equal(next(gen2)[0], next(gen1)[0], decimal=14)
+
 
 class optimize(TestCase):
 
@@ -91,6 +171,28 @@ class optimize(TestCase):
     self.assertTrue(numpy.equal(isnan, [0,1,1,0,1,1,0,1,1]).all())
     numpy.testing.assert_almost_equal(cons[~isnan], 1, decimal=15)
 
+  def test_nonlinear_hessianfree(self):
+    ns = self.ns
+    ns.u = 'ubasis_n ?dofs_n'
+    ns.fu = 'u + u^3'
+    err = self.domain.integral(ns.eval_('(fu - 2)^2 + u_,geom_i u_,geom_i'), geometry=ns.geom, degree=4)
+    cons = numpy.empty(len(ns.ubasis))
+    cons[:] = numpy.nan
+    cons[:3] = .5
+    lhs = solver.optimize('dofs', err, constrain=cons, newtontol=1e-10, hessianfree=True)
+    numpy.testing.assert_almost_equal(lhs, solver.optimize('dofs', err, constrain=cons, newtontol=1e-10), decimal=10)
+
+  def test_hessianfree_maxiter(self):
+    ns = self.ns
+    ns.u = 'ubasis_n ?dofs_n'
+    err = self.domain.integral(ns.eval_('(u - 2)^2 + u_,geom_i u_,geom_i'), geometry=ns.geom, degree=2)
+    constrain = numpy.zeros(len(ns.ubasis), dtype=bool)
+    stream = io.StringIO()
+    __log__ = log.StdoutLog(stream)
+    lhs, value = solver._newtoncg('dofs', err, numpy.zeros(len(ns.ubasis)), constrain, 1e-10, {}, maxiter=1)
+    self.assertIn('conjugate gradients did not converge in 1 iterations', stream.getvalue())
+    numpy.testing.assert_almost_equal(lhs, solver.optimize('dofs', err), decimal=8)
+
   def test_nonlinear_multipleroots(self):
     ns = self.ns
     ns.u = 'ubasis_n ?dofs_n'
@@ -100,3 +202,277 @@ class optimize(TestCase):
     isnan = numpy.isnan(cons)
     self.assertTrue(numpy.equal(isnan, [0,1,1,0,1,1,0,1,1]).all())
     numpy.testing.assert_almost_equal(cons[~isnan], .5, decimal=15)
+
+
+class thetamethod(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    domain, geom = mesh.rectilinear([4])
+    basis = domain.basis('spline', degree=1)
+    u = basis.dot(function.Argument('dofs', [len(basis)]))
+    self.inertia = domain.integral(basis * u, geometry=geom, degree=2)
+    self.residual = domain.integral(basis * (u - 1), geometry=geom, degree=2) # du/dt = 1 - u
+    self.lhs0 = numpy.zeros(len(basis))
+
+  def test_fixed(self):
+    for istep, lhs in zip(range(11), solver.impliciteuler('dofs', self.residual, self.inertia, .1, self.lhs0)):
+      pass
+    numpy.testing.assert_almost_equal(lhs, 1 - 1.1**-10, decimal=12)
+
+  def test_adaptive(self):
+    times = []
+    for time, lhs in solver.adaptivethetamethod('dofs', self.residual, self.inertia, .01, self.lhs0, theta=.5, errortol=1e-3):
+      times.append(time)
+      if time > 4:
+        break
+    numpy.testing.assert_allclose(lhs, 1 - numpy.exp(-time), rtol=1e-2)
+    timesteps = numpy.diff(times)
+    self.assertGreater(timesteps[-1], 10*timesteps.min())
+
+  def test_adaptive_partials(self):
+    for name, theta in ('adaptiveimpliciteuler', 1), ('adaptivecranknicolson', .5):
+      with self.subTest(name):
+        method = getattr(solver, name)
+        for (t1, lhs1), (t2, lhs2) in zip(method('dofs', self.residual, self.inertia, .01, self.lhs0, errortol=1e-3, endtime=1), solver.adaptivethetamethod('dofs', self.residual, self.inertia, .01, self.lhs0, theta=theta, errortol=1e-3, endtime=1)):
+          self.assertEqual(t1, t2)
+          numpy.testing.assert_equal(lhs1, lhs2)
+        self.assertEqual(t1, 1)
+
+  def test_endtime(self):
+    for time, lhs in solver.adaptivethetamethod('dofs', self.residual, self.inertia, .01, self.lhs0, theta=.5, errortol=1e-3, endtime=1.5):
+      pass
+    self.assertAlmostEqual(time, 1.5, places=12)
+    numpy.testing.assert_allclose(lhs, 1 - numpy.exp(-1.5), rtol=1e-2)
+
+  def test_checkpoint(self):
+    with tempfile.TemporaryDirectory() as __cachedir__:
+      for name, method, args in ('fixed', solver.cranknicolson, dict(timestep=.1)), ('adaptive', solver.adaptivethetamethod, dict(timestep=.01, theta=.5, errortol=1e-3)):
+        with self.subTest(name):
+          gen1 = method('dofs', self.residual, self.inertia, lhs0=self.lhs0, checkpoint='theta', **args)
+          for istep, lhs in zip(range(6), gen1):
+            pass
+          gen2 = method('dofs', self.residual, self.inertia, lhs0=self.lhs0, checkpoint='theta', **args)
+          numpy.testing.assert_equal(next(gen2), lhs) # resumes at step 5
+          numpy.testing.assert_equal(next(gen2), next(gen1))
+
+  def test_checkpoint_nsteps(self):
+    with tempfile.TemporaryDirectory() as __cachedir__:
+      for istep, lhs in zip(range(6), solver.cranknicolson('dofs', self.residual, self.inertia, .1, self.lhs0, checkpoint='theta', nsteps=10)):
+        pass
+      nyields = 0
+      for lhs in solver.cranknicolson('dofs', self.residual, self.inertia, .1, self.lhs0, checkpoint='theta', nsteps=10):
+        nyields += 1
+      self.assertEqual(nyields, 6) # resumes at step 5, ends at step 10
+      for reference in solver.cranknicolson('dofs', self.residual, self.inertia, .1, self.lhs0, nsteps=10):
+        pass
+      numpy.testing.assert_equal(lhs, reference)
+      for lhs in solver.cranknicolson('dofs', self.residual, self.inertia, .1, self.lhs0, checkpoint='theta', nsteps=10):
+        pass
+      for lhs in solver.cranknicolson('dofs', self.residual, self.inertia, .1, self.lhs0, nsteps=4):
+        pass
+      for restarted in solver.cranknicolson('dofs', self.residual, self.inertia, .1, self.lhs0, checkpoint='theta', nsteps=4):
+        pass
+      numpy.testing.assert_equal(restarted, lhs) # the checkpoint at step 10 is not resumed past step 4
+
+  def test_checkpoint_otherproblem(self):
+    with tempfile.TemporaryDirectory() as __cachedir__:
+      for istep, lhs in zip(range(6), solver.cranknicolson('dofs', self.residual, self.inertia, .1, self.lhs0, checkpoint='theta')):
+        pass
+      gen = solver.cranknicolson('dofs', self.residual, self.inertia, .2, self.lhs0, checkpoint='theta')
+      numpy.testing.assert_equal(next(gen), self.lhs0) # stale checkpoint is discarded
+
+  def test_parareal(self):
+    for __nprocs__ in 1, 2:
+      with self.subTest(nprocs=__nprocs__):
+        serial = solver.impliciteuler('dofs', self.residual, self.inertia, .1, self.lhs0)
+        parareal = solver.parareal('dofs', self.residual, self.inertia, .1, self.lhs0, theta=1, nsubsteps=4, nslices=3, tol=1e-12)
+        for istep, lhs, reference in zip(range(25), parareal, serial):
+          numpy.testing.assert_almost_equal(lhs, reference, decimal=10)
+        self.assertEqual(istep, 24)
+
+  def test_parareal_exact(self):
+    # without a tolerance parareal converges in nslices iterations to the serial solution
+    domain, geom = mesh.rectilinear([4])
+    basis = domain.basis('spline', degree=1)
+    u = basis.dot(function.Argument('dofs', [len(basis)]))
+    residual = domain.integral(basis * (u**2 - 1), geometry=geom, degree=4) # du/dt = 1 - u^2
+    serial = solver.cranknicolson('dofs', residual, self.inertia, .1, self.lhs0)
+    parareal = solver.parareal('dofs', residual, self.inertia, .1, self.lhs0, theta=.5, nsubsteps=3, nslices=3, tol=0)
+    for istep, lhs, reference in zip(range(10), parareal, serial):
+      numpy.testing.assert_almost_equal(lhs, reference, decimal=10)
+
+
+class rom(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    domain, geom = mesh.rectilinear([numpy.linspace(0,1,9)]*2)
+    basis = domain.basis('spline', degree=2)
+    u = basis.dot(function.Argument('dofs', [len(basis)]))
+    conductivity = function.Argument('kappa', ()) * geom[0]**2 + 1
+    self.residual = domain.integral(conductivity * (basis.grad(geom) * u.grad(geom)).sum(-1) - basis * function.Argument('load', ()), geometry=geom, degree=4)
+    self.cons = domain.boundary['left,right'].project(0, onto=basis, geometry=geom, ischeme='gauss4')
+
+  def fullsolve(self, **parameters):
+    arguments = {name: numpy.array(value) for name, value in parameters.items()}
+    return solver.solve_linear('dofs', self.residual, constrain=self.cons, arguments=arguments)
+
+  def test_affine(self):
+    components = self.residual.affine(['kappa', 'load'])
+    self.assertEqual(set(components), {None, 'kappa', 'load'})
+    for integral in components.values():
+      self.assertFalse(integral.contains('kappa') or integral.contains('load'))
+
+  def test_notaffine(self):
+    with self.assertRaises(solver.ModelError):
+      (self.residual * 2).replace({'load': function.Argument('kappa', ())**2}).affine(['kappa'])
+
+  def test_reduced(self):
+    rom = solver.ROM('dofs', self.residual, ['kappa', 'load'], constrain=self.cons)
+    for kappa in 0, 1, 10:
+      for load in 1, 2:
+        numpy.testing.assert_almost_equal(rom.snapshot(kappa=kappa, load=load), self.fullsolve(kappa=kappa, load=load), decimal=12)
+    rom.build()
+    self.assertLessEqual(rom.basis.shape[1], 3)
+    lhs = rom.solve(kappa=3, load=1.5)
+    self.assertLess(rom.errorindicator(lhs, kappa=3, load=1.5), 1e-2)
+    numpy.testing.assert_allclose(lhs, self.fullsolve(kappa=3, load=1.5), atol=1e-3)
+
+
+class ensemble(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    domain, geom = mesh.rectilinear([numpy.linspace(0,1,5)]*2)
+    basis = domain.basis('spline', degree=2)
+    u = basis.dot(function.Argument('dofs', [len(basis)]))
+    self.residual = domain.integral((basis.grad(geom) * u.grad(geom)).sum(-1) * (1 + u**2) + basis * function.Argument('load', ()), geometry=geom, degree=4) \
+                  + domain.boundary['top'].integral(basis * u, geometry=geom, degree=4)
+    self.jacobian = self.residual.derivative('dofs')
+    self.energy = domain.integral(u**2, geometry=geom, degree=4)
+    self.dofs = numpy.sin(numpy.arange(4*len(basis))).reshape(4, len(basis))
+    self.load = numpy.arange(4.)
+
+  def test_eval(self):
+    res, jac, energy = solver.Integral.multieval(self.residual, self.jacobian, self.energy, arguments=dict(dofs=self.dofs, load=self.load), ensemble=True)
+    self.assertEqual(res.shape, self.dofs.shape)
+    self.assertEqual(energy.shape, self.load.shape)
+    self.assertEqual(len(jac), len(self.dofs))
+    for i, (dofs, load) in enumerate(zip(self.dofs, self.load)):
+      resi, jaci, energyi = solver.Integral.multieval(self.residual, self.jacobian, self.energy, arguments=dict(dofs=dofs, load=numpy.array(load)))
+      numpy.testing.assert_almost_equal(res[i], resi, decimal=13)
+      numpy.testing.assert_almost_equal(jac[i].toarray(), jaci.toarray(), decimal=13)
+      numpy.testing.assert_almost_equal(energy[i], energyi, decimal=13)
+
+  def test_sharedpattern(self):
+    jac = self.jacobian.eval(arguments=dict(dofs=self.dofs, load=self.load), ensemble=True)
+    self.assertTrue(all(numpy.array_equal(jac[0].core.indices, jaci.core.indices) and numpy.array_equal(jac[0].core.indptr, jaci.core.indptr) for jaci in jac))
+
+  def test_invalid(self):
+    with self.assertRaisesRegex(AssertionError, 'requires arguments'):
+      self.energy.eval(ensemble=True)
+    with self.assertRaisesRegex(AssertionError, 'dofs=4, load=3'):
+      self.energy.eval(arguments=dict(dofs=self.dofs, load=self.load[:3]), ensemble=True)
+
+
+class eigen(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    domain, geom = mesh.rectilinear([numpy.linspace(0,numpy.pi,17)]*2)
+    basis = domain.basis('spline', degree=2)
+    self.stiffness = domain.integral(function.outer(basis.grad(geom)).sum(-1), geometry=geom, degree=4)
+    self.mass = domain.integral(function.outer(basis), geometry=geom, degree=4)
+    self.cons = domain.boundary.project(0, onto=basis, geometry=geom, ischeme='gauss4')
+    self.exact = numpy.sort([i**2+j**2 for i in range(1,6) for j in range(1,6)])
+
+  def test_modes(self):
+    eigvals, eigvecs = solver.eigen(self.stiffness, self.mass, nmodes=6, constrain=self.cons)
+    numpy.testing.assert_allclose(eigvals, self.exact[:6], rtol=1e-3)
+    self.assertTrue((eigvecs[:,self.cons.where] == 0).all())
+    K, M = solver.Integral.multieval(self.stiffness, self.mass)
+    for w, v in zip(eigvals, eigvecs):
+      numpy.testing.assert_almost_equal(K.matvec(v)[~self.cons.where], w * M.matvec(v)[~self.cons.where], decimal=8)
+
+  def test_batches(self):
+    eigvals, eigvecs = solver.eigen(self.stiffness, self.mass, nmodes=12, batchsize=4, constrain=self.cons)
+    numpy.testing.assert_allclose(eigvals, self.exact[:12], rtol=1e-3)
+    M = self.mass.eval()
+    numpy.testing.assert_almost_equal(eigvecs.dot(M.toarray()).dot(eigvecs.T), numpy.eye(12), decimal=8)
+
+  def test_shifts(self):
+    K, M = solver.Integral.multieval(self.stiffness, self.mass)
+    eigvals, eigvecs = solver.eigen(K, M, nmodes=12, batchsize=4, constrain=self.cons)
+    numpy.testing.assert_allclose(eigvals, self.exact[:12], rtol=1e-3)
+    shifts = sorted(shift for shift, free in K._shiftinverts)
+    self.assertGreater(len(shifts), 1) # later batches are needed
+    for shift in shifts[1:]:
+      self.assertGreater(abs(eigvals - shift).min(), .1) # shifts do not coincide with eigenvalues
+
+  def test_cached(self):
+    K, M = solver.Integral.multieval(self.stiffness, self.mass)
+    eigvals, eigvecs = solver.eigen(K, M, nmodes=6, batchsize=3, constrain=self.cons)
+    ncached = len(K._shiftinverts)
+    self.assertGreater(ncached, 0)
+    numpy.testing.assert_allclose(solver.eigen(K, M, nmodes=6, batchsize=3, constrain=self.cons)[0], eigvals, rtol=1e-10)
+    self.assertEqual(len(K._shiftinverts), ncached)
+
+
+class continuation(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    domain, geom = mesh.rectilinear([numpy.linspace(0,1,17)])
+    basis = domain.basis('spline', degree=2)
+    u = basis.dot(function.Argument('dofs', [len(basis)]))
+    lam = function.Argument('lambda', ())
+    # bratu problem -u'' = lambda exp(u), with a limit point at lambda = 3.5138
+    self.residual = domain.integral(basis.grad(geom)[:,0] * u.grad(geom)[0] - basis * lam * function.exp(u), geometry=geom, degree=6)
+    self.cons = domain.boundary.project(0, onto=basis, geometry=geom, ischeme='gauss1')
+    self.lhs0 = numpy.zeros(len(basis))
+
+  def test_limitpoint(self):
+    params = []
+    for p, lhs in solver.continuation('dofs', self.residual, 'lambda', self.lhs0, 0, steplength=.5, constrain=self.cons):
+      params.append(p)
+      res = self.residual.eval(arguments=dict(dofs=lhs, **{'lambda': numpy.array(p)}))
+      self.assertLess(numpy.linalg.norm(res[numpy.isnan(self.cons)]), 1e-10)
+      numpy.testing.assert_equal(lhs[~numpy.isnan(self.cons)], 0)
+      if p < 3 and max(params) > 3.4:
+        break
+    else:
+      self.fail('continuation ended')
+    self.assertAlmostEqual(max(params), 3.5138, places=2)
+    self.assertGreater(lhs.max(), 1.5) # upper branch
+
+  def test_reverse(self):
+    gen = solver.continuation('dofs', self.residual, 'lambda', self.lhs0, 1, steplength=-.2, constrain=self.cons)
+    params = [p for i, (p, lhs) in zip(range(5), gen)]
+    self.assertTrue((numpy.diff(params) < 0).all())
+
+
+class withsolve(TestCase):
+
+  def test_plain(self):
+    @solver.withsolve
+    def halve(lhs0):
+      lhs = lhs0
+      while True:
+        yield lhs, numpy.linalg.norm(lhs)
+        lhs = lhs / 2
+    iterator = halve(numpy.ones(2))
+    self.assertIsNone(iterator.telemetry)
+    numpy.testing.assert_array_less(numpy.abs(iterator.solve(tol=1e-3)), 1e-3)
+
+  def test_telemetry(self):
+    @solver.withsolve
+    def halve(lhs0, *, telemetry=None):
+      lhs = lhs0
+      while True:
+        telemetry.record(resnorm=numpy.linalg.norm(lhs))
+        yield lhs, numpy.linalg.norm(lhs)
+        lhs = lhs / 2
+    iterator = halve(numpy.ones(2))
+    iterator.solve(tol=1e-3)
+    self.assertEqual(iterator.telemetry.niter, 12)
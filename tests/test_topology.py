@@ -1,6 +1,6 @@
 from nutils import *
 from . import *
-import numpy, copy, sys, pickle, subprocess, base64, itertools
+import numpy, copy, sys, pickle, subprocess, base64, itertools, tempfile, os
 
 grid = numpy.linspace( 0., 1., 4 )
 
@@ -464,3 +464,107 @@ class multipatch_L(TestCase):
     for ipatch in range(3):
       vals = self.domain['patch{}'.format(ipatch)].elem_eval(patch_index, ischeme='gauss1')
       numpy.testing.assert_array_almost_equal(vals, ipatch)
+
+
+class project(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.domain, self.geom = mesh.rectilinear([4,4])
+    self.basis = self.domain.basis('spline', degree=2)
+
+  def test_arrayvalued(self):
+    fun = function.stack([self.geom[0], self.geom[1]**2, 1])
+    coeffs = self.domain.project(fun, onto=self.basis, geometry=self.geom, ischeme='gauss4')
+    self.assertEqual(coeffs.shape, (len(self.basis), 3))
+    for i in range(3):
+      numpy.testing.assert_array_almost_equal(coeffs[:,i], self.domain.project(fun[i], onto=self.basis, geometry=self.geom, ischeme='gauss4'))
+
+  def test_arrayvalued_constrained(self):
+    fun = function.stack([self.geom[0], 1])
+    cons = self.domain.boundary['left'].project(fun, onto=self.basis, geometry=self.geom, ischeme='gauss4')
+    coeffs = self.domain.project(fun, onto=self.basis, geometry=self.geom, ischeme='gauss4', constrain=cons)
+    numpy.testing.assert_array_almost_equal(coeffs[:,1], 1)
+
+class treecache(ContextTestCase):
+
+  def setUpContext(self, stack):
+    super().setUpContext(stack)
+    self.cachedir = stack.enter_context(tempfile.TemporaryDirectory())
+    self.domain, self.geom = mesh.rectilinear([4,4])
+    self.basis = self.domain.basis('spline', degree=2)
+
+  def integrate(self):
+    __treecache__ = True
+    __cachedir__ = self.cachedir
+    integrand = function.outer(self.basis.grad(self.geom)).sum(-1)
+    return self.domain.integrate([integrand, self.basis], geometry=self.geom, ischeme='gauss4')
+
+  def test_reuse(self):
+    A, b = self.integrate()
+    path = os.path.join(self.cachedir, 'integrationplans')
+    files = os.listdir(path)
+    self.assertEqual(len(files), 1)
+    A_, b_ = self.integrate()
+    self.assertEqual(os.listdir(path), files)
+    numpy.testing.assert_array_equal(A_.toarray(), A.toarray())
+    numpy.testing.assert_array_equal(b_, b)
+
+  def test_corrupt(self):
+    A, b = self.integrate()
+    path = os.path.join(self.cachedir, 'integrationplans')
+    filename, = os.listdir(path)
+    with open(os.path.join(path, filename), 'wb') as f:
+      f.write(b'corrupt')
+    A_, b_ = self.integrate()
+    numpy.testing.assert_array_equal(b_, b)
+
+
+class topocache(ContextTestCase):
+
+  def setUpContext(self, stack):
+    super().setUpContext(stack)
+    self.cachedir = stack.enter_context(tempfile.TemporaryDirectory())
+    self.path = os.path.join(self.cachedir, 'topologies')
+
+  def build(self):
+    __topocache__ = True
+    __cachedir__ = self.cachedir
+    domain, geom = mesh.multipatch(patches=[[0,1,2,3],[2,3,4,5]], patchverts=[[0,0],[0,1],[1,0],[1,1],[2,0],[2,1]], nelems=2)
+    basis = domain.basis('spline', degree=2)
+    trimmed = domain.trim(geom[0]-.75, maxrefine=2)
+    hierarchical = domain.refined_by(domain.elements[:2])
+    return domain, geom, basis, trimmed, hierarchical, hierarchical.basis('spline', degree=2)
+
+  def test_reuse(self):
+    domain, geom, basis, trimmed, hierarchical, hbasis = self.build()
+    self.assertIsNotNone(domain._persistkey)
+    files = sorted(os.listdir(self.path))
+    self.assertEqual(len(files), 5)
+    domain_, geom_, basis_, trimmed_, hierarchical_, hbasis_ = self.build()
+    self.assertEqual(sorted(os.listdir(self.path)), files)
+    self.assertEqual(domain_._persistkey, domain._persistkey)
+    self.assertIs(geom_, geom)
+    self.assertIs(basis_, basis)
+    self.assertIs(hbasis_, hbasis)
+    self.assertEqual(len(trimmed_), len(trimmed))
+    numpy.testing.assert_almost_equal(trimmed_.integrate(1, geometry=geom_, ischeme='gauss1'), 1.25)
+
+  def test_delegated(self):
+    domain, geom, basis, trimmed, hierarchical, hbasis = self.build()
+    files = sorted(os.listdir(self.path))
+    __topocache__ = True
+    __cachedir__ = self.cachedir
+    trimmed.basis('spline', degree=2)
+    self.assertEqual(sorted(os.listdir(self.path)), files) # stored only at the base topology
+
+  def test_unkeyed(self):
+    __topocache__ = True
+    __cachedir__ = self.cachedir
+    domain, geom = mesh.rectilinear([2,2])
+    domain.basis('spline', degree=2)
+    self.assertFalse(os.path.exists(self.path))
+
+  def test_disabled(self):
+    domain, geom = mesh.multipatch(patches=[[0,1,2,3]], patchverts=[[0,0],[0,1],[1,0],[1,1]], nelems=2)
+    self.assertIsNone(domain._persistkey)